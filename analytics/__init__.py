@@ -0,0 +1,2 @@
+# __init__.py for analytics package
+"""Log consolidation and analytics package for RALPh."""
\ No newline at end of file
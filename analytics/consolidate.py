@@ -0,0 +1,440 @@
+"""
+Incremental consolidation of RALPh structured logs into a queryable SQLite database.
+
+Only new or changed log files are ingested: append-only JSONL segments are read from
+the byte offset reached by the previous run, and legacy JSON logs are re-read only when
+their size or modification time changes.
+
+Usage:
+    python -m analytics.consolidate [--log-dir logging/logs] [--db logging/logs/consolidated_logs.sqlite3]
+"""
+
+import os
+import csv
+import json
+import sqlite3
+import argparse
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from config import LOG_DIR, LOG_DB_PATH
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    offset INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS turns (
+    conversation_id TEXT NOT NULL,
+    convo_number INTEGER NOT NULL,
+    turn_number INTEGER NOT NULL,
+    timestamp TEXT,
+    user_input TEXT,
+    verification_done INTEGER,
+    kb_search_input TEXT,
+    kb_retrieval TEXT,
+    kb_top_score REAL,
+    kb_tokens_original INTEGER,
+    kb_tokens_compressed INTEGER,
+    intermediate_output TEXT,
+    final_response TEXT,
+    final_response_timestamp TEXT,
+    process_message_duration REAL,
+    total_query_duration REAL,
+    source TEXT,
+    PRIMARY KEY (conversation_id, convo_number, turn_number)
+);
+CREATE INDEX IF NOT EXISTS idx_turns_conversation_id ON turns (conversation_id);
+CREATE INDEX IF NOT EXISTS idx_turns_timestamp ON turns (timestamp);
+
+CREATE TABLE IF NOT EXISTS kb_results (
+    conversation_id TEXT NOT NULL,
+    convo_number INTEGER NOT NULL,
+    turn_number INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    score REAL,
+    source TEXT,
+    drug TEXT,
+    section TEXT,
+    PRIMARY KEY (conversation_id, convo_number, turn_number, rank)
+);
+
+CREATE TABLE IF NOT EXISTS stage_timings (
+    conversation_id TEXT NOT NULL,
+    convo_number INTEGER NOT NULL,
+    turn_number INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    model TEXT,
+    duration REAL,
+    PRIMARY KEY (conversation_id, convo_number, turn_number, stage)
+);
+
+CREATE TABLE IF NOT EXISTS stage_usage (
+    conversation_id TEXT,
+    convo_number INTEGER,
+    turn_number INTEGER,
+    stage TEXT NOT NULL,
+    model TEXT,
+    timestamp TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost_usd REAL,
+    history_trimmed INTEGER,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_stage_usage_turn ON stage_usage (conversation_id, convo_number, turn_number);
+CREATE INDEX IF NOT EXISTS idx_stage_usage_timestamp ON stage_usage (timestamp);
+
+CREATE TABLE IF NOT EXISTS events (
+    conversation_id TEXT,
+    event TEXT NOT NULL,
+    timestamp TEXT,
+    payload TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_conversation_id ON events (conversation_id);
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_event ON events (event);
+"""
+
+# Columns of the turns table filled from "final_response" events
+FINAL_RESPONSE_COLUMNS = ["final_response", "final_response_timestamp", "total_query_duration"]
+
+
+def connect(db_path=LOG_DB_PATH):
+    """
+    Open the consolidated log database, creating the schema if needed.
+
+    Args:
+        db_path (str): Path of the SQLite database
+
+    Returns:
+        sqlite3.Connection: Database connection
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_log_file(path, offset=0):
+    """
+    Parse the log events of a file.
+
+    JSONL segments are read from the given byte offset up to the last complete line;
+    legacy JSON logs (a list of turns, rewritten on every update) are always read whole.
+
+    Args:
+        path (str): Log file path
+        offset (int): Byte offset already ingested (JSONL only)
+
+    Returns:
+        tuple: (events, new_offset)
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return [], 0
+        if not isinstance(data, list):
+            return [], 0
+
+        # Legacy entries hold the interaction and its final response in one record
+        events = []
+        for entry in data:
+            events.append(dict(entry, event="interaction"))
+            if entry.get("final_response") is not None:
+                events.append(dict(entry, event="final_response"))
+        return events, os.path.getsize(path)
+
+    events = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+    # Leave a partially written last line for the next run
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return events, offset + end
+
+
+def _parse_job(job):
+    """Worker entry point for parallel parsing."""
+    path, offset = job
+    events, new_offset = parse_log_file(path, offset)
+    return path, events, new_offset
+
+
+def _parse_in_order(executor, jobs, window):
+    """
+    Parse files in parallel and yield their results in job order.
+
+    At most `window` files are submitted ahead of the one being consumed, so the parsed
+    events held in memory stay bounded however many files there are.
+
+    Args:
+        executor (ProcessPoolExecutor): Parser processes
+        jobs (list): (path, offset) per file
+        window (int): Maximum number of files parsed ahead
+
+    Yields:
+        tuple: (path, events, new offset) per file
+    """
+    jobs = iter(jobs)
+    pending = deque(executor.submit(_parse_job, job) for job in islice(jobs, window))
+    while pending:
+        result = pending.popleft().result()
+        job = next(jobs, None)
+        if job is not None:
+            pending.append(executor.submit(_parse_job, job))
+        yield result
+
+
+def _kb_scores(event):
+    """
+    Cosine distances of a turn's KB results (None for chunks that were not scored).
+
+    Section index lookups are not scored; older logs recorded a placeholder distance
+    of 0 for them, which is dropped here.
+    """
+    scores = (event.get("kb_results") or {}).get("scores") or []
+    if (event.get("kb_context") or {}).get("retrieval") == "section_index":
+        return [None] * len(scores)
+    return scores
+
+
+def _interaction_row(event, source):
+    """Flatten an interaction event into turns table values."""
+    scores = [s for s in _kb_scores(event) if s is not None]
+    kb_context = event.get("kb_context") or {}
+    verification_done = event.get("verification_done")
+
+    return {
+        "timestamp": event.get("timestamp"),
+        "user_input": event.get("user_input"),
+        "verification_done": None if verification_done is None else int(bool(verification_done)),
+        "kb_search_input": event.get("kb_search_input"),
+        "kb_retrieval": kb_context.get("retrieval"),
+        "kb_top_score": min(scores) if scores else None,  # cosine distance: lower is better
+        "kb_tokens_original": kb_context.get("tokens_original"),
+        "kb_tokens_compressed": kb_context.get("tokens_compressed"),
+        "intermediate_output": event.get("intermediate_output"),
+        "process_message_duration": event.get("process_message_duration"),
+        "source": source,
+    }
+
+
+def _upsert_turn(connection, key, values):
+    """Insert a turn or update the given columns of an existing turn."""
+    columns = list(values)
+    connection.execute(
+        f"""
+        INSERT INTO turns (conversation_id, convo_number, turn_number, {", ".join(columns)})
+        VALUES (?, ?, ?, {", ".join("?" for _ in columns)})
+        ON CONFLICT (conversation_id, convo_number, turn_number)
+        DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in columns)}
+        """,
+        [*key, *(values[c] for c in columns)]
+    )
+
+
+def _store_kb_results(connection, key, event):
+    """Store one row per retrieved chunk of a turn."""
+    kb_results = event.get("kb_results") or {}
+    metadata_list = kb_results.get("metadata") or []
+    score_list = _kb_scores(event)
+
+    connection.execute(
+        "DELETE FROM kb_results WHERE conversation_id = ? AND convo_number = ? AND turn_number = ?", key
+    )
+    connection.executemany(
+        "INSERT INTO kb_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (*key, rank, score, (metadata or {}).get("source"), (metadata or {}).get("drug"), (metadata or {}).get("section"))
+            for rank, (metadata, score) in enumerate(zip(metadata_list, score_list))
+        ]
+    )
+
+
+def _store_stage_timings(connection, key, event):
+    """Store one row per timed pipeline stage of a turn."""
+    connection.execute(
+        "DELETE FROM stage_timings WHERE conversation_id = ? AND convo_number = ? AND turn_number = ?", key
+    )
+    connection.executemany(
+        "INSERT OR REPLACE INTO stage_timings VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (*key, timing.get("stage"), timing.get("model"), timing.get("duration"))
+            for timing in event.get("stage_timings") or []
+        ]
+    )
+
+
+def _usage_row(key, usage, timestamp, source):
+    """Flatten the token usage of a model call into stage_usage table values."""
+    return (
+        *key, usage.get("stage"), usage.get("model"), timestamp, usage.get("prompt_tokens"),
+        usage.get("completion_tokens"), usage.get("cost_usd"), usage.get("history_trimmed"), source
+    )
+
+
+def _store_stage_usage(connection, key, event, source):
+    """Store one row per model call of a turn that reported token usage."""
+    connection.execute(
+        "DELETE FROM stage_usage WHERE conversation_id = ? AND convo_number = ? AND turn_number = ?", key
+    )
+    connection.executemany(
+        "INSERT INTO stage_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            _usage_row(key, timing, event.get("timestamp"), source)
+            for timing in event.get("stage_timings") or []
+            if timing.get("prompt_tokens") is not None
+        ]
+    )
+
+
+def store_events(connection, events, source):
+    """
+    Store parsed log events.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        events (list): Parsed events
+        source (str): Log file name the events came from
+    """
+    for event in events:
+        event_type = event.get("event", "interaction")
+        key = (event.get("conversation_id"), event.get("convo_number"), event.get("turn_number"))
+
+        if event_type == "interaction" and None not in key:
+            _upsert_turn(connection, key, _interaction_row(event, source))
+            _store_kb_results(connection, key, event)
+            _store_stage_timings(connection, key, event)
+            _store_stage_usage(connection, key, event, source)
+        elif event_type == "llm_usage":
+            # Model calls outside a turn, e.g. report summaries
+            connection.execute(
+                "INSERT INTO stage_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                _usage_row(key, event, event.get("timestamp"), source)
+            )
+        elif event_type == "final_response" and None not in key:
+            _upsert_turn(connection, key, {c: event.get(c) for c in FINAL_RESPONSE_COLUMNS})
+        else:
+            payload = {k: v for k, v in event.items() if k not in ("event", "conversation_id", "timestamp")}
+            connection.execute(
+                "INSERT INTO events VALUES (?, ?, ?, ?, ?)",
+                (event.get("conversation_id"), event_type, event.get("timestamp"),
+                 json.dumps(payload, ensure_ascii=False, default=str), source)
+            )
+
+
+def consolidate(log_dir=LOG_DIR, db_path=LOG_DB_PATH, workers=None):
+    """
+    Ingest new or changed log files into the consolidated database.
+
+    Args:
+        log_dir (str): Directory containing the structured logs
+        db_path (str): Path of the SQLite database
+        workers (int): Number of parser processes (defaults to the CPU count)
+
+    Returns:
+        dict: {"files": files ingested, "events": events ingested}
+    """
+    connection = connect(db_path)
+    watermarks = {
+        path: (size, mtime, offset)
+        for path, size, mtime, offset in connection.execute("SELECT path, size, mtime, offset FROM ingested_files")
+    }
+
+    # Find files that are new or changed since the last run
+    jobs = []
+    stats = {}
+    for name in sorted(os.listdir(log_dir)):
+        if not (name.endswith(".jsonl") or name.endswith(".json")):
+            continue
+        path = os.path.join(log_dir, name)
+        stat = os.stat(path)
+        watermark = watermarks.get(name)
+        if watermark and watermark[0] == stat.st_size and watermark[1] == stat.st_mtime:
+            continue
+
+        # Append-only segments resume from the last offset unless they were truncated
+        offset = 0
+        if watermark and name.endswith(".jsonl") and stat.st_size >= watermark[2]:
+            offset = watermark[2]
+        jobs.append((path, offset))
+        stats[path] = stat
+
+    # Parse files in parallel and apply them in file order, one transaction per file so
+    # that a file's events and its watermark are committed together
+    files = events_count = 0
+    if jobs:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, events, new_offset in _parse_in_order(executor, jobs, 2 * workers):
+                name = os.path.basename(path)
+                with connection:
+                    store_events(connection, events, name)
+                    connection.execute(
+                        "INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?, ?)",
+                        (name, stats[path].st_size, stats[path].st_mtime, new_offset)
+                    )
+                files += 1
+                events_count += len(events)
+
+    connection.close()
+    return {"files": files, "events": events_count}
+
+
+def export_csv(db_path, csv_path):
+    """
+    Export the consolidated turns as a flat CSV file.
+
+    Args:
+        db_path (str): Path of the SQLite database
+        csv_path (str): Output CSV path
+    """
+    connection = connect(db_path)
+    cursor = connection.execute("SELECT * FROM turns ORDER BY timestamp")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        writer.writerows(cursor)
+    connection.close()
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Consolidate RALPh structured logs into SQLite")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="Directory containing the structured logs")
+    parser.add_argument("--db", default=LOG_DB_PATH, help="Path of the consolidated SQLite database")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parser processes")
+    parser.add_argument("--csv", default=None, help="Also export the consolidated turns to this CSV file")
+    return parser.parse_args()
+
+
+def main():
+    """Run an incremental consolidation"""
+    args = parse_args()
+    result = consolidate(args.log_dir, args.db, args.workers)
+    print(f"Ingested {result['events']} events from {result['files']} new or changed files into '{args.db}'.")
+
+    if args.csv:
+        export_csv(args.db, args.csv)
+        print(f"Exported consolidated turns to '{args.csv}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Latency, retrieval quality and token usage report over the consolidated RALPh logs.
+
+Run `python -m analytics.consolidate` first to ingest the latest logs.
+
+Usage:
+    python -m analytics.report [--db logging/logs/consolidated_logs.sqlite3] [--since 2025-01-01] [--output report_dir]
+"""
+
+import os
+import re
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from config import LOG_DB_PATH, KB_LOW_CONFIDENCE_DISTANCE
+
+
+PERCENTILES = [0.5, 0.9, 0.95, 0.99]
+
+# KB top-score (cosine distance) histogram bins
+SCORE_BINS = [0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 1.0, np.inf]
+
+# kb_retrieval value of turns answered by the (drug, section) index instead of vector search
+SECTION_INDEX_RETRIEVAL = "section_index"
+
+
+def load_tables(db_path=LOG_DB_PATH, since=None, until=None):
+    """
+    Load the consolidated turns, stage timings and token usage.
+
+    Args:
+        db_path (str): Path of the consolidated SQLite database
+        since (str): Only include turns at or after this ISO date
+        until (str): Only include turns before this ISO date
+
+    Returns:
+        tuple: (turns, stage_timings, stage_usage) DataFrames
+    """
+    conditions, params = [], []
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = sqlite3.connect(db_path)
+    turns = pd.read_sql_query(
+        f"""
+        SELECT conversation_id, convo_number, turn_number, timestamp, verification_done,
+               kb_retrieval, kb_top_score, process_message_duration, total_query_duration
+        FROM turns {where}
+        """,
+        connection,
+        params=params
+    )
+    stage_timings = pd.read_sql_query(
+        f"""
+        SELECT s.conversation_id, s.convo_number, s.turn_number, s.stage, s.model, s.duration, t.timestamp
+        FROM stage_timings s
+        JOIN turns t USING (conversation_id, convo_number, turn_number)
+        {where.replace("timestamp", "t.timestamp")}
+        """,
+        connection,
+        params=params
+    )
+    stage_usage = pd.read_sql_query(
+        f"""
+        SELECT conversation_id, convo_number, stage, model, timestamp, prompt_tokens, completion_tokens,
+               cost_usd, history_trimmed
+        FROM stage_usage {where}
+        """,
+        connection,
+        params=params
+    )
+    connection.close()
+
+    turns["day"] = pd.to_datetime(turns["timestamp"], errors="coerce").dt.date
+    stage_timings["day"] = pd.to_datetime(stage_timings["timestamp"], errors="coerce").dt.date
+    stage_usage["day"] = pd.to_datetime(stage_usage["timestamp"], errors="coerce").dt.date
+    return turns, stage_timings, stage_usage
+
+
+def _percentiles(grouped):
+    """Count and latency percentiles of a grouped duration series."""
+    if grouped.ngroups == 0:
+        return pd.DataFrame(columns=["count"] + [f"p{int(q * 100)}" for q in PERCENTILES])
+    result = grouped.quantile(PERCENTILES).unstack()
+    result.columns = [f"p{int(q * 100)}" for q in PERCENTILES]
+    result.insert(0, "count", grouped.count())
+    return result
+
+
+def latency_by_day(turns):
+    """Percentiles of the process_message and total query durations per day."""
+    return pd.concat(
+        {
+            "process_message": _percentiles(turns.groupby("day")["process_message_duration"]),
+            "total_query": _percentiles(turns.groupby("day")["total_query_duration"]),
+        },
+        axis=1
+    )
+
+
+def latency_by_stage(turns, stage_timings):
+    """
+    Percentiles of the stage durations per stage and model.
+
+    Response delivery (streaming to the UI and speech synthesis) is derived as the total
+    query duration minus the process_message duration.
+    """
+    delivery = turns.dropna(subset=["total_query_duration", "process_message_duration"])
+    delivery = pd.DataFrame({
+        "stage": "response_delivery",
+        "model": "-",
+        "duration": delivery["total_query_duration"] - delivery["process_message_duration"],
+    })
+    stages = pd.concat(
+        [stage_timings[["stage", "model", "duration"]].fillna({"model": "-"}), delivery],
+        ignore_index=True
+    )
+    return _percentiles(stages.groupby(["stage", "model"])["duration"])
+
+
+def _vector_search_turns(turns):
+    """
+    Counselling turns whose KB context came from vector search (turns answered by the
+    (drug, section) index have no score).
+    """
+    return turns.dropna(subset=["kb_top_score"])
+
+
+def kb_score_distribution(turns):
+    """
+    Distribution of the best (lowest distance) KB score per vector search turn, with the
+    section index lookups counted in their own row.
+    """
+    scores = _vector_search_turns(turns)["kb_top_score"]
+    histogram = pd.cut(scores, SCORE_BINS, right=False).value_counts(sort=False)
+    histogram.index = histogram.index.astype(str)
+    histogram[SECTION_INDEX_RETRIEVAL] = (turns["kb_retrieval"] == SECTION_INDEX_RETRIEVAL).sum()
+    return pd.DataFrame({
+        "turns": histogram,
+        "share": histogram / max(histogram.sum(), 1),
+    })
+
+
+def low_confidence_share(turns, threshold=KB_LOW_CONFIDENCE_DISTANCE):
+    """Share of vector search turns whose best KB result is further than the threshold, per day."""
+    retrieval_turns = _vector_search_turns(turns).assign(
+        low_confidence=lambda df: df["kb_top_score"] > threshold
+    )
+    grouped = retrieval_turns.groupby("day")["low_confidence"]
+    section_index_turns = turns.loc[turns["kb_retrieval"] == SECTION_INDEX_RETRIEVAL].groupby("day").size()
+    return pd.DataFrame({
+        "retrieval_turns": grouped.size(),
+        "low_confidence_share": grouped.mean(),
+        "section_index_turns": section_index_turns,
+    }).fillna({"retrieval_turns": 0, "section_index_turns": 0}).astype(
+        {"retrieval_turns": int, "section_index_turns": int}
+    )
+
+
+def summarization_frequency(turns, stage_timings):
+    """Share of turns that triggered a chat history summarization, per day."""
+    summarized = stage_timings.loc[stage_timings["stage"] == "summarize_history"].groupby("day").size()
+    total = turns.groupby("day").size()
+    return pd.DataFrame({
+        "turns": total,
+        "summarizations": summarized.reindex(total.index, fill_value=0),
+        "share": summarized.reindex(total.index, fill_value=0) / total,
+    })
+
+
+def slowest_conversations(turns, top=10):
+    """Conversations with the highest total query time."""
+    grouped = turns.groupby(["conversation_id", "convo_number"])["total_query_duration"]
+    result = pd.DataFrame({
+        "turns": grouped.size(),
+        "total_seconds": grouped.sum(),
+        "mean_seconds": grouped.mean(),
+        "max_seconds": grouped.max(),
+    })
+    return result.sort_values("total_seconds", ascending=False).head(top)
+
+
+def token_usage_by_day(stage_usage):
+    """Prompt and completion tokens and cost per day and stage."""
+    grouped = stage_usage.fillna({"model": "-"}).groupby(["day", "stage", "model"])
+    return pd.DataFrame({
+        "calls": grouped.size(),
+        "prompt_tokens": grouped["prompt_tokens"].sum(),
+        "completion_tokens": grouped["completion_tokens"].sum(),
+        "cost_usd": grouped["cost_usd"].sum(),
+        "history_trimmed": grouped["history_trimmed"].sum(),
+    })
+
+
+def costliest_conversations(stage_usage, top=10):
+    """
+    Conversations with the highest token cost.
+
+    Model calls logged without a conversation number (e.g. summaries made for a report
+    job) are kept, in a row of their own.
+    """
+    grouped = stage_usage.dropna(subset=["conversation_id"]).groupby(["conversation_id", "convo_number"], dropna=False)
+    result = pd.DataFrame({
+        "calls": grouped.size(),
+        "prompt_tokens": grouped["prompt_tokens"].sum(),
+        "completion_tokens": grouped["completion_tokens"].sum(),
+        "cost_usd": grouped["cost_usd"].sum(),
+    })
+    return result.sort_values("cost_usd", ascending=False).head(top)
+
+
+def build_report(db_path=LOG_DB_PATH, since=None, until=None, top=10, low_confidence=KB_LOW_CONFIDENCE_DISTANCE):
+    """
+    Build all report sections.
+
+    Args:
+        db_path (str): Path of the consolidated SQLite database
+        since (str): Only include turns at or after this ISO date
+        until (str): Only include turns before this ISO date
+        top (int): Number of slowest and costliest conversations to list
+        low_confidence (float): KB distance above which retrieval is low confidence
+
+    Returns:
+        dict: Section title -> DataFrame
+    """
+    turns, stage_timings, stage_usage = load_tables(db_path, since, until)
+    return {
+        "Latency percentiles by day (seconds)": latency_by_day(turns),
+        "Latency percentiles by stage and model (seconds)": latency_by_stage(turns, stage_timings),
+        "KB top-score distribution (cosine distance)": kb_score_distribution(turns),
+        f"Low retrieval confidence share (distance > {low_confidence})": low_confidence_share(turns, low_confidence),
+        "Chat history summarization frequency": summarization_frequency(turns, stage_timings),
+        f"Slowest {top} conversations": slowest_conversations(turns, top),
+        "Token usage and cost by day and stage": token_usage_by_day(stage_usage),
+        f"Costliest {top} conversations": costliest_conversations(stage_usage, top),
+    }
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="RALPh latency, retrieval quality and token usage report")
+    parser.add_argument("--db", default=LOG_DB_PATH, help="Path of the consolidated SQLite database")
+    parser.add_argument("--since", default=None, help="Only include turns at or after this ISO date")
+    parser.add_argument("--until", default=None, help="Only include turns before this ISO date")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest and costliest conversations to list")
+    parser.add_argument("--low-confidence", type=float, default=KB_LOW_CONFIDENCE_DISTANCE,
+                        help="KB distance above which retrieval is low confidence")
+    parser.add_argument("--output", default=None, help="Also write each section as a CSV file to this directory")
+    return parser.parse_args()
+
+
+def main():
+    """Print the report"""
+    args = parse_args()
+    report = build_report(args.db, args.since, args.until, args.top, args.low_confidence)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.precision", 3):
+        for title, table in report.items():
+            print(f"\n## {title}\n")
+            print(table.to_string() if not table.empty else "(no data)")
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for title, table in report.items():
+            file_name = re.sub(r"[^a-z0-9]+", "_", title.lower()).strip("_") + ".csv"
+            table.to_csv(os.path.join(args.output, file_name))
+        print(f"\nReport sections written to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
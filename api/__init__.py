@@ -0,0 +1,2 @@
+# __init__.py for api package
+"""HTTP and WebSocket API package for RALPh."""
\ No newline at end of file
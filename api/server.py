@@ -0,0 +1,264 @@
+"""
+Headless HTTP and WebSocket API for RALPh.
+
+Exposes session creation, message submission with token streaming (Server-Sent Events
+or WebSocket) and report requests on the same ChatSystem pipeline as the Gradio UI.
+The app can be served on its own or with the Gradio UI mounted next to it.
+
+Endpoints:
+    POST   /api/sessions                          Create a session (for a patient ID or patient details)
+    DELETE /api/sessions/{session_id}             Close a session
+    POST   /api/sessions/{session_id}/messages    Send a message, get the full response
+    POST   /api/sessions/{session_id}/stream      Send a message, stream the response (SSE)
+    WS     /api/sessions/{session_id}/ws          Send messages, stream the responses
+    POST   /api/sessions/{session_id}/report      Email a PDF summary of the session
+    GET    /api/reports/{job_id}                  Poll a report request
+    GET    /api/stats                             Live queue depth and wait times per stage
+    GET    /api/ready                             Readiness probe (503 while warming up)
+"""
+
+import json
+import threading
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from api.sessions import SessionManager, SessionLimitReached
+from chat.session_store import SessionConflict
+from config import REPORT_SUMMARY_PRECOMPUTE
+from patients.records import LocalRecordSource
+from utils.summary_cache import message_lines
+from utils.stage_scheduler import get_scheduler, StageBusy, STAGE_CHAT
+
+
+class SessionRequest(BaseModel):
+    patient_id: Optional[str] = None
+    patient_details: Optional[str] = None
+    prescription_details: Optional[str] = None
+
+
+class MessageRequest(BaseModel):
+    message: str
+
+
+class ReportRequest(BaseModel):
+    email: str
+
+
+def create_app(chat_system, report_jobs, summary_cache, warmup=None, sessions=None):
+    """
+    Create the API app.
+
+    Args:
+        chat_system (ChatSystem): Chat system whose models, knowledge base and logger are
+            shared by the API sessions
+        report_jobs (JobQueue): Report job queue (None if reports are disabled)
+        summary_cache (ReportSummaryCache): Cache of conversation summaries (None if reports are disabled)
+        warmup (WarmupOrchestrator): Start-up warm-up reported by the readiness probe (None if disabled)
+        sessions (SessionManager): Session manager, e.g. shared with the Gradio UI (a new one if None)
+
+    Returns:
+        FastAPI: The API app
+    """
+    app = FastAPI(title="RALPh API")
+    if sessions is None:
+        sessions = SessionManager(chat_system)
+    patient_records = LocalRecordSource()
+    scheduler = get_scheduler()
+
+    def get_session(session_id):
+        """Look up a session or fail with 404 or 503."""
+        try:
+            session = sessions.get(session_id)
+        except SessionLimitReached as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired session")
+        return session
+
+    def acquire(session):
+        """
+        Claim a session and a chat slot for one message, or fail with 409 or 503.
+
+        Returns:
+            callable: Frees the session and the chat slot; calls after the first do nothing
+        """
+        if not session.lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="A message is already being processed for this session")
+        try:
+            scheduler.acquire(STAGE_CHAT)
+        except (StageBusy, TimeoutError) as e:
+            session.lock.release()
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+        released = threading.Lock()
+
+        def release():
+            if released.acquire(blocking=False):
+                scheduler.release(STAGE_CHAT)
+                session.lock.release()
+
+        return release
+
+    def complete_turn(session, full_response):
+        """Save the session state, log the final response and refresh the report summary."""
+        try:
+            sessions.save_turn(session)
+        except SessionConflict as e:
+            # The reply has been sent already: keep it, as the Gradio interface does
+            session.chat_system.logger.log_event("session_save_conflict", error=repr(e))
+        session.chat_system.logger.update_final_response(full_response)
+        if summary_cache and REPORT_SUMMARY_PRECOMPUTE and session.chat_system.status_verified:
+            summary_cache.precompute(
+                message_lines(session.chat_system.chat_memory),
+                session.chat_system.prescription_details,
+                session.chat_system.logger,
+                session.chat_system.convo_number
+            )
+
+    def stream_turn(session, message, release):
+        """Stream the response chunks of a turn claimed with acquire, then release the claim."""
+        full_response = ""
+        try:
+            for chunk in session.chat_system.process_message_stream(message):
+                full_response += chunk
+                yield chunk
+            complete_turn(session, full_response)
+        except Exception:
+            # The state in memory may no longer match the store; reload it on the next turn
+            sessions.discard(session.session_id)
+            raise
+        finally:
+            release()
+
+    @app.post("/api/sessions")
+    def create_session(request: SessionRequest):
+        try:
+            if request.patient_id:
+                # Patient from the record source, instead of the details in the request
+                record = patient_records.get(request.patient_id)
+                if record is None:
+                    raise HTTPException(status_code=404, detail="Unknown patient")
+                session = sessions.create(record.patient_details, record.prescription_details, record)
+            else:
+                session = sessions.create(request.patient_details, request.prescription_details)
+        except SessionLimitReached as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        return {"session_id": session.session_id}
+
+    @app.delete("/api/sessions/{session_id}")
+    def delete_session(session_id: str):
+        if not sessions.delete(session_id):
+            raise HTTPException(status_code=404, detail="Unknown or expired session")
+        return {"deleted": True}
+
+    @app.post("/api/sessions/{session_id}/messages")
+    def send_message(session_id: str, request: MessageRequest):
+        session = get_session(session_id)
+        release = acquire(session)
+        response = "".join(stream_turn(session, request.message, release))
+        return {"response": response, "verified": session.chat_system.status_verified}
+
+    @app.post("/api/sessions/{session_id}/stream")
+    def stream_message(session_id: str, request: MessageRequest):
+        session = get_session(session_id)
+        release = acquire(session)
+
+        def events():
+            try:
+                for chunk in stream_turn(session, request.message, release):
+                    yield f"event: token\ndata: {json.dumps({'content': chunk})}\n\n"
+                yield f"event: done\ndata: {json.dumps({'verified': session.chat_system.status_verified})}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+        stream = events()
+
+        def finish():
+            # Runs once the response is over, also if the client left before the stream
+            # started (stream_turn never ran): stop the turn, free the session and the slot
+            stream.close()
+            release()
+
+        return StreamingResponse(stream, media_type="text/event-stream", background=BackgroundTask(finish))
+
+    @app.websocket("/api/sessions/{session_id}/ws")
+    async def message_socket(websocket: WebSocket, session_id: str):
+        try:
+            await run_in_threadpool(get_session, session_id)
+        except HTTPException:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+
+        try:
+            while True:
+                request = await websocket.receive_json()
+                try:
+                    # Look the session up again, it may have been reloaded after a failed turn
+                    session = await run_in_threadpool(get_session, session_id)
+                    release = await run_in_threadpool(acquire, session)
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    continue
+                turn = stream_turn(session, request["message"], release)
+                try:
+                    async for chunk in iterate_in_threadpool(turn):
+                        await websocket.send_json({"type": "token", "content": chunk})
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "detail": str(e)})
+                    continue
+                finally:
+                    # Also when the client has left mid-turn: stop the turn, free the session and the slot
+                    turn.close()
+                    release()
+                await websocket.send_json({"type": "done", "verified": session.chat_system.status_verified})
+        except WebSocketDisconnect:
+            pass
+
+    @app.post("/api/sessions/{session_id}/report")
+    def request_report(session_id: str, request: ReportRequest):
+        if report_jobs is None:
+            raise HTTPException(status_code=404, detail="Reports are disabled")
+        from utils.email_sender import is_valid_email
+        from utils.report_jobs import submit_report_job, describe_report_job
+
+        session = get_session(session_id)
+        if not is_valid_email(request.email):
+            raise HTTPException(status_code=422, detail="Invalid email address")
+        job_id = submit_report_job(
+            report_jobs,
+            session.chat_system.chat_memory,
+            session.chat_system.prescription_details,
+            request.email
+        )
+        job = report_jobs.get(job_id)
+        return {"job_id": job_id, "status": job["status"], "message": describe_report_job(job)}
+
+    @app.get("/api/reports/{job_id}")
+    def report_status(job_id: str):
+        if report_jobs is None:
+            raise HTTPException(status_code=404, detail="Reports are disabled")
+        from utils.report_jobs import describe_report_job
+
+        job = report_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown report")
+        return {"job_id": job_id, "status": job["status"], "message": describe_report_job(job)}
+
+    @app.get("/api/ready")
+    def ready():
+        if warmup is None:
+            return {"ready": True, "warm": None}
+        status = warmup.status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    @app.get("/api/stats")
+    def stats():
+        return {"scheduler": scheduler.stats(), "sessions": len(sessions), "report_jobs": report_jobs.stats() if report_jobs else None}
+
+    return app
@@ -0,0 +1,280 @@
+"""
+Chat sessions served by the RALPh API.
+
+Each session has its own ChatSystem state, while the language models, the knowledge
+base and the log sinks are shared with the main chat system. Session state is saved to
+the session store after every turn, so any worker can serve any session; each worker
+keeps the sessions it served recently in memory and only reads the store on a miss.
+
+If another worker saved a session since this worker loaded it, a finished turn is
+re-applied on top of the stored state rather than dropped, as the patient has already
+seen its reply.
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+from chat.system import ChatSystem
+from chat.session_store import create_session_store, serialize_state, deserialize_state, SessionConflict
+from config import API_MAX_SESSIONS, API_SESSION_IDLE_TIMEOUT, SESSION_STATE_TTL
+from utils.usage import empty_usage, add_usage
+
+
+# Seconds between purges of expired sessions from the store
+PURGE_INTERVAL = 300
+
+# Times a turn is re-applied on a newer stored state before giving up
+SAVE_TURN_ATTEMPTS = 3
+
+
+class SessionLimitReached(Exception):
+    """Raised when no more sessions can be held in memory."""
+
+
+class Session:
+    """
+    An API chat session.
+    """
+
+    def __init__(self, session_id, chat_system, version=None):
+        """
+        Initialize the session.
+
+        Args:
+            session_id (str): Session ID
+            chat_system (ChatSystem): Chat system holding the session state
+            version (int): Stored version the state is based on (None if not saved yet)
+        """
+        self.session_id = session_id
+        self.chat_system = chat_system
+        self.version = version
+        self.last_active = time.monotonic()
+
+        # A session processes one message at a time
+        self.lock = threading.Lock()
+
+
+class SessionManager:
+    """
+    Creates, looks up, saves and expires API chat sessions.
+    """
+
+    def __init__(self, base_chat_system, store=None, max_sessions=API_MAX_SESSIONS,
+                 idle_timeout=API_SESSION_IDLE_TIMEOUT, state_ttl=SESSION_STATE_TTL):
+        """
+        Initialize the session manager.
+
+        Args:
+            base_chat_system (ChatSystem): Chat system whose models, knowledge base and
+                logger are shared by all sessions
+            store (SessionStore): Session store (the configured store if None)
+            max_sessions (int): Maximum number of sessions held in memory
+            idle_timeout (float): Seconds after which an idle session is dropped from memory
+            state_ttl (float): Seconds after which an unused session is deleted from the store
+        """
+        self.base_chat_system = base_chat_system
+        self.store = store if store is not None else create_session_store()
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.state_ttl = state_ttl
+
+        # session ID -> Session, least recently active first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _new_chat_system(self, session_id, patient_details=None, prescription_details=None, patient_record=None):
+        """Create a chat system sharing the models, knowledge base and log sinks."""
+        base = self.base_chat_system
+        return ChatSystem(
+            chatllm=base.chatllm,
+            chatllm_large=base.chatllm_large,
+            summaryllm=base.summaryllm,
+            patient_details=patient_details or base.patient_details,
+            prescription_details=prescription_details or base.prescription_details,
+            memory_char_limit=base.memory_char_limit,
+            knowledge_base=base.knowledge_base,
+            logger=base.logger.fork(session_id),
+            patient_record=patient_record
+        )
+
+    def _evict(self):
+        """
+        Drop idle sessions from memory, and the least recently active one if memory is
+        full (lock must be held). Their state stays in the store.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        for session_id, session in list(self._sessions.items()):
+            if session.last_active >= cutoff:
+                break
+            if not session.lock.locked():
+                del self._sessions[session_id]
+
+        if len(self._sessions) >= self.max_sessions:
+            for session_id, session in self._sessions.items():
+                if not session.lock.locked():
+                    del self._sessions[session_id]
+                    return
+            raise SessionLimitReached(f"Session limit of {self.max_sessions} reached")
+
+    def _hold(self, session):
+        """Keep a session in memory."""
+        with self._lock:
+            self._evict()
+            self._sessions[session.session_id] = session
+
+    def create(self, patient_details=None, prescription_details=None, patient_record=None):
+        """
+        Create a session and save it to the store.
+
+        Args:
+            patient_details (str): Patient information (defaults to the main chat system's)
+            prescription_details (str): Prescription details (defaults to the main chat system's)
+            patient_record (PatientRecord): Parsed record of the patient, if already available
+
+        Returns:
+            Session: New session
+
+        Raises:
+            SessionLimitReached: If memory is full of busy sessions
+        """
+        # Delete expired sessions from the store now and then
+        now = time.monotonic()
+        if now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            self.store.purge(self.state_ttl)
+
+        session_id = uuid.uuid4().hex
+        session = Session(session_id, self._new_chat_system(session_id, patient_details, prescription_details, patient_record))
+        self._hold(session)
+        self.save(session)
+        return session
+
+    def get(self, session_id):
+        """
+        Look up a session in memory, or load it from the store, and mark it as active.
+
+        Args:
+            session_id (str): Session ID
+
+        Returns:
+            Session: The session, or None if unknown or expired
+
+        Raises:
+            SessionLimitReached: If the session must be loaded and memory is full of busy sessions
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return session
+
+        entry = self.store.load(session_id)
+        if entry is None:
+            return None
+        blob, version = entry
+        chat_system = self._new_chat_system(session_id)
+        chat_system.load_state(deserialize_state(blob))
+        session = Session(session_id, chat_system, version)
+
+        with self._lock:
+            # Another request may have loaded the session meanwhile
+            existing = self._sessions.get(session_id)
+            if existing is not None:
+                return existing
+        self._hold(session)
+        return session
+
+    def save(self, session):
+        """
+        Save a session's state after a turn.
+
+        Args:
+            session (Session): The session
+
+        Raises:
+            SessionConflict: If another worker saved the session since it was loaded; the
+                session is dropped from memory so that the next request reloads it
+        """
+        blob = serialize_state(session.chat_system.export_state())
+        try:
+            session.version = self.store.save(session.session_id, blob, session.version)
+        except SessionConflict:
+            self.discard(session.session_id)
+            raise
+
+    def save_turn(self, session):
+        """
+        Save a session's state after a turn.
+
+        If another worker saved the session since it was loaded, the stored state is
+        reloaded and the turn re-applied to it: the turn's question and reply are appended
+        to the stored history, and its counters and token usage added. The reply the
+        patient has already seen is kept, and no model call is repeated.
+
+        Args:
+            session (Session): The session (its lock must be held)
+
+        Raises:
+            SessionConflict: If the turn could not be saved after SAVE_TURN_ATTEMPTS; the
+                session is dropped from memory so that the next request reloads it
+        """
+        chat_system = session.chat_system
+        for attempt in range(SAVE_TURN_ATTEMPTS):
+            try:
+                session.version = self.store.save(
+                    session.session_id, serialize_state(chat_system.export_state()), session.version
+                )
+                return
+            except SessionConflict:
+                entry = self.store.load(session.session_id)
+                if entry is None or attempt == SAVE_TURN_ATTEMPTS - 1:
+                    self.discard(session.session_id)
+                    raise
+
+            # A turn appends the question and the reply to the history
+            turn = chat_system.export_state()
+            blob, session.version = entry
+            state = deserialize_state(blob)
+            state["messages"] = state["messages"] + turn["messages"][-2:]
+            state["status_verified"] = state["status_verified"] or turn["status_verified"]
+            state["turn_counter"] += 1
+            usage = add_usage(dict(state["token_usage"] or empty_usage()), chat_system.last_turn_usage)
+            usage["cost_usd"] = round(usage["cost_usd"], 6)
+            state["token_usage"] = usage
+            chat_system.load_state(state)
+
+    def discard(self, session_id):
+        """
+        Drop a session from memory, e.g. after a failed turn, so that it is reloaded from
+        the store on its next request.
+
+        Args:
+            session_id (str): Session ID
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def delete(self, session_id):
+        """
+        Close a session.
+
+        Args:
+            session_id (str): Session ID
+
+        Returns:
+            bool: False if the session was unknown
+        """
+        with self._lock:
+            held = self._sessions.pop(session_id, None) is not None
+        stored = self.store.load(session_id) is not None
+        self.store.delete(session_id)
+        return held or stored
+
+    def __len__(self):
+        """Number of sessions held in memory."""
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,2 @@
+# __init__.py for benchmarks package
+"""Performance benchmarks for RALPh."""
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Benchmark of RALPh's cold-start import cost.
+
+Imports each entry module in a fresh interpreter with `python -X importtime` and breaks
+the time down by top-level package, so slow or unexpected dependencies stand out.
+
+Usage:
+    python -m benchmarks.import_time [--modules main chat.system ...] [--runs 3] [--top 15]
+"""
+
+import sys
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+
+DEFAULT_MODULES = [
+    "main",
+    "config",
+    "chat.system",
+    "ui.gradio_interface",
+    "api.server",
+    "utils.speech",
+    "utils.report_jobs",
+]
+
+
+def import_once(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Args:
+        module (str): Module name
+
+    Returns:
+        tuple: (wall-clock seconds, -X importtime output, error message or None)
+    """
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    duration = time.perf_counter() - start_time
+
+    timings, errors = [], []
+    for line in result.stderr.splitlines():
+        (timings if line.startswith("import time:") else errors).append(line)
+    error = errors[-1] if result.returncode != 0 and errors else None
+    return duration, timings, error
+
+
+def package_self_times(timings):
+    """
+    Sum the self import time of every module by top-level package.
+
+    Args:
+        timings (list): -X importtime output lines
+
+    Returns:
+        dict: package -> self time in milliseconds
+    """
+    totals = defaultdict(float)
+    for line in timings[1:]:  # the first line is the header
+        self_us, _, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        totals[name.split(".")[0]] += int(self_us) / 1000
+    return totals
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark the import cost of RALPh entry modules")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per module (the median run is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed per module")
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark"""
+    args = parse_args()
+
+    for module in args.modules:
+        runs = sorted((import_once(module) for _ in range(args.runs)), key=lambda run: run[0])
+        duration, timings, error = runs[len(runs) // 2]
+
+        print(f"\n{module}: {duration * 1000:.0f} ms wall clock (interpreter start included)")
+        if error:
+            print(f"  import failed: {error}")
+
+        totals = package_self_times(timings)
+        for package, total in sorted(totals.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {package:<28} {total:9.1f} ms")
+        print(f"  {'(all packages)':<28} {sum(totals.values()):9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1035 @@
+"""
+Concurrent-user load and soak test for RALPh.
+
+Simulates patients running scripted conversations (verification, several questions,
+optional voice input/output and a PDF report request) and reports throughput, latency
+percentiles, error rates and memory (RSS) growth over time.
+
+Targets:
+    chat    One ChatSystem per simulated patient in this process, like an API session,
+            admitted by the stage scheduler, with reports sent through the report job queue
+    gradio  The Gradio UI's event handlers on one GradioInterface in this process, each
+            simulated patient being a browser session of it
+    api     The HTTP API served by this process, driven over HTTP
+    http    An already running RALPh API (python main.py --api), driven over HTTP
+
+The chat, gradio and api targets use stand-in models, knowledge base, speech and email
+with configurable latencies, so they call no external services and measure RALPh's own
+overhead and limits. The http target uses whatever backends the server is configured
+with; pass --server-pid to follow the server's memory. Voice turns are only simulated
+on the chat and gradio targets, as the API takes text.
+
+The capacity measured by the chat, api and http targets is that of the API. The gradio
+target measures the UI's own path (sessions, handlers, scheduler and report polling),
+but not Gradio's event queue and transport, so the UI's capacity is also bounded by
+GRADIO_QUEUE_MAX_SIZE and the queue's concurrency limit.
+
+Load profiles are stages of "users:seconds": the number of active users moves linearly
+to each stage's target over the stage. Users repeat conversations until the run ends.
+
+Usage:
+    python -m benchmarks.load_test [--target chat|gradio|api|http] [--url http://127.0.0.1:7860]
+        [--profile smoke|ramp|soak | --stages 10:60,50:120,50:600] [--interval 10]
+        [--output results_dir]
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import itertools
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+
+# Stages of (active users, seconds) of the built-in profiles
+PROFILES = {
+    "smoke": [(5, 10), (5, 50)],
+    "ramp": [(50, 300), (50, 300)],
+    "soak": [(20, 60), (20, 7200)],
+}
+
+# Questions asked by the simulated patients after verification
+QUESTIONS = [
+    "What is empagliflozin for?",
+    "What are the side effects of empagliflozin?",
+    "Can I take atorvastatin with grapefruit juice?",
+    "How should I store my medicines?",
+    "What should I do if I miss a dose of atorvastatin?",
+    "Can I drink alcohol with my medications?",
+    "Why do I need to take atorvastatin in the morning?",
+    "Is it safe to take empagliflozin when I am fasting?",
+    "What should I do if I feel dizzy after taking my medicine?",
+    "Can I take paracetamol together with my medications?",
+]
+
+# Stand-in model responses
+VERIFIED_REPLY = "Verified. Thank you for confirming your details. How can I help you with your medications today?"
+TOPIC_REPLY = (
+    "Drug: Empagliflozin 25mg tablet; \nTopic: 'Side effects and management'; \n"
+    "Answer: Empagliflozin can cause genital infections and dehydration."
+)
+COUNSELLING_SENTENCE = (
+    "Empagliflozin helps your kidneys remove sugar through the urine, so drink enough water "
+    "and let your doctor know if you feel dizzy or notice signs of an infection. "
+)
+SUMMARY_REPLY = (
+    "Patient verified and counselled on empagliflozin and atorvastatin: purpose, side effects, "
+    "storage and missed doses. No new concerns were raised."
+)
+
+REPORT_EMAIL = "loadtest@example.com"
+REPORT_TIMEOUT = 120
+TERMINAL_JOB_STATUSES = ("succeeded", "failed")
+
+# Latency samples kept per operation for the overall percentiles
+RESERVOIR_SIZE = 50000
+
+
+def percentiles(samples, quantiles=(0.5, 0.9, 0.95, 0.99)):
+    """
+    Nearest-rank percentiles of a sample list.
+
+    Args:
+        samples (list): Values
+        quantiles (tuple): Quantiles between 0 and 1
+
+    Returns:
+        dict: "p50", "p90", ... -> value (None if there are no samples)
+    """
+    ordered = sorted(samples)
+    return {
+        f"p{int(q * 100)}": round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 3) if ordered else None
+        for q in quantiles
+    }
+
+
+def read_rss_mb(pid=None):
+    """
+    Resident memory of a process.
+
+    Args:
+        pid (int): Process ID (this process if None)
+
+    Returns:
+        float: RSS in MB, or None if it cannot be read on this platform
+    """
+    pid = pid or os.getpid()
+    try:
+        import psutil
+        return round(psutil.Process(pid).memory_info().rss / 2**20, 1)
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def parse_stages(text):
+    """
+    Parse a load profile.
+
+    Args:
+        text (str): "users:seconds" stages, comma separated
+
+    Returns:
+        list: (users, seconds) tuples
+    """
+    stages = []
+    for stage in text.split(","):
+        users, seconds = stage.split(":")
+        stages.append((int(users), float(seconds)))
+    return stages
+
+
+def users_at(stages, elapsed):
+    """
+    Number of active users of a load profile at a point in time.
+
+    Args:
+        stages (list): (users, seconds) tuples
+        elapsed (float): Seconds since the start of the run
+
+    Returns:
+        int: Active users, or None once the profile has ended
+    """
+    previous = 0
+    for users, seconds in stages:
+        if elapsed < seconds:
+            return round(previous + (users - previous) * elapsed / seconds)
+        elapsed -= seconds
+        previous = users
+    return None
+
+
+class StandInLatency:
+    """
+    Latencies of the stand-in backends, with random jitter.
+    """
+
+    def __init__(self, args):
+        """
+        Initialize the latencies from the command line arguments.
+
+        Args:
+            args (argparse.Namespace): Parsed arguments
+        """
+        self.first_token = args.first_token
+        self.token_delay = args.token_delay
+        self.response_tokens = args.response_tokens
+        self.kb = args.kb_latency
+        self.stt = args.stt_latency
+        self.tts = args.tts_latency
+        self.email = args.email_latency
+        self.jitter = args.jitter
+
+    def sleep(self, seconds):
+        """Sleep for about the given time."""
+        if seconds > 0:
+            time.sleep(seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class StandInChatModel:
+    """
+    Stand-in for ChatOpenAI with fixed responses and simulated generation time.
+
+    Direct calls (topic extraction, summaries) return call_reply and streamed calls
+    (verification, counselling) return stream_reply, with token usage like the real models.
+    """
+
+    def __init__(self, model_name, latency, call_reply, stream_reply=None):
+        """
+        Initialize the stand-in.
+
+        Args:
+            model_name (str): Model name reported in logs
+            latency (StandInLatency): Simulated latencies
+            call_reply (str): Response of direct calls
+            stream_reply (str): Response of streamed calls
+        """
+        self.model_name = model_name
+        self.latency = latency
+        self.call_reply = call_reply
+        self.stream_reply = stream_reply or call_reply
+
+    @staticmethod
+    def _prompt_text(messages):
+        if isinstance(messages, str):
+            return messages
+        return "\n".join(str(getattr(message, "content", message)) for message in messages)
+
+    def _usage(self, messages, reply):
+        from utils.tokens import count_tokens
+        prompt_tokens = count_tokens(self._prompt_text(messages), self.model_name)
+        completion_tokens = count_tokens(reply, self.model_name)
+        return {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def __call__(self, messages):
+        from langchain_core.messages import AIMessage
+        self.latency.sleep(self.latency.first_token + self.latency.token_delay * self.latency.response_tokens)
+        return AIMessage(content=self.call_reply, usage_metadata=self._usage(messages, self.call_reply))
+
+    def invoke(self, messages):
+        return self(messages)
+
+    def bind(self, **kwargs):
+        return self
+
+    def stream(self, messages):
+        from langchain_core.messages import AIMessageChunk
+        self.latency.sleep(self.latency.first_token)
+        for word in self.stream_reply.split(" "):
+            self.latency.sleep(self.latency.token_delay)
+            yield AIMessageChunk(content=word + " ")
+        yield AIMessageChunk(content="", usage_metadata=self._usage(messages, self.stream_reply))
+
+
+class StandInSectionIndex:
+    """Stand-in for the (drug, section) index: knows the drug names, finds no sections."""
+
+    def __init__(self, drugs):
+        self.drugs = frozenset(drugs)
+
+
+class StandInKnowledgeBase:
+    """
+    Stand-in for KnowledgeBase: every query goes to a simulated vector search.
+    """
+
+    def __init__(self, latency, drugs):
+        """
+        Initialize the stand-in.
+
+        Args:
+            latency (StandInLatency): Simulated latencies
+            drugs (iterable): Drug names in the knowledge base
+        """
+        self.latency = latency
+        self.section_index = StandInSectionIndex(drugs)
+
+    def lookup(self, query, topic_output):
+        return None
+
+    def search(self, query, top_docs=5, drugs=None):
+        self.latency.sleep(self.latency.kb)
+        context = "\n".join(f"<chunk id=\"{i}\">{COUNSELLING_SENTENCE}</chunk>" for i in range(top_docs))
+        metadata = [{"source": "stand-in", "drug": "EMPAGLIFLOZIN", "section": "side effects"}] * top_docs
+        scores = [0.1 + 0.01 * i for i in range(top_docs)]
+        stats = {
+            "retrieval": "vector_search",
+            "tokens_original": 60 * top_docs,
+            "tokens_compressed": 60 * top_docs,
+            "chunks_kept": top_docs,
+            "chunks_retrieved": top_docs,
+        }
+        return context, metadata, scores, stats
+
+
+def create_stand_in_system(latency, work_dir):
+    """
+    Create a chat system with stand-in backends, and its report summary cache and job queue.
+
+    Args:
+        latency (StandInLatency): Simulated latencies
+        work_dir (str): Directory for the logs and the report job database
+
+    Returns:
+        tuple: (ChatSystem, ReportSummaryCache, JobQueue)
+    """
+    from chat.system import ChatSystem
+    from chat.logger import ChatSystemLogger
+    from patients.records import LocalRecordSource
+    from utils.summary_cache import ReportSummaryCache
+    from utils.report_jobs import create_report_job_queue
+
+    record = LocalRecordSource().get()
+    counselling_reply = (COUNSELLING_SENTENCE * (latency.response_tokens // 30 + 1)).strip()
+
+    logger = ChatSystemLogger(log_dir=os.path.join(work_dir, "logs"))
+    logger.start_conversation("loadtest")
+    chat_system = ChatSystem(
+        chatllm=StandInChatModel("gpt-4o-mini", latency, TOPIC_REPLY, VERIFIED_REPLY),
+        chatllm_large=StandInChatModel("gpt-4o", latency, counselling_reply),
+        summaryllm=StandInChatModel("o3-mini", latency, SUMMARY_REPLY),
+        patient_details=record.patient_details,
+        prescription_details=record.prescription_details,
+        knowledge_base=StandInKnowledgeBase(latency, record.drug_names),
+        logger=logger,
+        patient_record=record
+    )
+
+    def deliver_batch(reports):
+        # One SMTP session per batch
+        latency.sleep(latency.email)
+        return [None] * len(reports)
+
+    summary_cache = ReportSummaryCache(chat_system.summaryllm, logger=logger)
+    report_jobs = create_report_job_queue(summary_cache, os.path.join(work_dir, "report_jobs.sqlite3"), deliver_batch)
+    return chat_system, summary_cache, report_jobs
+
+
+class TurnRejected(Exception):
+    """Raised when the Gradio UI answers a turn with its busy message."""
+
+
+def wait_for_report(report_jobs, job_id):
+    """
+    Wait until a report job is done.
+
+    Args:
+        report_jobs (JobQueue): Report job queue
+        job_id (str): Report job ID
+
+    Raises:
+        RuntimeError: If the report failed
+        TimeoutError: If the report was not sent within REPORT_TIMEOUT
+    """
+    deadline = time.monotonic() + REPORT_TIMEOUT
+    while time.monotonic() < deadline:
+        job = report_jobs.get(job_id)
+        if job["status"] in TERMINAL_JOB_STATUSES:
+            if job["status"] != "succeeded":
+                raise RuntimeError(f"Report failed: {job['error']}")
+            return
+        time.sleep(0.2)
+    raise TimeoutError("Report not sent in time")
+
+
+class ChatTarget:
+    """
+    Drives ChatSystem instances in this process the way the API sessions do.
+    """
+
+    name = "chat"
+    supports_voice = True
+
+    def __init__(self, chat_system, summary_cache, report_jobs, latency):
+        """
+        Initialize the target.
+
+        Args:
+            chat_system (ChatSystem): Chat system whose models, knowledge base and logger are shared
+            summary_cache (ReportSummaryCache): Cache of conversation summaries
+            report_jobs (JobQueue): Report job queue
+            latency (StandInLatency): Simulated speech latencies
+        """
+        from utils.stage_scheduler import get_scheduler
+        from utils.speech_service import get_speech_service
+
+        self.base = chat_system
+        self.summary_cache = summary_cache
+        self.report_jobs = report_jobs
+        self.latency = latency
+        self.scheduler = get_scheduler()
+        self.speech_service = get_speech_service()
+        self._ids = itertools.count(1)
+
+    def open_session(self):
+        from chat.system import ChatSystem
+
+        base = self.base
+        return ChatSystem(
+            chatllm=base.chatllm,
+            chatllm_large=base.chatllm_large,
+            summaryllm=base.summaryllm,
+            patient_details=base.patient_details,
+            prescription_details=base.prescription_details,
+            memory_char_limit=base.memory_char_limit,
+            knowledge_base=base.knowledge_base,
+            logger=base.logger.fork(f"loadtest_{next(self._ids):06d}")
+        )
+
+    def close_session(self, chat_system):
+        pass
+
+    def speech(self, kind):
+        seconds = self.latency.stt if kind == "stt" else self.latency.tts
+        self.speech_service.submit(kind, self.latency.sleep, seconds).result()
+
+    def send(self, chat_system, message):
+        from config import REPORT_SUMMARY_PRECOMPUTE
+        from utils.stage_scheduler import STAGE_CHAT
+        from utils.summary_cache import message_lines
+
+        start_time = time.perf_counter()
+        first_token = None
+        chunks = []
+        with self.scheduler.slot(STAGE_CHAT):
+            for chunk in chat_system.process_message_stream(message):
+                if first_token is None and chunk:
+                    first_token = time.perf_counter() - start_time
+                chunks.append(chunk)
+        chat_system.logger.update_final_response("".join(chunks))
+
+        if REPORT_SUMMARY_PRECOMPUTE and chat_system.status_verified:
+            self.summary_cache.precompute(
+                message_lines(chat_system.chat_memory), chat_system.prescription_details, chat_system.logger,
+                chat_system.convo_number
+            )
+        return first_token
+
+    def request_report(self, chat_system):
+        from utils.report_jobs import submit_report_job
+
+        job_id = submit_report_job(
+            self.report_jobs, chat_system.chat_memory, chat_system.prescription_details, REPORT_EMAIL
+        )
+        wait_for_report(self.report_jobs, job_id)
+
+    def stats(self):
+        return self.scheduler.stats()
+
+
+class GradioTarget(ChatTarget):
+    """
+    Drives the event handlers of one shared GradioInterface the way browser sessions do.
+
+    Handlers are called directly, so Gradio's event queue and transport are left out.
+    Text-to-speech is simulated like on the chat target, rather than streamed by the
+    chat turn.
+    """
+
+    name = "gradio"
+
+    def __init__(self, chat_system, summary_cache, report_jobs, latency):
+        """
+        Initialize the target.
+
+        Args:
+            chat_system (ChatSystem): Chat system shared by the UI sessions
+            summary_cache (ReportSummaryCache): Cache of conversation summaries
+            report_jobs (JobQueue): Report job queue
+            latency (StandInLatency): Simulated speech latencies
+        """
+        from ui.gradio_interface import GradioInterface
+
+        super().__init__(chat_system, summary_cache, report_jobs, latency)
+        self.interface = GradioInterface(
+            chat_system, chat_system.summaryllm, summary_cache=summary_cache, report_jobs=report_jobs
+        )
+
+    def open_session(self):
+        # A new browser tab; its session is created with the first message
+        return {"session_id": None, "history": [[None, self.interface.introduction_msg]]}
+
+    def close_session(self, tab):
+        if tab["session_id"]:
+            self.interface.sessions.delete(tab["session_id"])
+
+    def send(self, tab, message):
+        start_time = time.perf_counter()
+        first_token = None
+        tab["session_id"], history, _ = self.interface.add_text_audio(tab["session_id"], tab["history"], message)
+
+        # The chatbot component hands its history to the next event as lists
+        history = [list(turn) for turn in history]
+        for history, _ in self.interface.trigger_bot_response(tab["session_id"], history, False):
+            if first_token is None and history[-1][1]:
+                first_token = time.perf_counter() - start_time
+        if history[-1][1] == self.interface.busy_msg:
+            raise TurnRejected(self.interface.busy_msg)
+        tab["history"] = history
+        return first_token
+
+    def request_report(self, tab):
+        status, job_id, _ = self.interface.save_to_pdf_and_send_email(REPORT_EMAIL, tab["session_id"])
+        if job_id is None:
+            raise RuntimeError(status)
+        wait_for_report(self.report_jobs, job_id)
+
+
+class HTTPStatusError(Exception):
+    """Raised when the API answers with an error status."""
+
+    def __init__(self, status, detail):
+        super().__init__(f"HTTP {status}: {detail}")
+        self.status = status
+
+
+class HTTPTarget:
+    """
+    Drives a RALPh API over HTTP, streaming responses as Server-Sent Events.
+    """
+
+    name = "http"
+    supports_voice = False
+
+    def __init__(self, base_url, timeout=120):
+        """
+        Initialize the target.
+
+        Args:
+            base_url (str): Server URL, e.g. http://127.0.0.1:7860
+            timeout (float): Seconds to wait for a response
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        """Send a request and return the open response."""
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode("utf-8") if body is not None else None,
+            headers={"Content-Type": "application/json"},
+            method=method
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            raise HTTPStatusError(e.code, e.read().decode("utf-8", "replace")[:200]) from None
+
+    def _json(self, method, path, body=None):
+        with self._request(method, path, body) as response:
+            return json.loads(response.read())
+
+    def open_session(self):
+        return self._json("POST", "/api/sessions", {})["session_id"]
+
+    def close_session(self, session_id):
+        try:
+            self._json("DELETE", f"/api/sessions/{session_id}")
+        except HTTPStatusError:
+            pass
+
+    def speech(self, kind):
+        raise NotImplementedError("The API takes text only")
+
+    def send(self, session_id, message):
+        start_time = time.perf_counter()
+        first_token = None
+        event = None
+        with self._request("POST", f"/api/sessions/{session_id}/stream", {"message": message}) as response:
+            for raw_line in response:
+                line = raw_line.decode("utf-8").rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - start_time
+                    elif event == "error":
+                        raise RuntimeError(json.loads(line[len("data: "):]).get("detail"))
+                    elif event == "done":
+                        return first_token
+        raise RuntimeError("Stream ended before the response was complete")
+
+    def request_report(self, session_id):
+        job_id = self._json("POST", f"/api/sessions/{session_id}/report", {"email": REPORT_EMAIL})["job_id"]
+        deadline = time.monotonic() + REPORT_TIMEOUT
+        while time.monotonic() < deadline:
+            job = self._json("GET", f"/api/reports/{job_id}")
+            if job["status"] in TERMINAL_JOB_STATUSES:
+                if job["status"] != "succeeded":
+                    raise RuntimeError(job["message"])
+                return
+            time.sleep(0.5)
+        raise TimeoutError("Report not sent in time")
+
+    def stats(self):
+        try:
+            return self._json("GET", "/api/stats")
+        except (HTTPStatusError, OSError):
+            return None
+
+
+def start_api_server(chat_system, summary_cache, report_jobs):
+    """
+    Serve the API in a background thread of this process.
+
+    Args:
+        chat_system (ChatSystem): Chat system shared by the API sessions
+        summary_cache (ReportSummaryCache): Cache of conversation summaries
+        report_jobs (JobQueue): Report job queue
+
+    Returns:
+        str: Server URL
+    """
+    import uvicorn
+    from api.server import create_app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    app = create_app(chat_system, report_jobs, summary_cache)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="LoadTestServer", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+class Recorder:
+    """
+    Thread-safe operation outcomes, per reporting interval and for the whole run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._interval = defaultdict(list)     # operation -> [(latency, error)] since the last flush
+        self._counts = defaultdict(lambda: defaultdict(int))  # operation -> "ok"/error kind -> count
+        self._latencies = defaultdict(list)    # operation -> reservoir of successful latencies
+        self._first_tokens = defaultdict(list)  # operation -> reservoir of times to first token
+        self._seen = defaultdict(int)
+
+    @staticmethod
+    def _keep(reservoir, seen, value):
+        """Reservoir sampling, so long soak runs use bounded memory."""
+        if len(reservoir) < RESERVOIR_SIZE:
+            reservoir.append(value)
+        else:
+            index = random.randrange(seen)
+            if index < RESERVOIR_SIZE:
+                reservoir[index] = value
+
+    def record(self, operation, latency, error=None, first_token=None):
+        """
+        Record the outcome of an operation.
+
+        Args:
+            operation (str): Operation name
+            latency (float): Seconds taken
+            error (str): Error kind (None if the operation succeeded)
+            first_token (float): Seconds to the first streamed token (turns only)
+        """
+        with self._lock:
+            self._interval[operation].append((latency, error))
+            self._counts[operation][error or "ok"] += 1
+            if error is None:
+                self._seen[operation] += 1
+                self._keep(self._latencies[operation], self._seen[operation], latency)
+                if first_token is not None:
+                    self._keep(self._first_tokens[operation], self._seen[operation], first_token)
+
+    def flush(self):
+        """
+        Take the outcomes recorded since the last flush.
+
+        Returns:
+            dict: operation -> [(latency, error)]
+        """
+        with self._lock:
+            interval, self._interval = self._interval, defaultdict(list)
+        return interval
+
+    def summary(self, duration):
+        """
+        Outcomes of the whole run.
+
+        Args:
+            duration (float): Run duration in seconds
+
+        Returns:
+            dict: operation -> count, errors by kind, error rate, throughput and percentiles
+        """
+        with self._lock:
+            result = {}
+            for operation, counts in sorted(self._counts.items()):
+                total = sum(counts.values())
+                errors = {kind: count for kind, count in counts.items() if kind != "ok"}
+                result[operation] = {
+                    "count": total,
+                    "errors": errors,
+                    "error_rate": round(sum(errors.values()) / total, 4) if total else 0.0,
+                    "per_second": round(counts.get("ok", 0) / duration, 3) if duration else None,
+                    "latency": percentiles(self._latencies[operation]),
+                    "first_token": percentiles(self._first_tokens[operation]) if self._first_tokens[operation] else None,
+                }
+            return result
+
+
+def error_kind(error):
+    """Short name of an error for the error counts."""
+    if isinstance(error, HTTPStatusError):
+        return f"HTTP {error.status}"
+    return type(error).__name__
+
+
+class SimulatedUser:
+    """
+    A patient running scripted conversations until stopped.
+    """
+
+    def __init__(self, user_id, target, recorder, args, stop_event):
+        """
+        Initialize the user.
+
+        Args:
+            user_id (int): User number
+            target: ChatTarget, GradioTarget or HTTPTarget
+            recorder (Recorder): Outcome recorder
+            args (argparse.Namespace): Parsed arguments
+            stop_event (threading.Event): Set when the run ends
+        """
+        self.user_id = user_id
+        self.target = target
+        self.recorder = recorder
+        self.args = args
+        self.stop_event = stop_event
+        self.retired = threading.Event()  # set when the profile scales users down
+        self.rng = random.Random(args.seed * 100003 + user_id)
+        self.thread = threading.Thread(target=self._run, name=f"LoadTestUser-{user_id}", daemon=True)
+
+    def _stopping(self):
+        return self.stop_event.is_set() or self.retired.is_set()
+
+    def _timed(self, operation, func, *args):
+        """Run an operation and record its outcome; returns whether it succeeded."""
+        start_time = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.recorder.record(operation, time.perf_counter() - start_time, error_kind(e))
+            return False, None
+        first_token = result if operation in ("verification", "question") else None
+        self.recorder.record(operation, time.perf_counter() - start_time, first_token=first_token)
+        return True, result
+
+    def _think(self):
+        """Pause between turns; returns False if the user should stop."""
+        self.stop_event.wait(self.rng.uniform(self.args.think_min, self.args.think_max))
+        return not self._stopping()
+
+    def _conversation(self, verification_message):
+        """Run one scripted conversation."""
+        start_time = time.perf_counter()
+        ok, session = self._timed("open_session", self.target.open_session)
+        if not ok:
+            self.stop_event.wait(1.0)
+            return
+        try:
+            voice = self.target.supports_voice and self.rng.random() < self.args.voice_share
+            questions = self.rng.sample(QUESTIONS, min(self.args.questions, len(QUESTIONS)))
+            turns = [("verification", verification_message)] + [("question", q) for q in questions]
+
+            for operation, message in turns:
+                if voice and not self._timed("speech_to_text", self.target.speech, "stt")[0]:
+                    return
+                if not self._timed(operation, self.target.send, session, message)[0]:
+                    return
+                if voice:
+                    self._timed("text_to_speech", self.target.speech, "tts")
+                if not self._think():
+                    return
+
+            if self.rng.random() < self.args.report_share:
+                self._timed("report", self.target.request_report, session)
+            self.recorder.record("conversation", time.perf_counter() - start_time)
+        finally:
+            self.target.close_session(session)
+
+    def _run(self):
+        from patients.records import LocalRecordSource
+
+        record = LocalRecordSource().get()
+        date_of_birth = record.date_of_birth.strftime("%d %B %Y") if record.date_of_birth else "unknown"
+        allergies = ", ".join(record.allergies) or "no"
+        verification_message = f"Hi, I'm {record.name}, born on {date_of_birth}, and I have {allergies} allergies."
+
+        # Spread the users' first requests over the think time
+        self.stop_event.wait(self.rng.uniform(0, self.args.think_max))
+        while not self._stopping():
+            self._conversation(verification_message)
+
+    def start(self):
+        self.thread.start()
+
+
+def run_load(target, args, stages, server_pid=None):
+    """
+    Run a load profile against a target.
+
+    Args:
+        target: ChatTarget, GradioTarget or HTTPTarget
+        args (argparse.Namespace): Parsed arguments
+        stages (list): (users, seconds) stages of the load profile
+        server_pid (int): Process whose memory is sampled (this process if None)
+
+    Returns:
+        tuple: (timeline rows, run summary)
+    """
+    recorder = Recorder()
+    stop_event = threading.Event()
+    users = []
+    timeline = []
+    rss_start = read_rss_mb(server_pid)
+
+    start_time = time.monotonic()
+    next_sample = start_time + args.interval
+    while True:
+        elapsed = time.monotonic() - start_time
+        target_users = users_at(stages, elapsed)
+        if target_users is None:
+            break
+
+        # Scale the active users to the profile
+        active = [user for user in users if not user.retired.is_set()]
+        for _ in range(len(active), target_users):
+            user = SimulatedUser(len(users), target, recorder, args, stop_event)
+            users.append(user)
+            user.start()
+        for user in active[target_users:]:
+            user.retired.set()
+
+        if time.monotonic() >= next_sample:
+            next_sample += args.interval
+            timeline.append(timeline_row(elapsed, recorder.flush(), target_users, args.interval, server_pid))
+            print_row(timeline[-1])
+        time.sleep(0.2)
+
+    # Let conversations in progress stop at their next step
+    stop_event.set()
+    deadline = time.monotonic() + args.drain
+    for user in users:
+        user.thread.join(max(0.0, deadline - time.monotonic()))
+    duration = time.monotonic() - start_time
+
+    timeline.append(timeline_row(duration, recorder.flush(), 0, args.interval, server_pid))
+    summary = {
+        "target": target.name,
+        "duration_seconds": round(duration, 1),
+        "peak_users": max((count for count, _ in stages), default=0),
+        "operations": recorder.summary(duration),
+        "memory": memory_summary(timeline, rss_start),
+        "target_stats": target.stats(),
+    }
+    return timeline, summary
+
+
+def timeline_row(elapsed, interval, users, interval_seconds, server_pid):
+    """Throughput, latency, error rate and RSS of one reporting interval."""
+    turns = interval.get("verification", []) + interval.get("question", [])
+    ok_latencies = [latency for latency, error in turns if error is None]
+    errors = sum(1 for outcomes in interval.values() for _, error in outcomes if error is not None)
+    total = sum(len(outcomes) for outcomes in interval.values())
+    turn_percentiles = percentiles(ok_latencies, (0.5, 0.95, 0.99))
+    return {
+        "elapsed": round(elapsed, 1),
+        "users": users,
+        "turns_per_second": round(len(ok_latencies) / interval_seconds, 3),
+        "turn_p50": turn_percentiles["p50"],
+        "turn_p95": turn_percentiles["p95"],
+        "turn_p99": turn_percentiles["p99"],
+        "operations": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "rss_mb": read_rss_mb(server_pid),
+    }
+
+
+def memory_summary(timeline, rss_start):
+    """
+    RSS at the start, end and peak of the run, and its growth rate.
+
+    The growth rate is the least-squares slope over the second half of the run, after
+    caches and pools have filled up, so a steady leak shows as a positive MB/hour.
+    """
+    samples = [(row["elapsed"], row["rss_mb"]) for row in timeline if row["rss_mb"] is not None]
+    if not samples:
+        return None
+    tail = samples[len(samples) // 2:]
+    slope = None
+    if len(tail) >= 2:
+        mean_t = sum(t for t, _ in tail) / len(tail)
+        mean_m = sum(m for _, m in tail) / len(tail)
+        variance = sum((t - mean_t) ** 2 for t, _ in tail)
+        if variance:
+            slope = sum((t - mean_t) * (m - mean_m) for t, m in tail) / variance
+    return {
+        "rss_start_mb": rss_start,
+        "rss_end_mb": samples[-1][1],
+        "rss_peak_mb": max(m for _, m in samples),
+        "rss_growth_mb_per_hour": round(slope * 3600, 1) if slope is not None else None,
+    }
+
+
+def print_row(row):
+    """Print a timeline row."""
+    print(
+        f"[{row['elapsed']:>8.1f}s] users {row['users']:>4}  turns/s {row['turns_per_second']:>7.2f}  "
+        f"p50 {row['turn_p50'] or 0:>6.2f}s  p95 {row['turn_p95'] or 0:>6.2f}s  "
+        f"errors {row['errors']:>4} ({row['error_rate']:.1%})  rss {row['rss_mb'] or 0:>8.1f} MB",
+        flush=True
+    )
+
+
+def print_summary(summary):
+    """Print the run summary."""
+    print(f"\n## {summary['target']} target, {summary['duration_seconds']}s, up to {summary['peak_users']} users\n")
+    print(f"{'operation':<16} {'count':>7} {'err%':>6} {'ok/s':>7} {'p50':>7} {'p90':>7} {'p95':>7} {'p99':>7} {'ttft p95':>9}")
+    for operation, stats in summary["operations"].items():
+        latency = stats["latency"]
+        first_token = (stats["first_token"] or {}).get("p95")
+        print(
+            f"{operation:<16} {stats['count']:>7} {stats['error_rate']:>6.1%} {stats['per_second'] or 0:>7.2f} "
+            + " ".join(f"{latency[p] if latency[p] is not None else '-':>7}" for p in ("p50", "p90", "p95", "p99"))
+            + f" {first_token if first_token is not None else '-':>9}"
+        )
+        if stats["errors"]:
+            print(f"{'':<16} errors: {stats['errors']}")
+    if summary["memory"]:
+        print(f"\nMemory: {summary['memory']}")
+
+
+def write_results(output_dir, timeline, summary):
+    """Write the timeline as CSV and the summary as JSON."""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "timeline.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(timeline[0]))
+        writer.writeheader()
+        writer.writerows(timeline)
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+    print(f"\nResults written to '{output_dir}'.")
+
+
+def isolate_environment(work_dir):
+    """
+    Keep the stand-in run's session store, report jobs and PDFs out of the app's data.
+
+    Must run before the RALPh modules are imported, as config.py reads the environment
+    at import time.
+    """
+    os.environ.setdefault("SESSION_STORE_PATH", os.path.join(work_dir, "sessions.sqlite3"))
+    os.environ.setdefault("PDF_ARCHIVE_ENABLED", "false")
+    os.environ.setdefault("WARMUP_ENABLED", "false")
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="RALPh concurrent-user load and soak test")
+    parser.add_argument("--target", choices=["chat", "gradio", "api", "http"], default="chat", help="System under test")
+    parser.add_argument("--url", default="http://127.0.0.1:7860", help="Server URL for the http target")
+    parser.add_argument("--server-pid", type=int, default=None, help="Process whose RSS is sampled for the http target")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="smoke", help="Built-in load profile")
+    parser.add_argument("--stages", default=None, help="Custom load profile, e.g. 10:60,50:120,50:600 (users:seconds)")
+    parser.add_argument("--interval", type=float, default=10.0, help="Seconds per timeline row")
+    parser.add_argument("--drain", type=float, default=30.0, help="Seconds to wait for users to finish at the end")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the conversation scripts")
+    parser.add_argument("--output", default=None, help="Directory for timeline.csv and summary.json")
+
+    script = parser.add_argument_group("conversation script")
+    script.add_argument("--questions", type=int, default=3, help="Questions per conversation after verification")
+    script.add_argument("--think-min", type=float, default=2.0, help="Minimum seconds between turns")
+    script.add_argument("--think-max", type=float, default=8.0, help="Maximum seconds between turns")
+    script.add_argument("--voice-share", type=float, default=0.3, help="Share of conversations using voice (chat and gradio targets)")
+    script.add_argument("--report-share", type=float, default=0.3, help="Share of conversations ending with a PDF report")
+
+    stand_in = parser.add_argument_group("stand-in backends (chat, gradio and api targets)")
+    stand_in.add_argument("--first-token", type=float, default=0.5, help="Seconds to the first token of a model call")
+    stand_in.add_argument("--token-delay", type=float, default=0.01, help="Seconds per generated token")
+    stand_in.add_argument("--response-tokens", type=int, default=150, help="Tokens of a counselling response")
+    stand_in.add_argument("--kb-latency", type=float, default=0.05, help="Seconds per knowledge base search")
+    stand_in.add_argument("--stt-latency", type=float, default=0.8, help="Seconds per speech-to-text call")
+    stand_in.add_argument("--tts-latency", type=float, default=1.0, help="Seconds per text-to-speech call")
+    stand_in.add_argument("--email-latency", type=float, default=0.5, help="Seconds per SMTP session (batch of emails)")
+    stand_in.add_argument("--jitter", type=float, default=0.25, help="Relative random variation of the latencies")
+    return parser.parse_args()
+
+
+def main():
+    """Run the load test"""
+    args = parse_args()
+    stages = parse_stages(args.stages) if args.stages else PROFILES[args.profile]
+
+    server_pid = None
+    if args.target == "http":
+        target = HTTPTarget(args.url)
+        server_pid = args.server_pid
+        if server_pid is None:
+            print("RSS is sampled from this process; pass --server-pid to follow the server.", file=sys.stderr)
+    else:
+        work_dir = tempfile.mkdtemp(prefix="ralph_loadtest_")
+        isolate_environment(work_dir)
+        latency = StandInLatency(args)
+        chat_system, summary_cache, report_jobs = create_stand_in_system(latency, work_dir)
+        if args.target == "chat":
+            target = ChatTarget(chat_system, summary_cache, report_jobs, latency)
+        elif args.target == "gradio":
+            target = GradioTarget(chat_system, summary_cache, report_jobs, latency)
+        else:
+            target = HTTPTarget(start_api_server(chat_system, summary_cache, report_jobs))
+            target.name = "api"
+        print(f"Stand-in backends; logs and job database in '{work_dir}'")
+
+    print(f"Load profile (users:seconds): {', '.join(f'{u}:{s:g}' for u, s in stages)}")
+    timeline, summary = run_load(target, args, stages, server_pid)
+    print_summary(summary)
+    if args.output:
+        write_results(args.output, timeline, summary)
+
+
+if __name__ == "__main__":
+    main()
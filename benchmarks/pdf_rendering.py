@@ -0,0 +1,94 @@
+"""
+Benchmark of the PDF report rendering stage.
+
+Compares rendering with the font parsed for every report and the PDF written to disk
+(the previous behaviour) against the cached-template renderer producing bytes in memory.
+Summarization is not included.
+
+Usage:
+    python -m benchmarks.pdf_rendering [--reports 50] [--chars 3000]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+
+from fpdf import FPDF
+
+from utils.pdf_generator import ReportRenderer, find_unicode_font
+
+
+SAMPLE_PARAGRAPH = (
+    "Empagliflozin 25mg: take 1 tablet once in the morning. It lowers blood sugar by helping the "
+    "kidneys remove glucose in the urine. Drink enough water and watch for signs of dehydration or "
+    "genital infections. Atorvastatin 20mg: continue 1 tablet once in the morning. "
+)
+
+
+def sample_summary(chars):
+    """Build a summary text of about the given length."""
+    return (SAMPLE_PARAGRAPH * (chars // len(SAMPLE_PARAGRAPH) + 1))[:chars]
+
+
+def render_uncached(summary, output_dir):
+    """Render a report the previous way: parse the font and write the PDF to disk."""
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.add_font('Unicode', '', find_unicode_font(), uni=True)
+    pdf.set_font('Unicode', size=12)
+    pdf.multi_cell(0, 10, summary)
+    file_name = os.path.join(output_dir, "report.pdf")
+    pdf.output(file_name)
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def time_calls(func, reports):
+    """Run a function repeatedly and return the sorted durations in milliseconds."""
+    durations = []
+    for _ in range(reports):
+        start_time = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return sorted(durations)
+
+
+def summarize(name, durations, size):
+    """Print latency percentiles of a benchmark case."""
+    p50 = durations[len(durations) // 2]
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(f"{name:<28} mean {sum(durations) / len(durations):8.2f} ms   p50 {p50:8.2f} ms   "
+          f"p95 {p95:8.2f} ms   {size} bytes")
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark PDF report rendering")
+    parser.add_argument("--reports", type=int, default=50, help="Number of reports rendered per case")
+    parser.add_argument("--chars", type=int, default=3000, help="Length of the summary text")
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark"""
+    args = parse_args()
+    summary = sample_summary(args.chars)
+
+    renderer = ReportRenderer()
+    first_start = time.perf_counter()
+    size = len(renderer.render(summary))
+    print(f"Template build and first render: {(time.perf_counter() - first_start) * 1000:.2f} ms")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        uncached = time_calls(lambda: render_uncached(summary, output_dir), args.reports)
+        uncached_size = len(render_uncached(summary, output_dir))
+    cached = time_calls(lambda: renderer.render(summary), args.reports)
+
+    summarize("font per report, via disk", uncached, uncached_size)
+    summarize("cached template, in memory", cached, size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Non-blocking text logging pipeline for RALPh.
+
+Log records are put on a queue by the request thread and formatted, sanitized and
+written by a dedicated listener thread.
+"""
+
+import os
+import gzip
+import queue
+import shutil
+import atexit
+import logging
+import logging.handlers
+
+from config import (
+    LOG_QUEUE_SIZE,
+    LOG_FILE_LEVEL,
+    LOG_CONSOLE_LEVEL,
+    LOG_ROTATION,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN,
+    LOG_BACKUP_COUNT,
+    LOG_COMPRESS
+)
+
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# The listener currently serving the 'ChatSystem' logger, and its queue handler (one per process)
+_active_listener = None
+_active_handler = None
+
+
+class SanitizingFormatter(logging.Formatter):
+    """
+    Formatter that replaces non-ASCII characters, so that Unicode in user input or
+    model output never breaks a log sink.
+    """
+
+    def format(self, record):
+        return super().format(record).encode('ascii', 'replace').decode('ascii')
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that defers all message formatting to the listener thread.
+
+    The standard QueueHandler merges the message arguments in the calling thread;
+    here records are queued as-is, which is safe because the queue never leaves
+    the process. Records are dropped rather than blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue, text_log_filename=None):
+        super().__init__(log_queue)
+        self.text_log_filename = text_log_filename
+        self.dropped_records = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+def _gzip_rotator(source, dest):
+    """Compress a rotated log file."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _parse_level(level):
+    """Convert a level name to a logging level, or None if the sink is turned off."""
+    if level is None or str(level).upper() == "OFF":
+        return None
+    return logging.getLevelName(str(level).upper())
+
+
+def build_file_handler(filename,
+                       rotation=LOG_ROTATION,
+                       max_bytes=LOG_MAX_BYTES,
+                       when=LOG_ROTATE_WHEN,
+                       backup_count=LOG_BACKUP_COUNT,
+                       compress=LOG_COMPRESS):
+    """
+    Build a rotating UTF-8 file handler.
+
+    Args:
+        filename (str): Log file path
+        rotation (str): "size" or "time"
+        max_bytes (int): File size that triggers rotation (size rotation)
+        when (str): Rotation interval, e.g. "midnight" or "H" (time rotation)
+        backup_count (int): Number of rotated files kept
+        compress (bool): Gzip rotated files
+
+    Returns:
+        logging.Handler: File handler
+    """
+    if rotation == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            filename, when=when, backupCount=backup_count, encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+
+    if compress:
+        handler.rotator = _gzip_rotator
+        handler.namer = lambda name: name + ".gz"
+
+    return handler
+
+
+def configure_queue_logging(logger,
+                            text_log_filename,
+                            file_level=LOG_FILE_LEVEL,
+                            console_level=LOG_CONSOLE_LEVEL,
+                            queue_size=LOG_QUEUE_SIZE):
+    """
+    Route a logger through a queue to file and console sinks served by a listener thread.
+
+    The sinks are set up once per process: while the listener runs, later calls reuse it
+    and its text log file, so that every record keeps going to the same open sinks.
+
+    Args:
+        logger (logging.Logger): Logger to configure (existing handlers are replaced)
+        text_log_filename (str): Path of the text log file
+        file_level (str): Level of the file sink, or "OFF"
+        console_level (str): Level of the console sink, or "OFF"
+        queue_size (int): Maximum number of queued records before records are dropped
+
+    Returns:
+        LazyQueueHandler: The handler attached to the logger
+    """
+    global _active_listener, _active_handler
+
+    if _active_listener is not None and _active_handler in logger.handlers:
+        return _active_handler
+    stop_queue_logging()
+
+    formatter = SanitizingFormatter(LOG_FORMAT)
+    sinks = []
+
+    level = _parse_level(file_level)
+    if level is not None:
+        file_handler = build_file_handler(text_log_filename)
+        file_handler.setLevel(level)
+        sinks.append(file_handler)
+
+    level = _parse_level(console_level)
+    if level is not None:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(level)
+        sinks.append(console_handler)
+
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    # The logger level is the most verbose sink level, so that records nobody
+    # consumes are discarded before they are created
+    if logger.handlers:
+        logger.handlers.clear()
+    logger.propagate = False
+
+    queue_handler = LazyQueueHandler(queue.Queue(maxsize=queue_size), text_log_filename)
+    if sinks:
+        logger.setLevel(min(sink.level for sink in sinks))
+        logger.addHandler(queue_handler)
+        _active_listener = logging.handlers.QueueListener(
+            queue_handler.queue, *sinks, respect_handler_level=True
+        )
+        _active_listener.start()
+        _active_handler = queue_handler
+    else:
+        logger.setLevel(logging.CRITICAL + 1)
+
+    return queue_handler
+
+
+def stop_queue_logging():
+    """Flush queued records, stop the listener thread and close its sinks."""
+    global _active_listener, _active_handler
+    if _active_listener is not None:
+        _active_listener.stop()
+        for sink in _active_listener.handlers:
+            sink.close()
+        _active_listener = None
+        _active_handler = None
+
+
+atexit.register(stop_queue_logging)
@@ -0,0 +1,216 @@
+"""
+Append-only, buffered JSONL writer for RALPh structured logs.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+
+from config import (
+    STRUCTURED_LOG_QUEUE_SIZE,
+    STRUCTURED_LOG_BATCH_SIZE,
+    STRUCTURED_LOG_FLUSH_INTERVAL,
+    STRUCTURED_LOG_MAX_BYTES,
+    STRUCTURED_LOG_ROTATE_SECONDS,
+    STRUCTURED_LOG_FSYNC
+)
+
+
+FSYNC_POLICIES = ("never", "interval", "batch")
+
+
+class StructuredLogWriter:
+    """
+    Writes structured log records as JSON lines from a background thread.
+
+    Records are queued by the request thread and written in batches. Files are never
+    rewritten: when a segment exceeds its size or age limit, a new segment file
+    (<prefix>_<seq>.jsonl) is started.
+    """
+
+    def __init__(self,
+                 path_prefix,
+                 max_queue_size=STRUCTURED_LOG_QUEUE_SIZE,
+                 batch_size=STRUCTURED_LOG_BATCH_SIZE,
+                 flush_interval=STRUCTURED_LOG_FLUSH_INTERVAL,
+                 max_bytes=STRUCTURED_LOG_MAX_BYTES,
+                 rotate_seconds=STRUCTURED_LOG_ROTATE_SECONDS,
+                 fsync_policy=STRUCTURED_LOG_FSYNC):
+        """
+        Initialize the writer and start its background thread.
+
+        Args:
+            path_prefix (str): Path prefix of the segment files
+            max_queue_size (int): Maximum number of queued records before new records are dropped
+            batch_size (int): Maximum number of records written per batch
+            flush_interval (float): Maximum seconds a record waits in the queue
+            max_bytes (int): Segment size that triggers rotation (0 disables)
+            rotate_seconds (float): Segment age that triggers rotation (0 disables)
+            fsync_policy (str): "never" (leave to the OS), "interval" (at most once per
+                flush interval) or "batch" (after every batch)
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unsupported fsync policy: {fsync_policy}")
+
+        self.path_prefix = path_prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.fsync_policy = fsync_policy
+
+        self.dropped_records = 0
+        self.current_path = None
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._file = None
+        self._segment = 0
+        self._segment_opened_at = 0.0
+        self._last_fsync = 0.0
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="StructuredLogWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        """
+        Queue a record for writing without blocking the caller.
+
+        Args:
+            record (dict): JSON-serializable record (must not be mutated afterwards)
+
+        Returns:
+            bool: False if the queue is full and the record was dropped
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped_records += 1
+            return False
+
+    def flush(self, timeout=5.0):
+        """
+        Block until all records queued so far are written.
+
+        Args:
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if the queue was flushed in time
+        """
+        if self._closed:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self):
+        """Flush outstanding records and stop the background thread."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _open_segment(self):
+        """Start a new segment file."""
+        if self._file:
+            self._sync(force=self.fsync_policy != "never")
+            self._file.close()
+
+        self._segment += 1
+        self.current_path = f"{self.path_prefix}_{self._segment:04d}.jsonl"
+        os.makedirs(os.path.dirname(self.current_path) or ".", exist_ok=True)
+        self._file = open(self.current_path, "a", encoding="utf-8")
+        self._segment_opened_at = time.monotonic()
+
+    def _should_rotate(self):
+        """Check the size and age limits of the current segment."""
+        if self._file is None:
+            return True
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        if self.rotate_seconds and time.monotonic() - self._segment_opened_at >= self.rotate_seconds:
+            return True
+        return False
+
+    def _sync(self, force=False):
+        """Fsync the current segment according to the fsync policy."""
+        now = time.monotonic()
+        if force or self.fsync_policy == "batch" or (
+            self.fsync_policy == "interval" and now - self._last_fsync >= self.flush_interval
+        ):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def _write_batch(self, records):
+        """Append a batch of records to the current segment."""
+        if self._should_rotate():
+            self._open_segment()
+
+        lines = []
+        for record in records:
+            try:
+                lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            except (TypeError, ValueError) as e:
+                lines.append(json.dumps({
+                    "event": "log_error",
+                    "timestamp": datetime.now().isoformat(),
+                    "error": f"Unserializable record: {e}",
+                }) + "\n")
+
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self.fsync_policy != "never":
+            self._sync()
+
+    def _run(self):
+        """Background loop: collect records into batches and write them."""
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # Drain up to a batch worth of records without waiting
+            records, waiters = [], []
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    records.append(item)
+                if not running or len(records) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            try:
+                if records:
+                    self._write_batch(records)
+            except OSError:
+                self.dropped_records += len(records)
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+
+        if self._file:
+            if self.fsync_policy != "never":
+                self._sync(force=True)
+            self._file.close()
@@ -3,13 +3,15 @@ Logging functionality for RALPh chatbot.
 """
 
 import os
-import json
+import copy
 import logging
-import codecs
+from collections import deque
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Deque, Dict, Optional
 
-from config import LOG_DIR
+from config import LOG_DIR, STRUCTURED_LOG_MEMORY_LIMIT
+from chat.log_writer import StructuredLogWriter
+from chat.log_handlers import configure_queue_logging
 
 
 class ChatSystemLogger:
@@ -17,12 +19,13 @@ class ChatSystemLogger:
     Logger class for ChatSystem that handles both text and structured logging with Unicode support.
     """
     
-    def __init__(self, log_dir=LOG_DIR):
+    def __init__(self, log_dir=LOG_DIR, memory_limit=STRUCTURED_LOG_MEMORY_LIMIT):
         """
-        Initialize logger with file and console handlers.
+        Initialize logger with queued file and console handlers.
         
         Args:
             log_dir (str): Directory for log files
+            memory_limit (int): Number of recent structured log entries kept in memory
         """
         # Create log directory if it doesn't exist
         if not os.path.exists(log_dir):
@@ -30,70 +33,79 @@ class ChatSystemLogger:
             
         # Generate timestamp for log files
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.text_log_filename = os.path.join(log_dir, f"chat_system_{timestamp}.log")
-        self.json_log_filename = os.path.join(log_dir, f"chat_system_{timestamp}.json")
+        text_log_filename = os.path.join(log_dir, f"chat_system_{timestamp}.log")
         
-        # Configure text file handler with UTF-8 encoding
-        file_handler = logging.FileHandler(self.text_log_filename, encoding='utf-8')
-        file_handler.setLevel(logging.INFO)
-        
-        # Configure console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        
-        # Create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
-        
-        # Set up logger
+        # Route the logger through a queue; a listener thread formats, sanitizes and writes
+        # the records to the rotating file and console sinks. The sinks are shared by all
+        # loggers of the process, so the text log is the one opened by the first logger
         self.logger = logging.getLogger('ChatSystem')
-        self.logger.setLevel(logging.INFO)
-        
-        # Remove existing handlers if any
-        if self.logger.handlers:
-            self.logger.handlers.clear()
-            
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        self.queue_handler = configure_queue_logging(self.logger, text_log_filename)
+        self.text_log_filename = self.queue_handler.text_log_filename
         
         # Initialize conversation ID
         self._conversation_id: Optional[str] = None
         
-        # Initialize structured logs
-        self.structured_logs: List[Dict[str, Any]] = []
+        # Initialize structured logs: recent entries in memory, all events appended to JSONL segments
+        self.structured_logs: Deque[Dict[str, Any]] = deque(maxlen=memory_limit)
+        self.structured_log_writer = StructuredLogWriter(os.path.join(log_dir, f"chat_system_{timestamp}"))
+        self._reported_dropped_records = 0
 
-    def _save_structured_log(self):
-        """Save structured logs to JSON file with UTF-8 encoding"""
-        try:
-            with codecs.open(self.json_log_filename, 'w', encoding='utf-8') as f:
-                json.dump(self.structured_logs, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            self.logger.error(f"Error saving structured log: {str(e)}")
+    @property
+    def json_log_filename(self):
+        """Path of the structured log segment currently being written"""
+        return self.structured_log_writer.current_path
+
+    def _save_structured_log(self, record: Dict[str, Any]):
+        """Queue a structured log event for the background JSONL writer"""
+        # Copy so that later in-memory updates do not race with serialization
+        self.structured_log_writer.write(dict(record))
+        
+        dropped = self.structured_log_writer.dropped_records
+        if dropped > self._reported_dropped_records:
+            self.logger.warning("Structured log queue full: %s records dropped so far", dropped)
+            self._reported_dropped_records = dropped
+
+    def log_event(self, event: str, **fields):
+        """
+        Record a structured log event for the current conversation.
+        
+        Args:
+            event: Event type
+            **fields: Event fields
+        """
+        record = {
+            "event": event,
+            "conversation_id": self._conversation_id,
+            "timestamp": datetime.now().isoformat(),
+        }
+        record.update(fields)
+        self._save_structured_log(record)
             
-    def _sanitize_for_logging(self, data: Any) -> Any:
+    @property
+    def conversation_id(self):
+        """ID of the current conversation"""
+        return self._conversation_id
+
+    def start_conversation(self, conversation_id: Optional[str] = None):
+        """Generate a new conversation ID (or use the given one) for tracking chat sessions"""
+        self._conversation_id = conversation_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.logger.info("Starting new conversation with ID: %s", self._conversation_id)
+
+    def fork(self, conversation_id: str):
         """
-        Sanitize data for logging to handle potential Unicode issues.
+        Create a logger for another concurrent conversation that shares this logger's
+        text and structured log sinks.
         
         Args:
-            data: The data to sanitize
+            conversation_id: ID of the new conversation
             
         Returns:
-            Sanitized data
+            ChatSystemLogger: Logger of the new conversation
         """
-        if isinstance(data, str):
-            # Replace any problematic characters with their closest ASCII equivalent
-            return data.encode('ascii', 'replace').decode('ascii')
-        elif isinstance(data, dict):
-            return {k: self._sanitize_for_logging(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self._sanitize_for_logging(item) for item in data]
-        return data
-            
-    def start_conversation(self):
-        """Generate a new conversation ID for tracking chat sessions"""
-        self._conversation_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.logger.info(f"Starting new conversation with ID: {self._conversation_id}")
+        child = copy.copy(self)
+        child.structured_logs = deque(maxlen=self.structured_logs.maxlen)
+        child.start_conversation(conversation_id)
+        return child
 
     def log_interaction(self, 
                        convo_number: int,
@@ -103,9 +115,12 @@ class ChatSystemLogger:
                        kb_search_input: str = None,
                        kb_metadata: list = None,
                        kb_scores: list = None,
+                       kb_context_stats: dict = None,
                        verification_status: bool = None,
                        intermediate_output: str = None,
-                       process_duration: float = None):
+                       process_duration: float = None,
+                       stage_timings: list = None,
+                       token_usage: dict = None):
         """
         Log a complete interaction in both text and structured formats.
         
@@ -117,37 +132,57 @@ class ChatSystemLogger:
             kb_search_input: Knowledge base search input
             kb_metadata: Knowledge base result metadata
             kb_scores: Knowledge base result scores
+            kb_context_stats: Context compression statistics (token counts, chunks kept)
             verification_status: Whether user is verified
             intermediate_output: LLM output before empathy processing
             process_duration: Processing time in seconds
+            stage_timings: Per-stage timings ({"stage", "model", "duration"} dicts, with token
+                usage and cost for model calls)
+            token_usage: Token usage and cost of the turn and of the conversation so far
         """
         try:
             # Convert start_time to ISO format
             timestamp = datetime.fromtimestamp(start_time).isoformat()
             
-            # Text logging - handle potential Unicode issues
-            safe_user_input = self._sanitize_for_logging(user_input)
-            safe_kb_search = self._sanitize_for_logging(kb_search_input)
-            safe_kb_metadata = self._sanitize_for_logging(kb_metadata)
-            safe_kb_scores = self._sanitize_for_logging(kb_scores)
-            safe_output = self._sanitize_for_logging(intermediate_output)
-
-            # Text logging
-            self.logger.info(f"Convo: {convo_number}")
-            self.logger.info(f"Turn: {turn_number}")
-            self.logger.info(f"INPUT: {safe_user_input}")
-            if kb_search_input:
-                self.logger.info(f"KB SEARCH INPUT: {safe_kb_search}")
-            if kb_metadata and kb_scores:
-                self.logger.info(f"KB Results - Metadata: {safe_kb_metadata}")
-                self.logger.info(f"KB Results - Scores: {safe_kb_scores}")
-            if intermediate_output:
-                self.logger.info(f"INTERMEDIATE OUTPUT: {safe_output}")
-            if process_duration is not None:
-                self.logger.info(f"Process Message Duration: {process_duration:.3f} seconds")
+            # Text logging - arguments are formatted and sanitized lazily by the listener thread
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Convo: %s", convo_number)
+                self.logger.info("Turn: %s", turn_number)
+                self.logger.info("INPUT: %s", user_input)
+                if kb_search_input:
+                    self.logger.info("KB SEARCH INPUT: %s", kb_search_input)
+                if kb_metadata and kb_scores:
+                    self.logger.info("KB Results - Metadata: %s", kb_metadata)
+                    self.logger.info("KB Results - Scores: %s", kb_scores)
+                if kb_context_stats:
+                    self.logger.info(
+                        "KB Context Tokens: %s -> %s (%s/%s chunks kept)",
+                        kb_context_stats['tokens_original'],
+                        kb_context_stats['tokens_compressed'],
+                        kb_context_stats['chunks_kept'],
+                        kb_context_stats['chunks_retrieved']
+                    )
+                if intermediate_output:
+                    self.logger.info("INTERMEDIATE OUTPUT: %s", intermediate_output)
+                if process_duration is not None:
+                    self.logger.info("Process Message Duration: %.3f seconds", process_duration)
+                for timing in stage_timings or []:
+                    self.logger.info(
+                        "Stage %s (%s): %.3f seconds", timing['stage'], timing['model'], timing['duration']
+                    )
+                if token_usage:
+                    self.logger.info(
+                        "Tokens: %s prompt, %s completion, $%s (conversation: %s tokens, $%s)",
+                        token_usage['turn']['prompt_tokens'],
+                        token_usage['turn']['completion_tokens'],
+                        token_usage['turn']['cost_usd'],
+                        token_usage['conversation']['prompt_tokens'] + token_usage['conversation']['completion_tokens'],
+                        token_usage['conversation']['cost_usd']
+                    )
                 
             # Structured logging
             structured_log = {
+                "event": "interaction",
                 "conversation_id": self._conversation_id,
                 "convo_number": convo_number,
                 "turn_number": turn_number,
@@ -159,27 +194,27 @@ class ChatSystemLogger:
                     "metadata": kb_metadata,
                     "scores": kb_scores
                 },
+                "kb_context": kb_context_stats,
                 "intermediate_output": intermediate_output,
                 "final_response": None,
                 "final_response_timestamp": None,
                 "process_message_duration": process_duration,
+                "stage_timings": stage_timings,
+                "token_usage": token_usage,
                 "total_query_duration": None
             }
             
             self.structured_logs.append(structured_log)
-            self._save_structured_log()
+            self._save_structured_log(structured_log)
             
         except Exception as e:
             self.logger.error(f"Error in log_interaction: {str(e)}")
-            try:
-                self.logger.error(f"Failed to log interaction for turn {turn_number}")
-                self._save_structured_log()
-            except:
-                pass
+            self.logger.error(f"Failed to log interaction for turn {turn_number}")
 
     def update_final_response(self, full_response: str):
         """
-        Update the last structured log entry with the final response and timing information.
+        Update the last structured log entry with the final response and timing information,
+        and record the update as a "final_response" event.
         
         Args:
             full_response: The final response from the LLM
@@ -202,14 +237,22 @@ class ChatSystemLogger:
                 log["final_response_timestamp"]
             )
             
-            # Log timing information
-            self.logger.info(f"Process Message Duration: {log['process_message_duration']:.3f} seconds")
-            self.logger.info(f"Total Query Duration: {log['total_query_duration']:.3f} seconds")
-
-            # Update text and JSON logs
-            self.logger.info(f"FINAL RESPONSE: {self._sanitize_for_logging(full_response)}")
-            self.logger.info("##################################################")
-            self._save_structured_log()
+            # Log timing information and final response
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Process Message Duration: %.3f seconds", log['process_message_duration'])
+                self.logger.info("Total Query Duration: %.3f seconds", log['total_query_duration'])
+                self.logger.info("FINAL RESPONSE: %s", full_response)
+                self.logger.info("##################################################")
+            
+            self._save_structured_log({
+                "event": "final_response",
+                "conversation_id": log["conversation_id"],
+                "convo_number": log["convo_number"],
+                "turn_number": log["turn_number"],
+                "final_response": full_response,
+                "final_response_timestamp": log["final_response_timestamp"],
+                "total_query_duration": log["total_query_duration"],
+            })
 
         except Exception as e:
             self.logger.error(f"Error updating final response: {str(e)}")
@@ -143,4 +143,8 @@ If the AI agent suggests that there is no information, only respond that there i
 
 
 # System prompt for summarization
-SYSTEM_PROMPT_SUMMARIZE = """You are an intelligent assistant that will summarise the contents of a medication counselling session into a structured report for the patient to take home. Include the following headers: 1) Medication List, 2) Medication Information, 3) Counselling Points, 4) Other important medication information."""
\ No newline at end of file
+SYSTEM_PROMPT_SUMMARIZE = """You are an intelligent assistant that will summarise the contents of a medication counselling session into a structured report for the patient to take home. Include the following headers: 1) Medication List, 2) Medication Information, 3) Counselling Points, 4) Other important medication information."""
+
+
+# System prompt for updating a summary with new conversation turns
+SYSTEM_PROMPT_SUMMARIZE_UPDATE = """You are an intelligent assistant that maintains a structured take-home report of a medication counselling session. You will be given the current report, followed by the newest part of the session. Update the report so that it also covers the new information, keeping everything from the current report that is still correct. Keep the same headers: 1) Medication List, 2) Medication Information, 3) Counselling Points, 4) Other important medication information. Return only the updated report."""
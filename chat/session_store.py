@@ -0,0 +1,242 @@
+"""
+Externalized conversation state for RALPh.
+
+The state of a conversation (chat history, verification status, turn and conversation
+counters, patient and prescription details) is serialized into a compact blob and kept
+in a session store, so that any worker process can serve any turn and a conversation
+survives a restart. Writes use optimistic concurrency: each save names the version it
+was based on and fails with SessionConflict if another worker saved in the meantime.
+
+SQLiteSessionStore is the local default; a networked store (e.g. Redis) only needs to
+implement the SessionStore methods. Workers keep recently used sessions in memory (see
+api/sessions.py), so the store is read when a session is first served by a worker,
+not on every message.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from config import SESSION_STORE_BACKEND, SESSION_STORE_PATH
+
+
+# Serialization format version and the blob prefixes of plain and compressed payloads
+STATE_FORMAT_VERSION = 1
+PLAIN_PREFIX = b"j"
+COMPRESSED_PREFIX = b"z"
+# Payloads larger than this (bytes) are compressed
+COMPRESS_MIN_BYTES = 512
+
+MESSAGE_CLASSES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+
+class SessionConflict(Exception):
+    """Raised when a session was saved by another worker since it was loaded."""
+
+
+def serialize_state(state):
+    """
+    Serialize a conversation state.
+
+    Args:
+        state (dict): State from ChatSystem.export_state
+
+    Returns:
+        bytes: Compact blob
+    """
+    payload = {
+        "v": STATE_FORMAT_VERSION,
+        "m": [[message.type, message.content] for message in state["messages"]],
+        "s": state["status_verified"],
+        "t": state["turn_counter"],
+        "c": state["convo_number"],
+        "p": state["patient_details"],
+        "r": state["prescription_details"],
+        "u": state.get("token_usage"),
+    }
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return COMPRESSED_PREFIX + zlib.compress(data)
+    return PLAIN_PREFIX + data
+
+
+def deserialize_state(blob):
+    """
+    Deserialize a conversation state.
+
+    Args:
+        blob (bytes): Blob from serialize_state
+
+    Returns:
+        dict: State for ChatSystem.load_state
+
+    Raises:
+        ValueError: If the blob is not a known format
+    """
+    prefix, data = blob[:1], blob[1:]
+    if prefix == COMPRESSED_PREFIX:
+        data = zlib.decompress(data)
+    elif prefix != PLAIN_PREFIX:
+        raise ValueError(f"Unknown session state format: {prefix!r}")
+
+    payload = json.loads(data.decode("utf-8"))
+    if payload.get("v") != STATE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported session state version: {payload.get('v')}")
+
+    return {
+        "messages": [MESSAGE_CLASSES.get(kind, SystemMessage)(content=content) for kind, content in payload["m"]],
+        "status_verified": payload["s"],
+        "turn_counter": payload["t"],
+        "convo_number": payload["c"],
+        "patient_details": payload["p"],
+        "prescription_details": payload["r"],
+        "token_usage": payload.get("u"),
+    }
+
+
+class SessionStore:
+    """
+    Interface of a session store. Blobs are opaque to the store.
+    """
+
+    def load(self, session_id):
+        """
+        Load a session.
+
+        Args:
+            session_id (str): Session ID
+
+        Returns:
+            tuple: (blob, version), or None if the session does not exist
+        """
+        raise NotImplementedError
+
+    def save(self, session_id, blob, expected_version):
+        """
+        Save a session if it is still at the expected version.
+
+        Args:
+            session_id (str): Session ID
+            blob (bytes): Serialized state
+            expected_version (int): Version the state was based on (None for a new session)
+
+        Returns:
+            int: New version
+
+        Raises:
+            SessionConflict: If the stored version differs from the expected one
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """
+        Delete a session.
+
+        Args:
+            session_id (str): Session ID
+        """
+        raise NotImplementedError
+
+    def purge(self, max_age):
+        """
+        Delete sessions that were not saved for a while.
+
+        Args:
+            max_age (float): Seconds since the last save
+
+        Returns:
+            int: Number of deleted sessions
+        """
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in a local SQLite database, shared by the workers of one host.
+    """
+
+    def __init__(self, db_path=SESSION_STORE_PATH):
+        """
+        Open (or create) the session database.
+
+        Args:
+            db_path (str): Path of the SQLite database
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    state BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connection(self):
+        """Connection of the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def load(self, session_id):
+        row = self._connection().execute(
+            "SELECT state, version FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def save(self, session_id, blob, expected_version):
+        connection = self._connection()
+        with connection:
+            if expected_version is None:
+                try:
+                    connection.execute(
+                        "INSERT INTO sessions (id, version, state, updated_at) VALUES (?, 1, ?, ?)",
+                        (session_id, blob, time.time())
+                    )
+                except sqlite3.IntegrityError:
+                    raise SessionConflict(f"Session {session_id} already exists")
+                return 1
+
+            cursor = connection.execute(
+                "UPDATE sessions SET version = version + 1, state = ?, updated_at = ? WHERE id = ? AND version = ?",
+                (blob, time.time(), session_id, expected_version)
+            )
+            if cursor.rowcount == 0:
+                raise SessionConflict(f"Session {session_id} changed since version {expected_version}")
+            return expected_version + 1
+
+    def delete(self, session_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def purge(self, max_age):
+        with self._connection() as connection:
+            cursor = connection.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_age,))
+            return cursor.rowcount
+
+
+def create_session_store():
+    """
+    Create the configured session store.
+
+    Returns:
+        SessionStore: The session store
+    """
+    if SESSION_STORE_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown session store backend: {SESSION_STORE_BACKEND}")
@@ -5,17 +5,28 @@ Core chat system implementation for RALPh.
 import time
 # from langchain.memory import ChatMessageHistory  # deprecated
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+from config import HISTORY_TOKEN_BUDGET, CONVERSATION_TOKEN_BUDGET
 from chat.logger import ChatSystemLogger
 from chat.prompts import (
-    build_counselling_system_prompt,
-    build_verification_system_prompt,
     SYSTEM_PROMPT_IDENTIFY_TOPICS,
     SYSTEM_PROMPT_EMPATHY
 )
 from knowledge_base.vector_store import KnowledgeBase
+from knowledge_base.section_index import mentioned_drugs
+from patients.artifacts import get_patient_artifacts
+from utils.tokens import count_tokens, trim_history
+from utils.usage import empty_usage, message_usage, add_usage, usage_record
+from utils.profiler import profiled
+
+
+# Reply once a conversation has used up CONVERSATION_TOKEN_BUDGET
+CONVERSATION_BUDGET_EXHAUSTED_MSG = (
+    "This conversation has reached its length limit. Please press Clear to start a new "
+    "conversation, and RALPh will be happy to help with your other questions."
+)
 
 
 class ChatSystem:
@@ -29,7 +40,10 @@ class ChatSystem:
                  summaryllm, 
                  patient_details, 
                  prescription_details, 
-                 memory_char_limit=5000):
+                 memory_char_limit=5000,
+                 knowledge_base=None,
+                 logger=None,
+                 patient_record=None):
         """
         Initialize ChatSystem with required LLMs and settings.
         
@@ -40,6 +54,9 @@ class ChatSystem:
             patient_details: Patient information
             prescription_details: Prescription details
             memory_char_limit: Character limit for chat memory before summarizing
+            knowledge_base: Shared knowledge base (a new one is created if None)
+            logger: Shared logger (a new one is created if None)
+            patient_record: Parsed patient record (parsed from the details if None)
         """
         self.chatllm = chatllm
         self.chatllm_large = chatllm_large
@@ -48,16 +65,25 @@ class ChatSystem:
         self.prescription_details = prescription_details
         self.memory_char_limit = memory_char_limit
         
+        # Prompts, drug list and verification keys of the patient, shared with their other sessions
+        self.patient_artifacts = get_patient_artifacts(patient_details, prescription_details, patient_record)
+        
         # Initialize chat memory and state
         self.chat_memory = ChatMessageHistory()
         self.status_verified = False  # Set to TRUE for testing
         self.convo_number = 0
         self.turn_counter = 0
         
+        # Token usage and cost of the conversation so far, and of its last turn
+        self.token_usage = empty_usage()
+        self.last_turn_usage = empty_usage()
+        
         # Initialize logger and knowledge base
-        self.logger = ChatSystemLogger()
-        self.logger.start_conversation()
-        self.knowledge_base = KnowledgeBase()
+        if logger is None:
+            logger = ChatSystemLogger()
+            logger.start_conversation()
+        self.logger = logger
+        self.knowledge_base = knowledge_base if knowledge_base is not None else KnowledgeBase()
         
     def _get_chat_history_length(self):
         """
@@ -73,10 +99,10 @@ class ChatSystem:
         Summarize chat history if it exceeds character limit.
         
         Returns:
-            bool: True if summarization occurred
+            tuple: (True if summarization occurred, token usage of the summary call)
         """
         if len(self.chat_memory.messages) == 0:
-            return False
+            return False, None
         
         self.logger.logger.info("Summarising chat history...")
 
@@ -94,7 +120,72 @@ class ChatSystem:
         self.chat_memory.clear()
         self.chat_memory.add_message(summary)
         
-        return True
+        return True, message_usage(summary)
+    
+    @staticmethod
+    def _stage_timing(stage, llm, stage_start, usage=None, history_trimmed=0):
+        """
+        Build the timing and token usage record of a pipeline stage.
+        
+        Args:
+            stage (str): Stage name
+            llm: Model used by the stage (None for non-LLM stages)
+            stage_start (float): Start time of the stage
+            usage (dict): Token usage reported by the model (None if not reported)
+            history_trimmed (int): Chat history messages left out to fit the token budgets
+            
+        Returns:
+            dict: {"stage", "model", "duration"}, plus prompt_tokens, completion_tokens,
+                cost_usd and history_trimmed when known
+        """
+        model_name = getattr(llm, "model_name", None) if llm is not None else None
+        timing = {
+            "stage": stage,
+            "model": model_name,
+            "duration": time.time() - stage_start
+        }
+        timing.update(usage_record(model_name, usage))
+        if history_trimmed:
+            timing["history_trimmed"] = history_trimmed
+        return timing
+    
+    def _conversation_tokens_spent(self):
+        """Prompt and completion tokens used by the conversation's finished turns."""
+        return self.token_usage["prompt_tokens"] + self.token_usage["completion_tokens"]
+    
+    def conversation_budget_exhausted(self):
+        """
+        Check whether the conversation has used up CONVERSATION_TOKEN_BUDGET.
+        
+        Returns:
+            bool: True if the budget is set and used up; the conversation then gets no more
+                model calls until it is reset
+        """
+        return bool(CONVERSATION_TOKEN_BUDGET) and self._conversation_tokens_spent() >= CONVERSATION_TOKEN_BUDGET
+    
+    def _history_for_call(self, llm, prompt_text):
+        """
+        Get the chat history to send with a call, trimmed to the token budgets.
+        
+        The history may use up to HISTORY_TOKEN_BUDGET tokens and, if CONVERSATION_TOKEN_BUDGET
+        is set, no more than what is left of the conversation's budget after the rest of the prompt.
+        The history therefore shrinks as the conversation nears its budget; once the budget is
+        used up, process_message_stream stops the conversation instead of sending calls
+        without any history.
+        
+        Args:
+            llm: Model the call is sent to
+            prompt_text (str): Rest of the prompt (system prompt and user input)
+            
+        Returns:
+            tuple: (history messages, number of messages left out)
+        """
+        model_name = getattr(llm, "model_name", "gpt-4o")
+        budget = HISTORY_TOKEN_BUDGET or None
+        if CONVERSATION_TOKEN_BUDGET:
+            remaining = CONVERSATION_TOKEN_BUDGET - self._conversation_tokens_spent() - count_tokens(prompt_text, model_name)
+            budget = max(0, remaining if budget is None else min(budget, remaining))
+        return trim_history(self.chat_memory.messages, budget, model_name)
     
     def process_message(self, user_input):
         """
@@ -106,48 +197,91 @@ class ChatSystem:
         Returns:
             str: Response from the LLM
         """
+        return "".join(self.process_message_stream(user_input))
+    
+    @profiled("process_message", lambda self, *args, **kwargs: (self.logger, self.convo_number, self.turn_counter + 1))
+    def process_message_stream(self, user_input):
+        """
+        Process user input and stream the response as it is generated.
+        
+        The chat state is updated and the interaction logged once the response is complete.
+        Once the conversation has used up CONVERSATION_TOKEN_BUDGET, no model is called and
+        the response asks the patient to start a new conversation.
+        
+        Args:
+            user_input (str): User's message
+            
+        Yields:
+            str: Response chunks from the LLM
+        """
         # Start timing the process_message function
         start_time = time.time()
 
         kb_search_input = None
         kb_metadata = None
         kb_scores = None
+        kb_context_stats = None
+        stage_timings = []
+        budget_exhausted = self.conversation_budget_exhausted()
         
         # Trigger summarisation of chat history if it exceeds the char limit
-        if self._get_chat_history_length() > self.memory_char_limit:
-            self._summarize_chat_history()
+        if not budget_exhausted and self._get_chat_history_length() > self.memory_char_limit:
+            stage_start = time.time()
+            _, summary_usage = self._summarize_chat_history()
+            stage_timings.append(self._stage_timing("summarize_history", self.summaryllm, stage_start, summary_usage))
         
+        # Stop a conversation over its token budget, rather than answer without any history
+        if budget_exhausted:
+            self.logger.log_event(
+                "conversation_budget_exhausted",
+                tokens_spent=self._conversation_tokens_spent(),
+                token_budget=CONVERSATION_TOKEN_BUDGET
+            )
+            output_message = CONVERSATION_BUDGET_EXHAUSTED_MSG
+            yield output_message
+            
         # Check if status is already verified
-        if self.status_verified:
+        elif self.status_verified:
             # Pre-knowledge base query step
             pre_kb_prompt = ChatPromptTemplate.from_messages([
                 ("system", SYSTEM_PROMPT_IDENTIFY_TOPICS),
                 MessagesPlaceholder(variable_name="chat_history"),
                 ("human", "{input}")
             ])
+            pre_kb_history, trimmed = self._history_for_call(self.chatllm, SYSTEM_PROMPT_IDENTIFY_TOPICS + user_input)
             pre_kb_messages = pre_kb_prompt.format_messages(
                 input=user_input,
-                chat_history=self.chat_memory.messages
+                chat_history=pre_kb_history
             )
+            stage_start = time.time()
             pre_kb_response = self.chatllm(pre_kb_messages)
             pre_kb_output_message = pre_kb_response.content
+            stage_timings.append(self._stage_timing(
+                "topic_extraction", self.chatllm, stage_start, message_usage(pre_kb_response), trimmed
+            ))
 
             user_input_with_metadata = user_input + "\n" + pre_kb_output_message
             kb_search_input = pre_kb_output_message
 
-            # Retrieve relevant data from knowledge base
-            context_retrieved, metadata_list, score_list = self.knowledge_base.search(
-                user_input_with_metadata, 5
-            )
+            # Retrieve relevant data from knowledge base: direct (drug, section) lookup when the
+            # topic step names known drugs & topics, vector search for open-ended questions
+            stage_start = time.time()
+            kb_results = self.knowledge_base.lookup(user_input_with_metadata, pre_kb_output_message)
+            if kb_results is None:
+                # Restrict vector search to the patient's prescription, unless the question
+                # names other drugs in the knowledge base
+                patient_drugs = self.patient_artifacts.drug_names
+                named_drugs = mentioned_drugs(pre_kb_output_message, self.knowledge_base.section_index.drugs)
+                drug_filter = patient_drugs if named_drugs <= patient_drugs else None
+                kb_results = self.knowledge_base.search(user_input_with_metadata, 5, drugs=drug_filter)
+            context_retrieved, metadata_list, score_list, context_stats = kb_results
+            stage_timings.append(self._stage_timing("kb_retrieval", None, stage_start))
             kb_metadata = metadata_list
             kb_scores = score_list
+            kb_context_stats = context_stats
 
             # Build the counselling system prompt
-            counsel_system_prompt = build_counselling_system_prompt(
-                self.patient_details, 
-                self.prescription_details, 
-                context_retrieved
-            )
+            counsel_system_prompt = self.patient_artifacts.counselling_system_prompt(context_retrieved)
 
             chat_prompt = ChatPromptTemplate.from_messages([
                 ("system", counsel_system_prompt),
@@ -155,31 +289,42 @@ class ChatSystem:
                 ("human", "{input}")
             ])
             
+            counsel_history, trimmed = self._history_for_call(self.chatllm_large, counsel_system_prompt + user_input)
             messages = chat_prompt.format_messages(
                 input=user_input,
-                chat_history=self.chat_memory.messages
+                chat_history=counsel_history
             )
             
-            response = self.chatllm_large(messages)
-            output_message = response.content
+            stage_start = time.time()
+            output_chunks = []
+            usage = None
+            for chunk in self.chatllm_large.stream(messages):
+                output_chunks.append(chunk.content)
+                usage = add_usage(usage, message_usage(chunk))
+                yield chunk.content
+            output_message = "".join(output_chunks)
+            stage_timings.append(self._stage_timing("counselling", self.chatllm_large, stage_start, usage, trimmed))
             
         # Perform verification if status is not yet verified
         else:
-            verification_system_prompt = build_verification_system_prompt(
-                self.patient_details, self.prescription_details
-            ) 
-
-            verify_prompt = ChatPromptTemplate.from_messages([
-                SystemMessagePromptTemplate.from_template(verification_system_prompt),
-                HumanMessagePromptTemplate.from_template("{user_input}")
-            ])
-            
-            messages = verify_prompt.format_messages(user_input=user_input)
-            response = self.chatllm(messages)
-            output_message = response.content
+            # The verification prompt is precompiled per patient
+            messages = self.patient_artifacts.verification_template.format_messages(user_input=user_input)
+            stage_start = time.time()
+            output_chunks = []
+            usage = None
+            for chunk in self.chatllm.stream(messages):
+                output_chunks.append(chunk.content)
+                usage = add_usage(usage, message_usage(chunk))
+                yield chunk.content
+            output_message = "".join(output_chunks)
+            stage_timings.append(self._stage_timing("verification", self.chatllm, stage_start, usage))
             
             if "verified" in output_message.lower():
                 self.status_verified = True
+                # Record which identity details the patient's message matched in the record
+                self.logger.log_event(
+                    "verification_check", **self.patient_artifacts.check_verification(user_input)
+                )
         
         # Store the interaction in chat history
         self.chat_memory.add_message(HumanMessage(content=user_input))
@@ -188,6 +333,16 @@ class ChatSystem:
         # Increase the turn counter
         self.turn_counter += 1
 
+        # Add up the token usage of the turn's model calls
+        turn_usage = empty_usage()
+        for timing in stage_timings:
+            for key in turn_usage:
+                turn_usage[key] += timing.get(key) or 0
+        turn_usage["cost_usd"] = round(turn_usage["cost_usd"], 6)
+        add_usage(self.token_usage, turn_usage)
+        self.last_turn_usage = turn_usage
+        self.token_usage["cost_usd"] = round(self.token_usage["cost_usd"], 6)
+
         # Calculate process_message duration
         process_duration = time.time() - start_time
 
@@ -200,16 +355,52 @@ class ChatSystem:
             kb_search_input=kb_search_input,
             kb_metadata=kb_metadata,
             kb_scores=kb_scores,
+            kb_context_stats=kb_context_stats,
             verification_status=self.status_verified,
             intermediate_output=output_message,
-            process_duration=process_duration
+            process_duration=process_duration,
+            stage_timings=stage_timings,
+            token_usage={"turn": turn_usage, "conversation": dict(self.token_usage)}
         )
 
-        return output_message
+    def export_state(self):
+        """
+        Export the conversation state for the session store.
+
+        Returns:
+            dict: Chat history, verification status, counters, token usage and patient details
+        """
+        return {
+            "messages": list(self.chat_memory.messages),
+            "status_verified": self.status_verified,
+            "turn_counter": self.turn_counter,
+            "convo_number": self.convo_number,
+            "patient_details": self.patient_details,
+            "prescription_details": self.prescription_details,
+            "token_usage": dict(self.token_usage),
+        }
+
+    def load_state(self, state):
+        """
+        Restore a conversation state exported with export_state.
+
+        Args:
+            state (dict): Conversation state
+        """
+        self.chat_memory.clear()
+        self.chat_memory.add_messages(state["messages"])
+        self.status_verified = state["status_verified"]
+        self.turn_counter = state["turn_counter"]
+        self.convo_number = state["convo_number"]
+        self.patient_details = state["patient_details"]
+        self.prescription_details = state["prescription_details"]
+        self.token_usage = dict(state.get("token_usage") or empty_usage())
+        self.patient_artifacts = get_patient_artifacts(self.patient_details, self.prescription_details)
 
     def reset_chat(self):
         """Reset chat memory and turn counter to initial state"""
         self.chat_memory.clear()  # clear chat memory
         self.turn_counter = 0   # reset turn counter
         self.convo_number += 1  # increase the convo number
+        self.token_usage = empty_usage()  # the token budget is per conversation
         self.logger.logger.info("Chat system reset: memory cleared and started new convo")
\ No newline at end of file
@@ -27,18 +27,145 @@ EMAIL_SENDER = os.environ.get("EMAIL_SENDER")
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
 EMAIL_SMTP_SERVER = os.environ.get("EMAIL_SMTP_SERVER", "smtp.gmail.com")
 EMAIL_SMTP_PORT = int(os.environ.get("EMAIL_SMTP_PORT", "587"))
+EMAIL_SMTP_STARTTLS = os.environ.get("EMAIL_SMTP_STARTTLS", "true").lower() == "true"  # disable for a local test server
+EMAIL_SMTP_POOL_SIZE = int(os.environ.get("EMAIL_SMTP_POOL_SIZE", "2"))  # max open connections to the provider
+EMAIL_SMTP_IDLE_TIMEOUT = float(os.environ.get("EMAIL_SMTP_IDLE_TIMEOUT", "240"))  # seconds before an idle connection is closed
+EMAIL_SMTP_NOOP_INTERVAL = float(os.environ.get("EMAIL_SMTP_NOOP_INTERVAL", "30"))  # idle seconds before a NOOP check
+EMAIL_SMTP_MAX_MESSAGES = int(os.environ.get("EMAIL_SMTP_MAX_MESSAGES", "100"))  # messages per connection before reconnecting
 
 # Chat settings
 MEMORY_CHAR_LIMIT = int(os.environ.get("MEMORY_CHAR_LIMIT", "5000"))  # default memory char limit: 5k
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "6000"))  # chat history tokens sent with a call (oldest trimmed first)
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", "0"))  # tokens per conversation: history is trimmed to what is left, and the conversation stops once it is used up (0: no limit)
+
+# Knowledge base search backend: "iris" (exact search in IRIS) or "ann" (local faiss index)
+KB_SEARCH_BACKEND = os.environ.get("KB_SEARCH_BACKEND", "iris")
+
+# ANN index settings (only used when KB_SEARCH_BACKEND is "ann")
+KB_ANN_INDEX_DIR = os.environ.get("KB_ANN_INDEX_DIR", "dataset/ann_index")
+KB_ANN_INDEX_TYPE = os.environ.get("KB_ANN_INDEX_TYPE", "hnsw")  # "hnsw" or "ivf"
+KB_ANN_QUANTIZATION = os.environ.get("KB_ANN_QUANTIZATION", "int8")  # "none", "fp16", "int8" or "pq" (ivf only)
+KB_ANN_HNSW_M = int(os.environ.get("KB_ANN_HNSW_M", "32"))
+KB_ANN_EF_CONSTRUCTION = int(os.environ.get("KB_ANN_EF_CONSTRUCTION", "200"))
+KB_ANN_EF_SEARCH = int(os.environ.get("KB_ANN_EF_SEARCH", "64"))  # higher = better recall, slower search
+KB_ANN_NLIST = int(os.environ.get("KB_ANN_NLIST", "1024"))
+KB_ANN_NPROBE = int(os.environ.get("KB_ANN_NPROBE", "16"))  # higher = better recall, slower search
+KB_ANN_PQ_M = int(os.environ.get("KB_ANN_PQ_M", "64"))
+
+# Knowledge base context compression settings
+KB_COMPRESSION_ENABLED = os.environ.get("KB_COMPRESSION_ENABLED", "true").lower() == "true"
+KB_DEDUP_THRESHOLD = float(os.environ.get("KB_DEDUP_THRESHOLD", "0.8"))  # shingle similarity for near-duplicates
+KB_RELATIVE_SCORE_CUTOFF = float(os.environ.get("KB_RELATIVE_SCORE_CUTOFF", "0.9"))  # min similarity vs. best chunk
+KB_MIN_SENTENCE_SCORE = float(os.environ.get("KB_MIN_SENTENCE_SCORE", "0.2"))  # min sentence relevance vs. best sentence
+KB_MAX_CONTEXT_TOKENS = int(os.environ.get("KB_MAX_CONTEXT_TOKENS", "1500"))  # token cap for retrieved context
+KB_QUERY_CACHE_SIZE = int(os.environ.get("KB_QUERY_CACHE_SIZE", "1024"))  # query embeddings kept in memory
+
+# Text logging settings (per-sink levels: DEBUG, INFO, WARNING, ERROR or OFF)
+LOG_FILE_LEVEL = os.environ.get("LOG_FILE_LEVEL", "INFO")
+LOG_CONSOLE_LEVEL = os.environ.get("LOG_CONSOLE_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))  # records dropped beyond this
+LOG_ROTATION = os.environ.get("LOG_ROTATION", "size")  # "size" or "time"
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(20 * 1024 * 1024)))  # size rotation: 20MB
+LOG_ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN", "midnight")  # time rotation interval
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "14"))
+LOG_COMPRESS = os.environ.get("LOG_COMPRESS", "true").lower() == "true"  # gzip rotated files
+
+# Structured log writer settings
+STRUCTURED_LOG_QUEUE_SIZE = int(os.environ.get("STRUCTURED_LOG_QUEUE_SIZE", "10000"))  # records dropped beyond this
+STRUCTURED_LOG_BATCH_SIZE = int(os.environ.get("STRUCTURED_LOG_BATCH_SIZE", "100"))
+STRUCTURED_LOG_FLUSH_INTERVAL = float(os.environ.get("STRUCTURED_LOG_FLUSH_INTERVAL", "1.0"))  # seconds
+STRUCTURED_LOG_MAX_BYTES = int(os.environ.get("STRUCTURED_LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # rotate at 50MB
+STRUCTURED_LOG_ROTATE_SECONDS = float(os.environ.get("STRUCTURED_LOG_ROTATE_SECONDS", "86400"))  # rotate daily
+STRUCTURED_LOG_FSYNC = os.environ.get("STRUCTURED_LOG_FSYNC", "interval")  # "never", "interval" or "batch"
+STRUCTURED_LOG_MEMORY_LIMIT = int(os.environ.get("STRUCTURED_LOG_MEMORY_LIMIT", "100"))  # recent entries kept in memory
 
 # Directories
 LOG_DIR = "logging/logs"
 SUMMARIES_DIR = "logging/summaries"
 AUDIO_FILES_DIR = "logging/audiofiles"
+LOG_DB_PATH = os.environ.get("LOG_DB_PATH", os.path.join(LOG_DIR, "consolidated_logs.sqlite3"))
+REPORT_JOB_DB_PATH = os.environ.get("REPORT_JOB_DB_PATH", os.path.join(SUMMARIES_DIR, "report_jobs.sqlite3"))
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(AUDIO_FILES_DIR, "tts_cache"))
+
+# Report job queue settings (PDF summary and email delivery)
+REPORT_JOB_WORKERS = int(os.environ.get("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_MAX_ATTEMPTS = int(os.environ.get("REPORT_JOB_MAX_ATTEMPTS", "4"))
+REPORT_JOB_BACKOFF_SECONDS = float(os.environ.get("REPORT_JOB_BACKOFF_SECONDS", "5"))  # doubled for each retry
+REPORT_JOB_BATCH_SIZE = int(os.environ.get("REPORT_JOB_BATCH_SIZE", "10"))  # due reports emailed together over one SMTP session
+REPORT_SUMMARY_CACHE_SIZE = int(os.environ.get("REPORT_SUMMARY_CACHE_SIZE", "256"))  # conversation summaries kept in memory
+REPORT_SUMMARY_PRECOMPUTE = os.environ.get("REPORT_SUMMARY_PRECOMPUTE", "true").lower() == "true"  # update the summary after each turn
+PDF_ARCHIVE_ENABLED = os.environ.get("PDF_ARCHIVE_ENABLED", "true").lower() == "true"  # also save sent PDFs to SUMMARIES_DIR
+
+# Speech-to-text upload preprocessing settings
+STT_PREPROCESS_ENABLED = os.environ.get("STT_PREPROCESS_ENABLED", "true").lower() == "true"
+STT_SAMPLE_RATE = int(os.environ.get("STT_SAMPLE_RATE", "16000"))  # Hz, mono
+STT_VAD_THRESHOLD_DB = float(os.environ.get("STT_VAD_THRESHOLD_DB", "-45"))  # dBFS level below which frames are silence
+STT_VAD_PADDING_MS = int(os.environ.get("STT_VAD_PADDING_MS", "250"))  # audio kept around detected speech
+STT_CODEC = os.environ.get("STT_CODEC", "opus")  # "opus", "flac" or "wav" (opus/flac need soundfile)
+
+# Speech service settings
+SPEECH_MAX_CONCURRENCY = int(os.environ.get("SPEECH_MAX_CONCURRENCY", "4"))  # concurrent ElevenLabs calls
+SPEECH_MAX_QUEUE = int(os.environ.get("SPEECH_MAX_QUEUE", "16"))  # waiting calls before new calls are rejected
+SPEECH_TIMEOUT = float(os.environ.get("SPEECH_TIMEOUT", "30"))  # seconds per call
+
+# Pipeline scheduler settings (chat turns are admitted before background report work)
+SCHEDULER_TOTAL_SLOTS = int(os.environ.get("SCHEDULER_TOTAL_SLOTS", "8"))  # running tasks across all stages
+SCHEDULER_CHAT_CONCURRENCY = int(os.environ.get("SCHEDULER_CHAT_CONCURRENCY", "6"))
+SCHEDULER_CHAT_MAX_QUEUE = int(os.environ.get("SCHEDULER_CHAT_MAX_QUEUE", "12"))  # waiting turns before new turns are rejected
+SCHEDULER_CHAT_WAIT_TIMEOUT = float(os.environ.get("SCHEDULER_CHAT_WAIT_TIMEOUT", "20"))  # seconds a turn may wait for a slot
+SCHEDULER_SUMMARY_CONCURRENCY = int(os.environ.get("SCHEDULER_SUMMARY_CONCURRENCY", "2"))  # report summary LLM calls
+SCHEDULER_SUMMARY_MAX_QUEUE = int(os.environ.get("SCHEDULER_SUMMARY_MAX_QUEUE", "32"))
+SCHEDULER_REPORT_CONCURRENCY = int(os.environ.get("SCHEDULER_REPORT_CONCURRENCY", "2"))  # PDF rendering and email delivery
+SCHEDULER_REPORT_MAX_QUEUE = int(os.environ.get("SCHEDULER_REPORT_MAX_QUEUE", "32"))
+GRADIO_QUEUE_MAX_SIZE = int(os.environ.get("GRADIO_QUEUE_MAX_SIZE", "64"))  # pending UI events before new ones are rejected
+
+# Text-to-speech cache settings
+TTS_CACHE_ENABLED = os.environ.get("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))  # disk quota: 500MB
+TTS_CACHE_TTL_SECONDS = float(os.environ.get("TTS_CACHE_TTL_SECONDS", str(30 * 86400)))  # unused entries expire after 30 days
+
+# Analytics settings
+KB_LOW_CONFIDENCE_DISTANCE = float(os.environ.get("KB_LOW_CONFIDENCE_DISTANCE", "0.2"))  # best KB distance above this is low confidence
+
+# Headless API settings (python main.py --api)
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "7860"))
+API_MAX_SESSIONS = int(os.environ.get("API_MAX_SESSIONS", "200"))  # sessions held in memory per worker
+API_SESSION_IDLE_TIMEOUT = float(os.environ.get("API_SESSION_IDLE_TIMEOUT", "1800"))  # seconds before an idle session is dropped from memory
+
+# Session state store settings (conversation state shared by all workers)
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "sqlite")
+SESSION_STORE_PATH = os.environ.get("SESSION_STORE_PATH", os.path.join(LOG_DIR, "sessions.sqlite3"))
+SESSION_STATE_TTL = float(os.environ.get("SESSION_STATE_TTL", str(7 * 86400)))  # unused sessions are deleted after 7 days
+
+# Optional features; when disabled, their dependencies are never imported
+VOICE_ENABLED = os.environ.get("VOICE_ENABLED", "true").lower() == "true"  # speech-to-text input and spoken responses
+REPORTS_ENABLED = os.environ.get("REPORTS_ENABLED", "true").lower() == "true"  # PDF summaries sent by email
+
+# Patient record settings
+PATIENT_RECORDS_PATH = os.environ.get("PATIENT_RECORDS_PATH", "dataset/patient_records.json")  # local stand-in for the medical record
+DEFAULT_PATIENT_ID = os.environ.get("DEFAULT_PATIENT_ID")  # patient served by the UI (the demo patient if unset)
+PATIENT_ARTIFACT_CACHE_SIZE = int(os.environ.get("PATIENT_ARTIFACT_CACHE_SIZE", "512"))  # patients with precompiled prompts kept
+KB_DRUG_FILTER_OVERFETCH = int(os.environ.get("KB_DRUG_FILTER_OVERFETCH", "3"))  # candidates per result when filtering to the patient's drugs
+
+# Start-up warm-up settings
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_DEADLINE = float(os.environ.get("WARMUP_DEADLINE", "30"))  # seconds before the app reports ready regardless
+WARMUP_LLM_PING = os.environ.get("WARMUP_LLM_PING", "true").lower() == "true"  # send a 1-token request to each chat model
+
+# Client-side OpenAI rate limit settings (the budgets follow the provider's rate limit headers)
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_DEFAULT_RPM = int(os.environ.get("RATE_LIMIT_DEFAULT_RPM", "500"))  # requests per minute per model until reported
+RATE_LIMIT_DEFAULT_TPM = int(os.environ.get("RATE_LIMIT_DEFAULT_TPM", "200000"))  # tokens per minute per model until reported
+RATE_LIMIT_OUTPUT_TOKENS = int(os.environ.get("RATE_LIMIT_OUTPUT_TOKENS", "512"))  # completion tokens assumed before a call
+RATE_LIMIT_WAIT_TIMEOUT = float(os.environ.get("RATE_LIMIT_WAIT_TIMEOUT", "30"))  # seconds a call may wait for budget
+
+# Sampling profiler settings (python main.py --profile)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.05"))  # share of turns profiled
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))  # milliseconds between stack samples
+PROFILES_DIR = os.environ.get("PROFILES_DIR", os.path.join(LOG_DIR, "profiles"))  # collapsed stack files
 
-# Ensure required directories exist
-for directory in [LOG_DIR, SUMMARIES_DIR, AUDIO_FILES_DIR]:
-    os.makedirs(directory, exist_ok=True)
+# Directories are created by the components that write to them, on first use
 
 
 # Default patient and prescription details for testing
@@ -0,0 +1,332 @@
+# Approximate nearest neighbour (ANN) index for the knowledge base.
+
+import os
+import json
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+
+from config import (
+    KB_ANN_INDEX_TYPE,
+    KB_ANN_QUANTIZATION,
+    KB_ANN_HNSW_M,
+    KB_ANN_EF_CONSTRUCTION,
+    KB_ANN_EF_SEARCH,
+    KB_ANN_NLIST,
+    KB_ANN_NPROBE,
+    KB_ANN_PQ_M
+)
+
+
+# Faiss scalar quantizer types for each supported quantization option
+SCALAR_QUANTIZERS = {
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+}
+
+# Minimum number of training points per IVF list recommended by faiss
+MIN_POINTS_PER_LIST = 39
+
+# Product quantizer bits per sub-vector; training needs at least 2**PQ_NBITS vectors
+PQ_NBITS = 8
+
+# Scalar quantization used instead of PQ when there are too few vectors to train it
+PQ_FALLBACK_QUANTIZATION = "int8"
+
+
+class ANNIndex:
+    """
+    Faiss-backed HNSW or IVF index over knowledge base chunk embeddings.
+
+    The index is persisted in a directory containing:
+        - index.faiss: the faiss index
+        - docstore.jsonl: one line per indexed chunk (id, page_content, metadata)
+        - manifest.json: index parameters and build version
+
+    The index is loaded into the memory of each process that opens it (faiss does not
+    memory-map HNSW or quantized IVF indexes), so every worker holds its own copy.
+    """
+
+    def __init__(self,
+                 index_dir,
+                 dimension=1536,
+                 index_type=KB_ANN_INDEX_TYPE,
+                 quantization=KB_ANN_QUANTIZATION,
+                 hnsw_m=KB_ANN_HNSW_M,
+                 ef_construction=KB_ANN_EF_CONSTRUCTION,
+                 ef_search=KB_ANN_EF_SEARCH,
+                 nlist=KB_ANN_NLIST,
+                 nprobe=KB_ANN_NPROBE,
+                 pq_m=KB_ANN_PQ_M,
+                 read_only=False):
+        """
+        Initialize (and load, if present) the ANN index.
+
+        Args:
+            index_dir (str): Directory holding the index files
+            dimension (int): Embedding dimension
+            index_type (str): "hnsw" or "ivf"
+            quantization (str): "none", "fp16", "int8" or "pq" (ivf only)
+            hnsw_m (int): HNSW graph degree (higher = better recall, more memory)
+            ef_construction (int): HNSW build-time candidate list size
+            ef_search (int): HNSW query-time candidate list size (recall/latency trade-off)
+            nlist (int): Number of IVF lists
+            nprobe (int): Number of IVF lists probed per query (recall/latency trade-off)
+            pq_m (int): Number of product quantizer sub-vectors (ivf + pq only)
+            read_only (bool): Open the index for searching only (add and save are refused)
+        """
+        if index_type not in ("hnsw", "ivf"):
+            raise ValueError(f"Unsupported ANN index type: {index_type}")
+        if quantization not in ("none", "pq") and quantization not in SCALAR_QUANTIZERS:
+            raise ValueError(f"Unsupported ANN quantization: {quantization}")
+        if quantization == "pq" and index_type != "ivf":
+            raise ValueError("Product quantization is only supported for the ivf index type")
+
+        self.index_dir = index_dir
+        self.dimension = dimension
+        self.index_type = index_type
+        self.quantization = quantization
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.read_only = read_only
+
+        # Quantization the index was actually built with (see _create_index)
+        self.built_quantization = quantization
+
+        self.index_path = os.path.join(index_dir, "index.faiss")
+        self.docstore_path = os.path.join(index_dir, "docstore.jsonl")
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+
+        self.index = None
+        self.ids = []           # faiss row -> chunk id
+        self.documents = []     # faiss row -> Document
+        self._id_set = set()
+        self._loaded_version = None
+
+        self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def contains(self, chunk_id):
+        """Check whether a chunk is already indexed."""
+        return chunk_id in self._id_set
+
+    def _create_index(self, training_vectors):
+        """
+        Create (and train, if required) a new faiss index.
+
+        Args:
+            training_vectors (np.ndarray): Vectors used to train quantizers / IVF centroids
+
+        Returns:
+            faiss.Index: Empty, trained index
+        """
+        metric = faiss.METRIC_INNER_PRODUCT
+
+        if self.index_type == "hnsw":
+            if self.quantization == "none":
+                index = faiss.IndexHNSWFlat(self.dimension, self.hnsw_m, metric)
+            else:
+                index = faiss.IndexHNSWSQ(
+                    self.dimension, SCALAR_QUANTIZERS[self.quantization], self.hnsw_m, metric
+                )
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            # Clamp the number of lists so every centroid gets enough training points
+            nlist = max(1, min(self.nlist, len(training_vectors) // MIN_POINTS_PER_LIST))
+            coarse_quantizer = faiss.IndexFlatIP(self.dimension)
+
+            # PQ training needs 2**PQ_NBITS vectors per sub-quantizer codebook; small
+            # knowledge bases use scalar quantization instead (rebuild the index to switch)
+            quantization = self.quantization
+            if quantization == "pq" and len(training_vectors) < 2 ** PQ_NBITS:
+                quantization = PQ_FALLBACK_QUANTIZATION
+            self.built_quantization = quantization
+
+            if quantization == "none":
+                index = faiss.IndexIVFFlat(coarse_quantizer, self.dimension, nlist, metric)
+            elif quantization == "pq":
+                index = faiss.IndexIVFPQ(coarse_quantizer, self.dimension, nlist, self.pq_m, PQ_NBITS, metric)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(
+                    coarse_quantizer, self.dimension, nlist, SCALAR_QUANTIZERS[quantization], metric
+                )
+
+        if not index.is_trained:
+            index.train(training_vectors)
+
+        return index
+
+    def _apply_search_params(self):
+        """Apply the query-time recall/latency parameters to the loaded index."""
+        if self.index is None:
+            return
+        if self.index_type == "hnsw":
+            self.index.hnsw.efSearch = self.ef_search
+        else:
+            faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+
+    @staticmethod
+    def _normalize(vectors):
+        """Convert to a contiguous float32 matrix of unit vectors (cosine similarity)."""
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def add(self, ids, vectors, documents, metadatas):
+        """
+        Incrementally add chunks to the index, skipping chunks that are already indexed.
+
+        Args:
+            ids (list): Chunk IDs
+            vectors (list): Chunk embeddings
+            documents (list): Chunk texts
+            metadatas (list): Chunk metadata dicts
+
+        Returns:
+            int: Number of chunks added
+        """
+        if self.read_only:
+            raise RuntimeError("Cannot add to an ANN index opened read-only")
+
+        new_rows = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._id_set]
+        if not new_rows:
+            return 0
+
+        matrix = self._normalize([vectors[i] for i in new_rows])
+        if self.index is None:
+            self.index = self._create_index(matrix)
+            self._apply_search_params()
+        self.index.add(matrix)
+
+        # Append the new chunks to the docstore in the same order as the faiss rows
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.docstore_path, "a", encoding="utf-8") as f:
+            for i in new_rows:
+                record = {"id": ids[i], "page_content": documents[i], "metadata": metadatas[i] or {}}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._append_document(record)
+
+        return len(new_rows)
+
+    def _append_document(self, record):
+        """Register a docstore record in memory."""
+        self.ids.append(record["id"])
+        self.documents.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+        self._id_set.add(record["id"])
+
+    def save(self):
+        """Persist the index atomically and bump the build version."""
+        if self.index is None:
+            return
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+        version = (self._loaded_version or 0) + 1
+        manifest = {
+            "version": version,
+            "count": len(self.ids),
+            "dimension": self.dimension,
+            "index_type": self.index_type,
+            "quantization": self.quantization,
+            "built_quantization": self.built_quantization,
+            "hnsw_m": self.hnsw_m,
+            "ef_construction": self.ef_construction,
+            "nlist": self.nlist,
+            "pq_m": self.pq_m,
+        }
+        with open(self.manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        self._loaded_version = version
+
+    def _read_manifest(self):
+        """Read the manifest, or None if the index has not been built."""
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self):
+        """
+        Load the index and docstore from disk, if present.
+
+        Returns:
+            bool: True if an index was loaded
+        """
+        manifest = self._read_manifest()
+        if manifest is None or not os.path.exists(self.index_path):
+            return False
+
+        if manifest["index_type"] != self.index_type or manifest["quantization"] != self.quantization:
+            raise ValueError(
+                f"ANN index at {self.index_dir} was built as {manifest['index_type']}/{manifest['quantization']}, "
+                f"expected {self.index_type}/{self.quantization}"
+            )
+
+        self.index = faiss.read_index(self.index_path)
+        self.built_quantization = manifest.get("built_quantization", manifest["quantization"])
+        self._apply_search_params()
+
+        self.ids, self.documents, self._id_set = [], [], set()
+        with open(self.docstore_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+
+        # Ignore chunks appended after the last save
+        records = lines[:self.index.ntotal]
+        for line in records:
+            self._append_document(json.loads(line))
+
+        # Drop unsaved docstore rows so that later appends stay aligned with the faiss rows
+        if not self.read_only and len(lines) > len(records):
+            with open(self.docstore_path, "w", encoding="utf-8") as f:
+                f.writelines(records)
+
+        self._loaded_version = manifest["version"]
+        return True
+
+    def refresh(self):
+        """
+        Reload the index if another process has saved a newer build.
+
+        Returns:
+            bool: True if the index was reloaded
+        """
+        manifest = self._read_manifest()
+        if manifest is None or manifest["version"] == self._loaded_version:
+            return False
+        return self.load()
+
+    def search(self, query_vector, k=5):
+        """
+        Search the index for the nearest chunks.
+
+        Args:
+            query_vector (list): Query embedding
+            k (int): Number of results
+
+        Returns:
+            list: (Document, score) tuples, where score is the cosine distance (lower is better)
+        """
+        if self.index is None or self.index.ntotal == 0:
+            return []
+
+        similarities, rows = self.index.search(self._normalize(query_vector), k)
+
+        results = []
+        for similarity, row in zip(similarities[0], rows[0]):
+            if row < 0 or row >= len(self.documents):
+                continue
+            results.append((self.documents[row], float(1.0 - similarity)))
+        return results
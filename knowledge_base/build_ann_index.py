@@ -0,0 +1,42 @@
+"""
+Build or incrementally update the knowledge base ANN index from the IRIS collection.
+
+Usage:
+    python -m knowledge_base.build_ann_index
+"""
+
+import argparse
+
+from config import (
+    KB_ANN_INDEX_DIR,
+    KB_ANN_INDEX_TYPE,
+    KB_ANN_QUANTIZATION
+)
+from knowledge_base.ann_index import ANNIndex
+from knowledge_base.vector_store import KnowledgeBase
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Build the RALPh knowledge base ANN index")
+    parser.add_argument("--index-dir", default=KB_ANN_INDEX_DIR, help="Directory for the index files")
+    parser.add_argument("--index-type", default=KB_ANN_INDEX_TYPE, choices=["hnsw", "ivf"])
+    parser.add_argument("--quantization", default=KB_ANN_QUANTIZATION, choices=["none", "fp16", "int8", "pq"])
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks read from IRIS per query")
+    return parser.parse_args()
+
+
+def main():
+    """Add all IRIS chunks that are not yet indexed to the ANN index"""
+    args = parse_args()
+
+    ann_index = ANNIndex(args.index_dir, index_type=args.index_type, quantization=args.quantization)
+    print(f"Loaded ANN index with {len(ann_index)} chunks")
+
+    knowledge_base = KnowledgeBase(search_backend="iris")
+    added = knowledge_base.sync_ann_index(ann_index, batch_size=args.batch_size)
+    print(f"Added {added} chunks, index now holds {len(ann_index)} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# Post-retrieval compression of knowledge base context.
+
+import re
+import math
+
+from config import (
+    KB_DEDUP_THRESHOLD,
+    KB_RELATIVE_SCORE_CUTOFF,
+    KB_MIN_SENTENCE_SCORE,
+    KB_MAX_CONTEXT_TOKENS
+)
+from utils.tokens import count_tokens
+
+
+# Words that carry no signal when matching sentences against a query
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "has", "have", "how", "i", "if", "in", "is", "it", "its", "my", "of",
+    "on", "or", "should", "so", "that", "the", "this", "to", "was", "what", "when",
+    "which", "will", "with", "you", "your", "drug", "topic", "answer", "mg", "tablet",
+    "tablets", "tab",
+}
+
+HEADER_PREFIX = "Drug name:"
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[^\d\s][.!?])\s+(?=[A-Z(])")
+XML_OVERHEAD_TOKENS = count_tokens('<content id="0">\n\n</content>\n\n')
+
+
+def _words(text):
+    """Lowercase word tokens of a text, without stopwords."""
+    return [w for w in WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+
+
+def _shingles(text, size=3):
+    """Set of word n-grams used for near-duplicate detection."""
+    words = _words(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a, b):
+    """Jaccard similarity of two sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def format_context_xml(chunks):
+    """
+    Format retrieved chunks as the XML context passed to the LLM.
+
+    Args:
+        chunks (list): List of (chunk_id, text) tuples
+
+    Returns:
+        str: XML formatted context
+    """
+    xml_content = ""
+    for chunk_id, text in chunks:
+        xml_content += f'<content id="{chunk_id}">\n{text}\n</content>\n\n'
+    return xml_content
+
+
+class ContextCompressor:
+    """
+    Removes redundant retrieved chunks and keeps only the sentences relevant to the query.
+    """
+
+    def __init__(self,
+                 dedup_threshold=KB_DEDUP_THRESHOLD,
+                 relative_score_cutoff=KB_RELATIVE_SCORE_CUTOFF,
+                 min_sentence_score=KB_MIN_SENTENCE_SCORE,
+                 max_context_tokens=KB_MAX_CONTEXT_TOKENS):
+        """
+        Initialize the compressor.
+
+        Args:
+            dedup_threshold (float): Shingle Jaccard similarity above which a chunk is a near-duplicate
+            relative_score_cutoff (float): Minimum similarity relative to the best chunk (0-1)
+            min_sentence_score (float): Minimum sentence relevance relative to the best sentence (0-1)
+            max_context_tokens (int): Token cap for the compressed context
+        """
+        self.dedup_threshold = dedup_threshold
+        self.relative_score_cutoff = relative_score_cutoff
+        self.min_sentence_score = min_sentence_score
+        self.max_context_tokens = max_context_tokens
+
+    def _filter_by_score(self, docs_with_score):
+        """
+        Drop chunks whose similarity is far below the best chunk.
+
+        IRIS returns cosine distances (lower is better), so scores are converted to
+        similarities before applying the relative cutoff.
+        """
+        if not docs_with_score:
+            return []
+
+        similarities = [1.0 - score if score is not None else 1.0 for _, score in docs_with_score]
+        best = max(similarities)
+        threshold = best * self.relative_score_cutoff
+
+        return [
+            (i, doc, score)
+            for i, ((doc, score), similarity) in enumerate(zip(docs_with_score, similarities))
+            if similarity >= threshold
+        ]
+
+    def _deduplicate(self, ranked_chunks):
+        """Drop chunks that are near-duplicates of a higher ranked chunk."""
+        kept = []
+        kept_shingles = []
+        for chunk_id, doc, score in ranked_chunks:
+            shingles = _shingles(self._strip_header(doc.page_content)[1])
+            if any(_jaccard(shingles, other) >= self.dedup_threshold for other in kept_shingles):
+                continue
+            kept.append((chunk_id, doc, score))
+            kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def _strip_header(text):
+        """Split the 'Drug name:' header line from the chunk body."""
+        lines = text.split("\n", 1)
+        if lines and lines[0].startswith(HEADER_PREFIX):
+            return lines[0], (lines[1] if len(lines) > 1 else "")
+        return None, text
+
+    @staticmethod
+    def _split_units(body):
+        """
+        Split a chunk body into (heading_chain, sentence) units.
+
+        Markdown headings are not units themselves; they are attached to the sentences
+        under them so that selected sentences keep their section context.
+        """
+        units = []
+        headings = {}
+        for line in body.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                level = len(line) - len(line.lstrip("#"))
+                headings = {lvl: text for lvl, text in headings.items() if lvl < level}
+                headings[level] = line
+                continue
+            chain = tuple(headings[lvl] for lvl in sorted(headings))
+            for sentence in SENTENCE_SPLIT_PATTERN.split(line):
+                if sentence.strip():
+                    units.append((chain, sentence.strip()))
+        return units
+
+    @staticmethod
+    def _term_weights(query_terms, units):
+        """
+        Weight query terms by inverse document frequency over the candidate sentences.
+
+        Terms that appear in nearly every sentence (e.g. the drug name) carry little signal.
+        """
+        document_frequency = dict.fromkeys(query_terms, 0)
+        for chain, sentence in units:
+            for word in query_terms & set(_words(sentence + " " + " ".join(chain))):
+                document_frequency[word] += 1
+        total = max(1, len(units))
+        return {
+            word: math.log(1 + total / count)
+            for word, count in document_frequency.items() if count
+        }
+
+    @staticmethod
+    def _score_sentence(sentence, heading_chain, term_weights):
+        """Score a sentence by the weighted query terms it (or its headings) contain."""
+        words = set(_words(sentence))
+        if not words:
+            return 0.0
+        heading_words = set(_words(" ".join(heading_chain))) - words
+        overlap = sum(term_weights.get(w, 0.0) for w in words)
+        overlap += 0.5 * sum(term_weights.get(w, 0.0) for w in heading_words)
+        return overlap / math.sqrt(len(words))
+
+    def compress(self, query, docs_with_score):
+        """
+        Compress retrieved chunks into a smaller XML context.
+
+        Args:
+            query (str): The search query
+            docs_with_score (list): List of (Document, score) tuples from the vector store
+
+        Returns:
+            tuple: (xml_content, stats)
+        """
+        original_xml = format_context_xml(
+            [(i, doc.page_content) for i, (doc, _) in enumerate(docs_with_score)]
+        )
+
+        ranked = self._filter_by_score(docs_with_score)
+        dropped_low_score = len(docs_with_score) - len(ranked)
+        kept = self._deduplicate(ranked)
+        dropped_duplicate = len(ranked) - len(kept)
+
+        # Score every sentence of every kept chunk against the query
+        chunk_parts = {}
+        for chunk_id, doc, _ in kept:
+            header, body = self._strip_header(doc.page_content)
+            chunk_parts[chunk_id] = (header, self._split_units(body))
+
+        all_units = [unit for _, units in chunk_parts.values() for unit in units]
+        term_weights = self._term_weights(set(_words(query)), all_units)
+
+        scored = []
+        for rank, (chunk_id, _, _) in enumerate(kept):
+            for position, (chain, sentence) in enumerate(chunk_parts[chunk_id][1]):
+                score = self._score_sentence(sentence, chain, term_weights)
+                if score > 0:
+                    scored.append((score, rank, position, chunk_id))
+
+        # Keep sentences whose relevance is close enough to the best sentence
+        best_score = max((score for score, _, _, _ in scored), default=0.0)
+        candidates = [
+            (-score, rank, position, chunk_id)
+            for score, rank, position, chunk_id in scored
+            if score >= best_score * self.min_sentence_score
+        ]
+
+        # Fall back to the best chunk in reading order if nothing matches the query
+        if not candidates and kept:
+            chunk_id = kept[0][0]
+            candidates = [(0.0, 0, position, chunk_id) for position in range(len(chunk_parts[chunk_id][1]))]
+
+        # Greedily select the most relevant sentences within the token cap
+        selected = {}
+        used_tokens = 0
+        for _, _, position, chunk_id in sorted(candidates):
+            header, units = chunk_parts[chunk_id]
+            chain, sentence = units[position]
+            cost = count_tokens(sentence)
+            if chunk_id not in selected:
+                cost += count_tokens(header or "") + XML_OVERHEAD_TOKENS
+            cost += sum(count_tokens(h) for h in chain if not self._has_heading(selected.get(chunk_id), units, h))
+            if used_tokens + cost > self.max_context_tokens:
+                continue
+            selected.setdefault(chunk_id, set()).add(position)
+            used_tokens += cost
+
+        # Reassemble the selected sentences per chunk, in original order
+        chunks = []
+        for chunk_id, _, _ in kept:
+            if chunk_id not in selected:
+                continue
+            header, units = chunk_parts[chunk_id]
+            lines = [header] if header else []
+            emitted_headings = set()
+            for position in sorted(selected[chunk_id]):
+                chain, sentence = units[position]
+                for heading in chain:
+                    if heading not in emitted_headings:
+                        lines.append(heading)
+                        emitted_headings.add(heading)
+                lines.append(sentence)
+            chunks.append((chunk_id, "\n".join(lines)))
+
+        xml_content = format_context_xml(chunks)
+        stats = {
+            "chunks_retrieved": len(docs_with_score),
+            "chunks_kept": len(chunks),
+            "dropped_low_score": dropped_low_score,
+            "dropped_duplicate": dropped_duplicate,
+            "tokens_original": count_tokens(original_xml),
+            "tokens_compressed": count_tokens(xml_content),
+        }
+        return xml_content, stats
+
+    @staticmethod
+    def _has_heading(positions, units, heading):
+        """Check whether a heading is already emitted by previously selected sentences."""
+        if not positions:
+            return False
+        return any(heading in units[p][0] for p in positions)
@@ -0,0 +1,52 @@
+# Module for caching query embeddings.
+
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embedding model wrapper that keeps the embeddings of recent queries.
+
+    Document embeddings are passed through uncached; query embeddings are kept in an
+    LRU cache, so repeated queries skip the embedding call.
+    """
+
+    def __init__(self, embeddings, max_entries=1024):
+        """
+        Initialize the cache.
+
+        Args:
+            embeddings (Embeddings): Embedding model
+            max_entries (int): Number of query embeddings kept
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # query -> embedding, least recently used first
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self._lock:
+            embedding = self._cache.get(text)
+            if embedding is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return embedding
+            self.misses += 1
+
+        embedding = self.embeddings.embed_query(text)
+
+        with self._lock:
+            self._cache[text] = embedding
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return embedding
@@ -0,0 +1,254 @@
+# Structured (drug, section) index for direct chunk lookup without vector search.
+
+import os
+import re
+
+
+# Canonical monograph sections, matched against the markdown headings of each chunk
+SECTION_HEADINGS = [
+    ("mechanism_of_action", re.compile(r"mechanism of action", re.I)),
+    ("indication", re.compile(r"indication", re.I)),
+    ("lifestyle", re.compile(r"non[\s-]*pharmacological", re.I)),
+    ("administration_storage", re.compile(r"administration|storage|counselling points", re.I)),
+    ("pregnancy_breastfeeding", re.compile(r"pregnancy|breastfeeding", re.I)),
+    ("side_effects", re.compile(r"side effects", re.I)),
+    ("interactions", re.compile(r"interactions", re.I)),
+]
+
+# Keywords identifying each section in the topics named by the topic identification step
+TOPIC_KEYWORDS = [
+    ("mechanism_of_action", re.compile(r"mechanism|how it works", re.I)),
+    ("lifestyle", re.compile(r"non[\s-]*pharmacological|lifestyle", re.I)),
+    ("indication", re.compile(r"indication|disease", re.I)),
+    ("administration_storage", re.compile(r"administration|storage", re.I)),
+    ("pregnancy_breastfeeding", re.compile(r"pregnan|breastfeed", re.I)),
+    ("side_effects", re.compile(r"side effect", re.I)),
+    ("interactions", re.compile(r"interaction", re.I)),
+]
+
+HEADER_PATTERN = re.compile(r"^Drug name:\s*(.+)$", re.M)
+HEADING_PATTERN = re.compile(r"^\s*(#+)\s*(.+?)\s*$", re.M)
+# Field names only count at the start of a line or after the "; " field separator, so that
+# "drug:" inside the free-text answer does not start a new field
+FIELD_PATTERN = re.compile(r"(?:^|;)[ \t]*(Drug|Topic|Answer)\s*:", re.I | re.M)
+
+MAX_DRUG_NAME_WORDS = 3
+
+# Words that may accompany a drug name in the topic step output without naming another drug
+DRUG_FIELD_FILLER = {
+    "and", "or", "tablet", "tablets", "tab", "tabs", "capsule", "capsules", "mg", "mcg", "xr",
+    "sr", "er", "oral", "the", "of", "dose", "dosage", "unit", "units", "iu", "ml",
+}
+
+
+def extract_drug(page_content, source=None):
+    """
+    Extract the drug name of a chunk.
+
+    Args:
+        page_content (str): Chunk text (starting with the "Drug name:" prefix added at ingestion)
+        source (str): Source document path
+
+    Returns:
+        str: Upper-case drug name, or None if unknown
+    """
+    match = HEADER_PATTERN.search(page_content)
+    if match:
+        return match.group(1).strip().upper()
+    if source:
+        return os.path.splitext(os.path.basename(source))[0].upper()
+    return None
+
+
+def extract_sections(page_content):
+    """
+    Extract the canonical sections covered by a chunk, in order of appearance.
+
+    Args:
+        page_content (str): Chunk text
+
+    Returns:
+        list: Section keys
+    """
+    sections = []
+    for hashes, heading in HEADING_PATTERN.findall(page_content):
+        for section, pattern in SECTION_HEADINGS:
+            # Sub-headings only mark the lifestyle counselling nested under the indication
+            if len(hashes) > 1 and section != "lifestyle":
+                continue
+            if pattern.search(heading):
+                if section not in sections:
+                    sections.append(section)
+                break
+    return sections
+
+
+def extract_chunk_metadata(page_content, source=None):
+    """
+    Build the drug/section metadata stored with each chunk at ingestion.
+
+    Args:
+        page_content (str): Chunk text
+        source (str): Source document path
+
+    Returns:
+        dict: {"drug": str, "section": str} where section is the chunk's primary section
+    """
+    sections = extract_sections(page_content)
+    return {
+        "drug": extract_drug(page_content, source),
+        "section": sections[0] if sections else None,
+    }
+
+
+def _topic_fields(topic_output):
+    """Split the topic identification output into its lower-case named fields."""
+    parts = FIELD_PATTERN.split(topic_output)
+    fields = {}
+    for name, value in zip(parts[1::2], parts[2::2]):
+        # Keep the first value of each field; everything after the answer starts is answer text
+        fields.setdefault(name.lower(), value)
+        if "answer" in fields:
+            break
+    return {name: value.strip(" ;\n\"'") for name, value in fields.items()}
+
+
+def _match_drugs(drug_field, known_drugs):
+    """
+    Match the words of a drug field against the known drug names.
+
+    Returns:
+        tuple: (drugs, leftover_words) with the matched upper-case drug names and the
+            words that are neither part of a known drug name nor dosage filler
+    """
+    words = re.findall(r"[a-z][a-z\-]*", drug_field.lower())
+    drugs = []
+    leftover_words = []
+    i = 0
+    while i < len(words):
+        # Match the longest known (possibly multi-word) drug name starting at this word
+        for n in range(min(MAX_DRUG_NAME_WORDS, len(words) - i), 0, -1):
+            candidate = " ".join(words[i:i + n]).upper()
+            if candidate in known_drugs:
+                if candidate not in drugs:
+                    drugs.append(candidate)
+                i += n
+                break
+        else:
+            if words[i] not in DRUG_FIELD_FILLER and not re.fullmatch(r"(mg|mcg|ml|g)", words[i]):
+                leftover_words.append(words[i])
+            i += 1
+    return drugs, leftover_words
+
+
+def mentioned_drugs(topic_output, known_drugs):
+    """
+    Find the known drugs named by the topic identification step.
+
+    Args:
+        topic_output (str): Output formatted as "Drug: ...; Topic: ...; Answer: ..."
+        known_drugs (set): Upper-case drug names present in the index
+
+    Returns:
+        set: Upper-case drug names
+    """
+    return set(_match_drugs(_topic_fields(topic_output).get("drug", ""), known_drugs)[0])
+
+
+def parse_topic_output(topic_output, known_drugs):
+    """
+    Parse the drugs and sections named by the topic identification step.
+
+    Args:
+        topic_output (str): Output formatted as "Drug: ...; Topic: ...; Answer: ..."
+        known_drugs (set): Upper-case drug names present in the index
+
+    Returns:
+        tuple: (drugs, sections), or None if the query is open-ended, names an
+            unknown drug or a topic without a matching section
+    """
+    fields = _topic_fields(topic_output)
+    drug_field = fields.get("drug", "")
+    topic_field = fields.get("topic", "")
+    if not drug_field or not topic_field:
+        return None
+
+    # Every word in the drug field must belong to a known drug name or be dosage filler
+    drugs, leftover_words = _match_drugs(drug_field, known_drugs)
+    if not drugs or leftover_words:
+        return None
+
+    # Every named topic must map to a section; unquoted topics are matched by keyword
+    topics = [t for t in re.split(r"['\"]", topic_field) if re.sub(r"\b(and|or)\b|[,;\s]", "", t)]
+    if len(topics) == 1:
+        sections = [key for key, pattern in TOPIC_KEYWORDS if pattern.search(topic_field)]
+    else:
+        sections = []
+        for topic in topics:
+            section = next((key for key, pattern in TOPIC_KEYWORDS if pattern.search(topic)), None)
+            if section is None:
+                return None
+            if section not in sections:
+                sections.append(section)
+    if not sections:
+        return None
+
+    return drugs, sections
+
+
+class SectionIndex:
+    """
+    Exact (drug, section) -> chunk index built from the knowledge base contents.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.chunks = {}   # (drug, section) -> list of (chunk_id, Document)
+        self.drugs = set()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add(self, chunk_id, document):
+        """
+        Index a chunk under every section it covers.
+
+        Args:
+            chunk_id: Chunk ID
+            document (Document): Chunk document
+        """
+        metadata = document.metadata or {}
+        drug = metadata.get("drug") or extract_drug(document.page_content, metadata.get("source"))
+        if not drug:
+            return
+
+        self.drugs.add(drug)
+        for section in extract_sections(document.page_content):
+            entries = self.chunks.setdefault((drug, section), [])
+            if all(existing_id != chunk_id for existing_id, _ in entries):
+                entries.append((chunk_id, document))
+
+    def lookup(self, drugs, sections):
+        """
+        Fetch the chunks for every (drug, section) pair.
+
+        Args:
+            drugs (list): Upper-case drug names
+            sections (list): Section keys
+
+        Returns:
+            list: Documents in (drug, section) order without duplicates, or None if any
+                pair is missing from the index
+        """
+        documents = []
+        seen = set()
+        for drug in drugs:
+            for section in sections:
+                entries = self.chunks.get((drug, section))
+                if not entries:
+                    return None
+                for chunk_id, document in entries:
+                    if chunk_id not in seen:
+                        seen.add(chunk_id)
+                        documents.append(document)
+        return documents
@@ -1,9 +1,22 @@
 # Module for connecting to and querying the vector database.
 
-# from langchain.embeddings.openai import OpenAIEmbeddings   # deprecated
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_iris import IRISVector
-from config import IRIS_CONNECTION_STRING, IRIS_COLLECTION_NAME
+import json
+
+from langchain_core.documents import Document
+from config import (
+    IRIS_CONNECTION_STRING,
+    IRIS_COLLECTION_NAME,
+    KB_COMPRESSION_ENABLED,
+    KB_SEARCH_BACKEND,
+    KB_ANN_INDEX_DIR,
+    KB_QUERY_CACHE_SIZE,
+    KB_DRUG_FILTER_OVERFETCH
+)
+from knowledge_base.compression import ContextCompressor, format_context_xml
+from knowledge_base.section_index import SectionIndex, parse_topic_output, extract_drug
+from knowledge_base.query_cache import CachedQueryEmbeddings
+from utils.tokens import count_tokens
+from models.rate_limiter import rate_limited_embeddings
 
 
 class KnowledgeBase:
@@ -11,10 +24,20 @@ class KnowledgeBase:
     Handles interactions with the IRIS vector database.
     """
     
-    def __init__(self):
-        """Initialize the knowledge base with embeddings and database connection."""
-        # Initialize embedding model
-        self.embeddings = OpenAIEmbeddings()
+    def __init__(self, search_backend=KB_SEARCH_BACKEND):
+        """
+        Initialize the knowledge base with embeddings and database connection.
+        
+        Args:
+            search_backend (str): "iris" for exact search in IRIS, "ann" for the local ANN index
+        """
+        # Imported here, so that importing the chat system does not load the database drivers
+        # from langchain.embeddings.openai import OpenAIEmbeddings   # deprecated
+        from langchain_community.embeddings import OpenAIEmbeddings
+        from langchain_iris import IRISVector
+        
+        # Initialize embedding model (query embeddings are cached, so cache hits skip the rate limiter)
+        self.embeddings = CachedQueryEmbeddings(rate_limited_embeddings(OpenAIEmbeddings()), KB_QUERY_CACHE_SIZE)
         
         # Connect to the database
         self.db = IRISVector(
@@ -23,6 +46,18 @@ class KnowledgeBase:
             collection_name=IRIS_COLLECTION_NAME,
             connection_string=IRIS_CONNECTION_STRING,
         )
+        
+        # Optional ANN index (opened read-only; built with knowledge_base.build_ann_index)
+        self.ann_index = None
+        if search_backend == "ann":
+            from knowledge_base.ann_index import ANNIndex
+            self.ann_index = ANNIndex(KB_ANN_INDEX_DIR, read_only=True)
+        
+        # Post-retrieval context compression
+        self.compressor = ContextCompressor() if KB_COMPRESSION_ENABLED else None
+        
+        # Exact (drug, section) index for direct lookups
+        self.section_index = self._build_section_index()
     
     def get_document_count(self):
         """
@@ -33,29 +68,201 @@ class KnowledgeBase:
         """
         return len(self.db.get()['ids'])
     
-    def search(self, query, top_docs=5):
+    def _read_chunks(self, ids=None, with_embeddings=False):
+        """
+        Read stored chunks from the IRIS collection table.
+        
+        IRISVector.get only returns chunk IDs, so the table is queried directly.
+        
+        Args:
+            ids (list): Chunk IDs to read (all chunks if None)
+            with_embeddings (bool): Also read the stored embedding of each chunk
+            
+        Returns:
+            dict: "ids", "documents", "metadatas" (and "embeddings") lists in the same order
+        """
+        from sqlalchemy.orm import Session
+        
+        table = self.db.table
+        columns = [table.c.id, table.c.document, table.c.metadata]
+        if with_embeddings:
+            columns.append(table.c.embedding)
+        
+        with Session(self.db._conn) as session:
+            query = session.query(*columns)
+            if ids is not None:
+                query = query.filter(table.c.id.in_(ids))
+            rows = query.all()
+        
+        records = {
+            "ids": [row.id for row in rows],
+            "documents": [row.document for row in rows],
+            "metadatas": [json.loads(row.metadata) if row.metadata else {} for row in rows],
+        }
+        if with_embeddings:
+            records["embeddings"] = [self._parse_vector(row.embedding) for row in rows]
+        return records
+    
+    @staticmethod
+    def _parse_vector(value):
+        """Convert a stored embedding (list or comma-separated string) to a list of floats."""
+        if isinstance(value, str):
+            value = value.strip("[]").split(",")
+        return [float(v) for v in value]
+    
+    def _build_section_index(self):
+        """
+        Build the (drug, section) index from the chunks in the knowledge base.
+        
+        Returns:
+            SectionIndex: Index over all chunks
+        """
+        section_index = SectionIndex()
+        
+        if self.ann_index is not None:
+            for chunk_id, document in zip(self.ann_index.ids, self.ann_index.documents):
+                section_index.add(chunk_id, document)
+        else:
+            records = self._read_chunks()
+            for chunk_id, text, metadata in zip(records['ids'], records['documents'], records['metadatas']):
+                section_index.add(chunk_id, Document(page_content=text, metadata=metadata))
+                
+        return section_index
+    
+    def sync_ann_index(self, ann_index, batch_size=256):
+        """
+        Incrementally add IRIS chunks that are not yet in the ANN index, using the
+        embeddings already stored in IRIS.
+        
+        Args:
+            ann_index (ANNIndex): Writable ANN index
+            batch_size (int): Number of chunks read from IRIS per query
+            
+        Returns:
+            int: Number of chunks added
+        """
+        new_ids = [chunk_id for chunk_id in self.db.get()['ids'] if not ann_index.contains(chunk_id)]
+        
+        # The first build trains the index quantizers, so it needs all vectors at once;
+        # later builds are added and saved batch by batch
+        pending = {"ids": [], "vectors": [], "documents": [], "metadatas": []}
+        added = 0
+        for start in range(0, len(new_ids), batch_size):
+            records = self._read_chunks(new_ids[start:start + batch_size], with_embeddings=True)
+            pending["ids"] += records['ids']
+            pending["vectors"] += records['embeddings']
+            pending["documents"] += records['documents']
+            pending["metadatas"] += records['metadatas']
+            
+            if ann_index.index is not None or start + batch_size >= len(new_ids):
+                added += ann_index.add(**pending)
+                ann_index.save()
+                pending = {key: [] for key in pending}
+            
+        return added
+    
+    def _similarity_search_with_score(self, query, top_docs):
+        """
+        Run the similarity search on the configured backend.
+        
+        Returns:
+            list: (Document, score) tuples, where score is the cosine distance
+        """
+        if self.ann_index is not None:
+            # Pick up newer builds saved by the index builder
+            if self.ann_index.refresh():
+                self.section_index = self._build_section_index()
+            return self.ann_index.search(self.embeddings.embed_query(query), top_docs)
+        return self.db.similarity_search_with_score(query, top_docs)
+    
+    def search(self, query, top_docs=5, drugs=None):
         """
         Search knowledge base for relevant documents.
         
         Args:
             query (str): The search query
             top_docs (int): Number of top documents to return
+            drugs (set): Upper-case drug names to restrict the results to (e.g. the
+                patient's prescription); ignored if no result matches them
             
         Returns:
-            tuple: (xml_content, metadata_list, score_list)
+            tuple: (xml_content, metadata_list, score_list, context_stats)
         """
         # Run similarity search
-        docs_with_score = self.db.similarity_search_with_score(query, top_docs)
-        
-        # Prepare results
-        metadata_list = []
-        score_list = []
-        xml_content = ""
-        
-        # Format results as XML
-        for i, (doc, score) in enumerate(docs_with_score):
-            metadata_list.append(doc.metadata)
-            score_list.append(score)
-            xml_content += f'<content id="{i}">\n{doc.page_content}\n</content>\n\n'
+        if not drugs:
+            docs_with_score = self._similarity_search_with_score(query, top_docs)
+            return self._format_results(query, docs_with_score)
+        
+        # Over-fetch, then keep the chunks about the given drugs
+        candidates = self._similarity_search_with_score(query, top_docs * KB_DRUG_FILTER_OVERFETCH)
+        filtered = [(doc, score) for doc, score in candidates if self._chunk_drug(doc) in drugs]
+        results = self._format_results(query, (filtered or candidates)[:top_docs])
+        results[3]["drug_filter"] = "applied" if filtered else "no_match"
+        return results
+    
+    @staticmethod
+    def _chunk_drug(document):
+        """Upper-case drug name of a chunk."""
+        metadata = document.metadata or {}
+        return (metadata.get("drug") or extract_drug(document.page_content, metadata.get("source")) or "").upper()
+    
+    def lookup(self, query, topic_output):
+        """
+        Fetch context by exact (drug, section) lookup when the topic identification step
+        names only known drugs and topics.
+        
+        Args:
+            query (str): The search query (used to compress the context)
+            topic_output (str): Output of the topic identification step
+            
+        Returns:
+            tuple: (xml_content, metadata_list, score_list, context_stats), or None if the
+                query is open-ended and needs vector search
+        """
+        parsed = parse_topic_output(topic_output, self.section_index.drugs)
+        if parsed is None:
+            return None
+        
+        documents = self.section_index.lookup(*parsed)
+        if not documents:
+            return None
+        
+        # Exact matches were not scored: the compressor ranks them as equally close
+        # (distance 0), and no score is logged for them
+        results = self._format_results(
+            query, [(doc, 0.0) for doc in documents], scores=[None] * len(documents)
+        )
+        results[3]["retrieval"] = "section_index"
+        return results
+    
+    def _format_results(self, query, docs_with_score, scores=None):
+        """
+        Format retrieved chunks as XML context, compressing them if enabled.
+        
+        Args:
+            query (str): The search query
+            docs_with_score (list): (Document, cosine distance) tuples
+            scores (list): Scores to return for logging (the distances if None)
+        
+        Returns:
+            tuple: (xml_content, metadata_list, score_list, context_stats)
+        """
+        metadata_list = [doc.metadata for doc, _ in docs_with_score]
+        score_list = scores if scores is not None else [score for _, score in docs_with_score]
+        
+        if self.compressor:
+            xml_content, context_stats = self.compressor.compress(query, docs_with_score)
+        else:
+            xml_content = format_context_xml(
+                [(i, doc.page_content) for i, (doc, _) in enumerate(docs_with_score)]
+            )
+            tokens = count_tokens(xml_content)
+            context_stats = {
+                "chunks_retrieved": len(docs_with_score),
+                "chunks_kept": len(docs_with_score),
+                "tokens_original": tokens,
+                "tokens_compressed": tokens,
+            }
+        context_stats["retrieval"] = "vector_search"
             
-        return xml_content, metadata_list, score_list
\ No newline at end of file
+        return xml_content, metadata_list, score_list, context_stats
@@ -7,19 +7,16 @@ import argparse
 
 # Import configuration
 from config import (
-    PATIENT_DETAILS_EXAMPLE,
-    PRESCRIPTION_DETAILS_EXAMPLE,
-    MEMORY_CHAR_LIMIT
+    DEFAULT_PATIENT_ID,
+    MEMORY_CHAR_LIMIT,
+    PROFILE_SAMPLE_RATE,
+    PROFILES_DIR,
+    API_HOST,
+    API_PORT,
+    WARMUP_ENABLED
 )
 
-# Import LLM models
-from models.llm import initialize_models
-
-# Import chat system
-from chat.system import ChatSystem
-
-# Import UI
-from ui.gradio_interface import GradioInterface
+# LLM, chat system and UI modules are imported in main(), as they load langchain and gradio
 
 
 def parse_args():
@@ -27,6 +24,9 @@ def parse_args():
     parser = argparse.ArgumentParser(description="RALPh - Your Personalised Pocket Pharmacist")
     parser.add_argument("--share", action="store_true", help="Create a public link for the Gradio interface")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode")
+    parser.add_argument("--api", action="store_true", help="Serve the HTTP/WebSocket API with the Gradio interface mounted at /")
+    parser.add_argument("--profile", action="store_true", help="Profile a sample of the chat turns (collapsed stacks in the log directory)")
+    parser.add_argument("--profile-rate", type=float, default=PROFILE_SAMPLE_RATE, help="Share of chat turns profiled with --profile")
     return parser.parse_args()
 
 
@@ -35,6 +35,23 @@ def main():
     # Parse command line arguments
     args = parse_args()
     
+    # Sample chat turns with the profiler before any turn can run
+    if args.profile:
+        from utils.profiler import enable_profiling
+        enable_profiling(args.profile_rate)
+        print(f"Profiling {args.profile_rate:.0%} of chat turns to '{PROFILES_DIR}'")
+    
+    # Import LLM models, chat system and UI
+    from models.llm import initialize_models
+    from chat.system import ChatSystem
+    from ui.gradio_interface import GradioInterface
+    from patients.records import LocalRecordSource
+    
+    # Load the patient record (the demo patient unless DEFAULT_PATIENT_ID is set)
+    patient_record = LocalRecordSource().get(DEFAULT_PATIENT_ID)
+    if patient_record is None:
+        raise SystemExit(f"Unknown patient ID: {DEFAULT_PATIENT_ID}")
+    
     # Initialize LLM models
     chatllm, chatllm_large, summaryllm = initialize_models()
     print("LLM models initialized")
@@ -44,16 +61,42 @@ def main():
         chatllm=chatllm,
         chatllm_large=chatllm_large,
         summaryllm=summaryllm,
-        patient_details=PATIENT_DETAILS_EXAMPLE,
-        prescription_details=PRESCRIPTION_DETAILS_EXAMPLE,
-        memory_char_limit=MEMORY_CHAR_LIMIT
+        patient_details=patient_record.patient_details,
+        prescription_details=patient_record.prescription_details,
+        memory_char_limit=MEMORY_CHAR_LIMIT,
+        patient_record=patient_record
     )
     print("Chat system initialized")
     
+    # Warm up connections, caches and templates in the background
+    warmup = None
+    if WARMUP_ENABLED:
+        from utils.warmup import create_warmup
+        warmup = create_warmup(chat_system).start()
+        print("Warm-up started")
+    
     # Initialize and launch Gradio interface
     gradio_interface = GradioInterface(chat_system, summaryllm)
-    print("Launching Gradio interface...")
-    gradio_interface.launch_interface(share=args.share)
+    
+    if args.api:
+        # Serve the API and the Gradio interface from the same server
+        import uvicorn
+        import gradio as gr
+        from api.server import create_app
+        
+        # The server starts at once; /api/ready reports 503 until the warm-up is done. API and
+        # UI sessions share one session manager, so they share the session limit
+        app = create_app(chat_system, gradio_interface.report_jobs, gradio_interface.summary_cache, warmup,
+                         gradio_interface.sessions)
+        app = gr.mount_gradio_app(app, gradio_interface.build_interface(), path="/")
+        print(f"Launching API on http://{API_HOST}:{API_PORT}/api ...")
+        uvicorn.run(app, host=API_HOST, port=API_PORT)
+    else:
+        if warmup:
+            status = warmup.wait()
+            print(f"Warm-up finished in {status['elapsed']}s (warm: {status['warm']})")
+        print("Launching Gradio interface...")
+        gradio_interface.launch_interface(share=args.share)
 
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@
 from langchain_openai import ChatOpenAI, OpenAI
 import openai
 from config import OPENAI_API_KEY
+from models.rate_limiter import rate_limit_callbacks
 
 # Set OpenAI API key
 openai.api_key = OPENAI_API_KEY
@@ -12,6 +13,9 @@ def initialize_models():
     """
     Initialize and return language models.
     
+    All models share the client-side rate limiter, which reads the rate limit headers
+    and token usage of their responses.
+    
     Returns:
         tuple: (chatllm, chatllm_large, summaryllm)
     """
@@ -20,7 +24,10 @@ def initialize_models():
         model_name="gpt-4o-mini", 
         temperature=0, 
         top_p=0.8, 
-        streaming=True
+        streaming=True,
+        stream_usage=True,
+        include_response_headers=True,
+        callbacks=rate_limit_callbacks()
     )
     
     # More powerful model for complex queries
@@ -28,13 +35,18 @@ def initialize_models():
         model_name="gpt-4o", 
         temperature=0, 
         top_p=0.8, 
-        streaming=True
+        streaming=True,
+        stream_usage=True,
+        include_response_headers=True,
+        callbacks=rate_limit_callbacks()
     )
     
     # Model for summarization (can use the same as chatllm)
     summaryllm = ChatOpenAI(
         model_name="o3-mini", 
-        reasoning_effort="medium"
+        reasoning_effort="medium",
+        include_response_headers=True,
+        callbacks=rate_limit_callbacks()
     )
     
     return chatllm, chatllm_large, summaryllm
\ No newline at end of file
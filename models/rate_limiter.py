@@ -0,0 +1,450 @@
+"""
+Client-side rate limiting of OpenAI calls for RALPh.
+
+Every chat, summary and embedding call goes through a shared limiter that keeps a
+request bucket (RPM) and a token bucket (TPM) per model. Callers wait in a queue per
+model, in priority order and first come first served within a priority, so interactive
+chat turns go ahead of background report summaries. Token use is estimated before a
+call and corrected with the reported usage afterwards; the bucket sizes and levels
+follow the x-ratelimit-* headers of the provider's responses, and a 429 pauses the
+model until its limit resets.
+"""
+
+import re
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+from config import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_DEFAULT_RPM,
+    RATE_LIMIT_DEFAULT_TPM,
+    RATE_LIMIT_OUTPUT_TOKENS,
+    RATE_LIMIT_WAIT_TIMEOUT
+)
+from utils.tokens import count_tokens
+from utils.metrics import METRICS_WINDOW, percentiles
+
+
+# Priority of calls made outside any pipeline stage (interactive, like chat turns)
+DEFAULT_PRIORITY = 0
+
+# Priority of the calls made by the current thread or task; set by the stage scheduler
+_priority = contextvars.ContextVar("rate_limit_priority", default=DEFAULT_PRIORITY)
+
+# "1s", "6m0s", "20ms", "1h2m3.5s"
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class RateLimitTimeout(TimeoutError):
+    """Raised when a model call waited longer than allowed for rate limit budget."""
+
+
+@contextmanager
+def rate_limit_priority(priority):
+    """
+    Set the priority of the model calls made in a block.
+
+    Args:
+        priority (int): Priority (lower goes first)
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def parse_duration(text):
+    """
+    Parse a rate limit reset duration.
+
+    Args:
+        text (str): Duration such as "6m0s" or "20ms", or a number of seconds
+
+    Returns:
+        float: Seconds, or None if the text could not be parsed
+    """
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(text)
+    if not parts:
+        return None
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+
+class _ModelBudget:
+    """Request and token buckets and the wait queue of one model."""
+
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+
+        # Buckets start full and refill to their size over a minute
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+        # Waiting tickets (priority, sequence), heap ordered
+        self.waiters = []
+
+        self.admitted = 0
+        self.timed_out = 0
+        self.throttled = 0
+        self.wait_times = deque(maxlen=METRICS_WINDOW)
+
+    def refill(self, now):
+        """Add the budget accrued since the last update."""
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def delay(self, tokens, now):
+        """Seconds until a call estimated at the given tokens fits the budget."""
+        delay = max(0.0, self.paused_until - now)
+        if self.requests < 1:
+            delay = max(delay, (1 - self.requests) * 60 / self.rpm)
+        if self.tokens < tokens:
+            delay = max(delay, (tokens - self.tokens) * 60 / self.tpm)
+        return delay
+
+
+class RateLimiter:
+    """
+    Shared RPM/TPM limiter for model calls.
+    """
+
+    def __init__(self, default_rpm=RATE_LIMIT_DEFAULT_RPM, default_tpm=RATE_LIMIT_DEFAULT_TPM,
+                 wait_timeout=RATE_LIMIT_WAIT_TIMEOUT):
+        """
+        Initialize the limiter. Models are added on first use.
+
+        Args:
+            default_rpm (int): Requests per minute assumed until the provider reports the limit
+            default_tpm (int): Tokens per minute assumed until the provider reports the limit
+            wait_timeout (float): Maximum seconds a call waits for budget (None waits indefinitely)
+        """
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.wait_timeout = wait_timeout
+
+        self._budgets = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _budget(self, model):
+        """The budget of a model, created on first use (lock must be held)."""
+        budget = self._budgets.get(model)
+        if budget is None:
+            budget = self._budgets[model] = _ModelBudget(model, self.default_rpm, self.default_tpm)
+        return budget
+
+    def acquire(self, model, tokens, priority=None, timeout=None):
+        """
+        Wait until a call to a model fits its request and token budgets, and take them.
+
+        Args:
+            model (str): Model name
+            tokens (int): Estimated tokens of the call (prompt and completion)
+            priority (int): Priority (defaults to the priority of the current stage)
+            timeout (float): Maximum seconds to wait (defaults to the limiter's wait timeout)
+
+        Raises:
+            RateLimitTimeout: If the budget did not free up in time
+        """
+        priority = _priority.get() if priority is None else priority
+        timeout = self.wait_timeout if timeout is None else timeout
+        queued_at = time.monotonic()
+        deadline = None if timeout is None else queued_at + timeout
+
+        with self._condition:
+            budget = self._budget(model)
+            # A call larger than the whole bucket waits for a full bucket
+            tokens = min(tokens, budget.tpm)
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(budget.waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    budget.refill(now)
+                    wait = budget.delay(tokens, now) if budget.waiters[0] == ticket else None
+                    if wait == 0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            budget.timed_out += 1
+                            raise RateLimitTimeout(f"Timed out waiting for {model} rate limit budget")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+            finally:
+                budget.waiters.remove(ticket)
+                heapq.heapify(budget.waiters)
+                # Let the next waiter re-check, whether this one started or gave up
+                self._condition.notify_all()
+
+            budget.requests -= 1
+            budget.tokens -= tokens
+            budget.admitted += 1
+            budget.wait_times.append(time.monotonic() - queued_at)
+
+    def settle(self, model, estimated_tokens, actual_tokens):
+        """
+        Correct the token bucket once the actual usage of a call is known.
+
+        Args:
+            model (str): Model name
+            estimated_tokens (int): Tokens taken by acquire
+            actual_tokens (int): Tokens reported by the provider
+        """
+        with self._condition:
+            budget = self._budget(model)
+            budget.tokens = min(budget.tpm, budget.tokens + estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+    def update_from_headers(self, model, headers, throttled=False):
+        """
+        Adjust the budgets of a model to the provider's rate limit headers.
+
+        Args:
+            model (str): Model name
+            headers (Mapping): Response headers (x-ratelimit-*, retry-after)
+            throttled (bool): Whether the response was a 429
+        """
+        headers = {key.lower(): value for key, value in dict(headers or {}).items()}
+
+        def number(name):
+            try:
+                return float(headers[name])
+            except (KeyError, TypeError, ValueError):
+                return None
+
+        with self._condition:
+            budget = self._budget(model)
+            budget.refill(time.monotonic())
+
+            limit_requests = number("x-ratelimit-limit-requests")
+            limit_tokens = number("x-ratelimit-limit-tokens")
+            if limit_requests:
+                budget.rpm = limit_requests
+            if limit_tokens:
+                budget.tpm = limit_tokens
+
+            # The provider's count also covers calls from other processes sharing the key
+            remaining_requests = number("x-ratelimit-remaining-requests")
+            remaining_tokens = number("x-ratelimit-remaining-tokens")
+            if remaining_requests is not None:
+                budget.requests = min(budget.requests, remaining_requests)
+            if remaining_tokens is not None:
+                budget.tokens = min(budget.tokens, remaining_tokens)
+
+            if throttled:
+                budget.throttled += 1
+                budget.requests = min(budget.requests, 0.0)
+                budget.tokens = min(budget.tokens, 0.0)
+                pause = (
+                    parse_duration(headers.get("retry-after"))
+                    or max(parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                           parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0)
+                    or 1.0
+                )
+                budget.paused_until = max(budget.paused_until, time.monotonic() + pause)
+
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        Live budgets, queue depth and wait percentiles per model.
+
+        Returns:
+            dict: Model name -> budget stats
+        """
+        with self._condition:
+            now = time.monotonic()
+            result = {}
+            for budget in self._budgets.values():
+                budget.refill(now)
+                entry = {
+                    "rpm": budget.rpm,
+                    "tpm": budget.tpm,
+                    "requests_available": round(budget.requests, 1),
+                    "tokens_available": round(budget.tokens),
+                    "waiting": len(budget.waiters),
+                    "admitted": budget.admitted,
+                    "timed_out": budget.timed_out,
+                    "throttled": budget.throttled,
+                }
+                if budget.wait_times:
+                    entry["queue_wait"] = percentiles(budget.wait_times)
+                result[budget.model] = entry
+            return result
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback that takes rate limit budget before each model call and settles
+    it from the reported usage and headers afterwards.
+    """
+
+    # Let RateLimitTimeout abort the call instead of being logged and ignored
+    raise_error = True
+
+    def __init__(self, limiter):
+        """
+        Initialize the handler.
+
+        Args:
+            limiter (RateLimiter): Shared limiter
+        """
+        self.limiter = limiter
+
+        # run ID -> (model, estimated tokens) of calls in flight
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _model_name(serialized, invocation_params):
+        params = invocation_params or {}
+        return (
+            params.get("model_name") or params.get("model")
+            or ((serialized or {}).get("kwargs") or {}).get("model_name") or "unknown"
+        )
+
+    def _start(self, run_id, model, prompt_text, invocation_params):
+        """Estimate the tokens of a call and wait for budget."""
+        output_tokens = (invocation_params or {}).get("max_tokens") or RATE_LIMIT_OUTPUT_TOKENS
+        estimate = count_tokens(prompt_text, model) + output_tokens
+        self.limiter.acquire(model, estimate)
+        with self._lock:
+            self._calls[run_id] = (model, estimate)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, invocation_params=None, **kwargs):
+        model = self._model_name(serialized, invocation_params)
+        prompt_text = "\n".join(str(message.content) for batch in messages for message in batch)
+        self._start(run_id, model, prompt_text, invocation_params)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, invocation_params=None, **kwargs):
+        model = self._model_name(serialized, invocation_params)
+        self._start(run_id, model, "\n".join(prompts), invocation_params)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        model, estimate = call
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        actual = usage.get("total_tokens")
+        headers = None
+        for generations in response.generations:
+            for generation in generations:
+                headers = headers or (generation.generation_info or {}).get("headers")
+                message = getattr(generation, "message", None)
+                if message is not None:
+                    headers = headers or message.response_metadata.get("headers")
+                    if actual is None and message.usage_metadata:
+                        actual = message.usage_metadata.get("total_tokens")
+
+        if actual is not None:
+            self.limiter.settle(model, estimate, actual)
+        if headers:
+            self.limiter.update_from_headers(model, headers)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        model, _ = call
+
+        response = getattr(error, "response", None)
+        if getattr(error, "status_code", None) == 429 and response is not None:
+            self.limiter.update_from_headers(model, response.headers, throttled=True)
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Embedding model wrapper that takes rate limit budget before each embedding call.
+    """
+
+    def __init__(self, embeddings, limiter):
+        """
+        Initialize the wrapper.
+
+        Args:
+            embeddings (Embeddings): Embedding model
+            limiter (RateLimiter): Shared limiter
+        """
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.model = getattr(embeddings, "model", "embeddings")
+
+    def embed_documents(self, texts):
+        self.limiter.acquire(self.model, sum(count_tokens(text) for text in texts))
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        self.limiter.acquire(self.model, count_tokens(text))
+        return self.embeddings.embed_query(text)
+
+
+# Shared limiter, created on first use
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Get the shared rate limiter.
+
+    Returns:
+        RateLimiter: The process-wide limiter, or None if rate limiting is disabled
+    """
+    global _limiter
+    if not RATE_LIMIT_ENABLED:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
+
+
+def rate_limit_callbacks():
+    """
+    Callbacks to pass to a LangChain model so its calls are rate limited.
+
+    Returns:
+        list: The rate limit callback handler (empty if rate limiting is disabled)
+    """
+    limiter = get_rate_limiter()
+    return [RateLimitCallbackHandler(limiter)] if limiter is not None else []
+
+
+def rate_limited_embeddings(embeddings):
+    """
+    Wrap an embedding model so its calls are rate limited.
+
+    Args:
+        embeddings (Embeddings): Embedding model
+
+    Returns:
+        Embeddings: Wrapped model (the model itself if rate limiting is disabled)
+    """
+    limiter = get_rate_limiter()
+    return RateLimitedEmbeddings(embeddings, limiter) if limiter is not None else embeddings
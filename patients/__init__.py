@@ -0,0 +1,2 @@
+# __init__.py for patients package
+"""Patient record package for RALPh."""
\ No newline at end of file
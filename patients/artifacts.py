@@ -0,0 +1,176 @@
+# Precompiled per-patient artifacts, shared by all sessions of a patient.
+
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+
+from chat.prompts import build_counselling_system_prompt, build_verification_system_prompt
+from config import PATIENT_ARTIFACT_CACHE_SIZE
+from patients.records import parse_patient_record
+
+
+# Marks where the retrieved context goes when the counselling prompt is split
+CONTEXT_PLACEHOLDER = "\x00context\x00"
+
+
+def _normalize(text):
+    """Lower-case text with punctuation and repeated whitespace removed."""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s/-]", " ", text.casefold())).strip()
+
+
+class PatientArtifacts:
+    """
+    Everything derived from a patient record that does not change between turns.
+    """
+
+    def __init__(self, record):
+        """
+        Compute the artifacts of a patient.
+
+        Args:
+            record (PatientRecord): Patient record
+        """
+        self.record = record
+
+        # Prescribed drugs, used to filter knowledge base retrieval
+        self.drug_names = record.drug_names
+
+        # Verification prompt (fully determined by the record) and the counselling prompt
+        # around the retrieved context
+        self.verification_template = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(
+                build_verification_system_prompt(record.patient_details, record.prescription_details)
+            ),
+            HumanMessagePromptTemplate.from_template("{user_input}")
+        ])
+        self.counselling_prefix, self.counselling_suffix = build_counselling_system_prompt(
+            record.patient_details, record.prescription_details, CONTEXT_PLACEHOLDER
+        ).split(CONTEXT_PLACEHOLDER)
+
+        # Normalized identity details the patient is asked to confirm
+        self.verification_keys = {
+            "name": _normalize(record.name) if record.name else None,
+            "date_of_birth": self._date_variants(record.date_of_birth),
+            "allergies": tuple(_normalize(allergy) for allergy in record.allergies),
+        }
+
+    @staticmethod
+    def _date_variants(date_of_birth):
+        """Common spellings of a date."""
+        if date_of_birth is None:
+            return ()
+        day, month, year = date_of_birth.day, date_of_birth.month, date_of_birth.year
+        return tuple(_normalize(variant) for variant in {
+            date_of_birth.strftime(f"{day} %B %Y"),
+            date_of_birth.strftime(f"{day} %b %Y"),
+            f"{day:02d}/{month:02d}/{year}",
+            f"{day}/{month}/{year}",
+            date_of_birth.isoformat(),
+        })
+
+    def counselling_system_prompt(self, context_retrieved):
+        """
+        Build the counselling system prompt (same text as build_counselling_system_prompt).
+
+        Args:
+            context_retrieved (str): Context from the knowledge base
+
+        Returns:
+            str: Complete system prompt
+        """
+        return self.counselling_prefix + context_retrieved + self.counselling_suffix
+
+    def check_verification(self, text):
+        """
+        Check which identity details appear in the patient's message.
+
+        Args:
+            text (str): Patient message
+
+        Returns:
+            dict: name, date_of_birth and allergy -> whether they match the record
+        """
+        normalized = f" {_normalize(text)} "
+        keys = self.verification_keys
+        return {
+            "name": bool(keys["name"]) and f" {keys['name']} " in normalized,
+            "date_of_birth": any(f" {variant} " in normalized for variant in keys["date_of_birth"]),
+            "allergy": (
+                any(f" {allergy} " in normalized for allergy in keys["allergies"]) if keys["allergies"]
+                else bool(re.search(r"\b(no|none|nil|nkda)\b", normalized))
+            ),
+        }
+
+
+class PatientArtifactCache:
+    """
+    LRU cache of patient artifacts, keyed by the patient and prescription texts.
+    """
+
+    def __init__(self, max_entries=PATIENT_ARTIFACT_CACHE_SIZE):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Number of patients kept
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # key -> PatientArtifacts, least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, patient_details, prescription_details, record=None):
+        """
+        Get the artifacts of a patient, computing them on first use.
+
+        Args:
+            patient_details (str): Patient details
+            prescription_details (str): Prescription details
+            record (PatientRecord): Parsed record, if already available
+
+        Returns:
+            PatientArtifacts: Artifacts of the patient
+        """
+        key = hashlib.sha256(f"{patient_details}\0{prescription_details}".encode("utf-8")).hexdigest()
+        with self._lock:
+            artifacts = self._entries.get(key)
+            if artifacts is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return artifacts
+            self.misses += 1
+
+        artifacts = PatientArtifacts(record or parse_patient_record(patient_details, prescription_details))
+
+        with self._lock:
+            # Keep the first copy if another session computed it meanwhile
+            artifacts = self._entries.setdefault(key, artifacts)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return artifacts
+
+
+# Shared cache of all sessions in the process
+_cache = PatientArtifactCache()
+
+
+def get_patient_artifacts(patient_details, prescription_details, record=None):
+    """
+    Get the shared artifacts of a patient.
+
+    Args:
+        patient_details (str): Patient details
+        prescription_details (str): Prescription details
+        record (PatientRecord): Parsed record, if already available
+
+    Returns:
+        PatientArtifacts: Artifacts of the patient
+    """
+    return _cache.get(patient_details, prescription_details, record)
@@ -0,0 +1,213 @@
+# Typed patient records, their parser and the local record source.
+
+import re
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Optional, Tuple
+
+from config import PATIENT_RECORDS_PATH, PATIENT_DETAILS_EXAMPLE, PRESCRIPTION_DETAILS_EXAMPLE
+
+
+# "'Field': 'value'," lines of the patient details (quotes and trailing commas optional)
+DETAIL_LINE_PATTERN = re.compile(r"^\s*'?([^':]+?)'?\s*:\s*'?(.*?)'?\s*,?\s*$")
+
+# "1. ATORVASTATIN 20mg tablets - 1 tablet once in the morning - NO CHANGE"
+PRESCRIPTION_LINE_PATTERN = re.compile(
+    r"^\s*\d+[.)]\s*"
+    r"(?P<name>.+?)\s+"
+    r"(?P<strength>\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|units?|iu)\b(?:\s*/\s*\d*\s*\w+)?)\s*"
+    r"(?P<form>[^-]*?)\s*"
+    r"-\s*(?P<directions>.+?)"
+    r"(?:\s+-\s*(?P<status>[A-Z][A-Z ]+))?\s*$",
+    re.I
+)
+
+DATE_FORMATS = ["%d %B %Y", "%d %b %Y", "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"]
+
+# Allergy field values meaning the patient has no known allergies
+NO_ALLERGY_PATTERN = re.compile(r"^(nil|none|nkda|no known( drug)? allerg(y|ies))\b", re.I)
+
+
+@dataclass(frozen=True)
+class Medication:
+    """A prescribed medication."""
+    name: str                       # upper-case drug name, as in the knowledge base
+    strength: Optional[str] = None  # e.g. "20mg"
+    form: Optional[str] = None      # e.g. "tablets"
+    directions: Optional[str] = None
+    status: Optional[str] = None    # e.g. "NO CHANGE" or "NEWLY PRESCRIBED DRUG"
+
+
+@dataclass(frozen=True)
+class PatientRecord:
+    """
+    A patient and their prescription.
+
+    The original texts are kept, as the prompts quote them verbatim.
+    """
+    patient_details: str
+    prescription_details: str
+    patient_id: Optional[str] = None
+    name: Optional[str] = None
+    date_of_birth: Optional[date] = None
+    gender: Optional[str] = None
+    allergies: Tuple[str, ...] = ()
+    medical_history: Tuple[str, ...] = ()
+    labs: Dict[str, str] = field(default_factory=dict, hash=False, compare=False)
+    medications: Tuple[Medication, ...] = ()
+
+    @property
+    def drug_names(self):
+        """Upper-case names of the prescribed drugs."""
+        return frozenset(medication.name for medication in self.medications)
+
+
+def parse_date(text):
+    """
+    Parse a date of birth.
+
+    Args:
+        text (str): Date in one of DATE_FORMATS
+
+    Returns:
+        date: The date, or None if it could not be parsed
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def split_list(text):
+    """Split a comma, semicolon or "and" separated list."""
+    return tuple(item.strip() for item in re.split(r",|;|\band\b", text) if item.strip())
+
+
+def parse_patient_details(text):
+    """
+    Parse the "'Field': 'value'" lines of the patient details.
+
+    Args:
+        text (str): Patient details
+
+    Returns:
+        dict: Lower-case field name -> value
+    """
+    fields = {}
+    for line in text.replace("\\n", "\n").splitlines():
+        match = DETAIL_LINE_PATTERN.match(line)
+        if match and match.group(2):
+            fields[match.group(1).strip().lower()] = match.group(2).strip()
+    return fields
+
+
+def parse_prescription(text):
+    """
+    Parse the numbered lines of a prescription.
+
+    Args:
+        text (str): Prescription details
+
+    Returns:
+        tuple: Medications, in prescription order (unparsable lines are skipped)
+    """
+    medications = []
+    for line in text.splitlines():
+        match = PRESCRIPTION_LINE_PATTERN.match(line)
+        if match:
+            medications.append(Medication(
+                name=re.sub(r"\s+", " ", match.group("name")).strip().upper(),
+                strength=re.sub(r"\s+", "", match.group("strength")),
+                form=match.group("form") or None,
+                directions=match.group("directions").strip(),
+                status=match.group("status").strip() if match.group("status") else None
+            ))
+    return tuple(medications)
+
+
+def parse_patient_record(patient_details, prescription_details, patient_id=None):
+    """
+    Build a typed patient record from the patient and prescription texts.
+
+    Args:
+        patient_details (str): Patient details
+        prescription_details (str): Prescription details
+        patient_id (str): Patient ID (defaults to the NRIC field)
+
+    Returns:
+        PatientRecord: Parsed record
+    """
+    fields = parse_patient_details(patient_details)
+
+    allergy = fields.get("allergy") or fields.get("allergies") or ""
+    labs = {}
+    for item in split_list(fields.get("labs", "")):
+        name, _, value = item.partition(":")
+        if value:
+            labs[name.strip()] = value.strip()
+
+    return PatientRecord(
+        patient_details=patient_details,
+        prescription_details=prescription_details,
+        patient_id=patient_id or fields.get("nric"),
+        name=fields.get("name"),
+        date_of_birth=parse_date(fields.get("date of birth", "")),
+        gender=fields.get("gender"),
+        allergies=() if NO_ALLERGY_PATTERN.match(allergy) else split_list(allergy),
+        medical_history=split_list(re.sub(r"\([^)]*\)", "", fields.get("past medical history", ""))),
+        labs=labs,
+        medications=parse_prescription(prescription_details)
+    )
+
+
+class LocalRecordSource:
+    """
+    Patient records from a local JSON file, standing in for an electronic medical record.
+
+    The file holds a list of {"patient_id", "patient_details", "prescription_details"}
+    objects. The demo patient from config.py is always available.
+    """
+
+    def __init__(self, path=PATIENT_RECORDS_PATH):
+        """
+        Load the records.
+
+        Args:
+            path (str): JSON file with the records (optional)
+        """
+        example = parse_patient_record(PATIENT_DETAILS_EXAMPLE, PRESCRIPTION_DETAILS_EXAMPLE)
+        self.default_patient_id = example.patient_id
+        self._records = {example.patient_id: example}
+
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for entry in json.load(f):
+                    record = parse_patient_record(
+                        entry["patient_details"], entry["prescription_details"], entry.get("patient_id")
+                    )
+                    self._records[record.patient_id] = record
+
+    def get(self, patient_id=None):
+        """
+        Get a patient record.
+
+        Args:
+            patient_id (str): Patient ID (the demo patient if None)
+
+        Returns:
+            PatientRecord: The record, or None if unknown
+        """
+        return self._records.get(patient_id or self.default_patient_id)
+
+    def ids(self):
+        """
+        List the available patient IDs.
+
+        Returns:
+            list: Patient IDs
+        """
+        return list(self._records)
@@ -0,0 +1,125 @@
+"""
+Tests of the pooled SMTP connections against a local SMTP stand-in (aiosmtpd).
+
+Usage (from the project root):
+    pip install aiosmtpd pytest
+    python -m pytest tests
+"""
+
+import socket
+import unittest
+
+from utils.smtp_pool import SMTPConnectionPool
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+SENDER = "ralph@example.com"
+REJECTED_RECIPIENT = "rejected@example.com"
+
+
+class RecordingHandler:
+    """SMTP stand-in handler that keeps the delivered messages and rejects one recipient."""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REJECTED_RECIPIENT:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.mail_from, list(envelope.rcpt_tos), envelope.content))
+        self.sessions.add(id(session))
+        return "250 Message accepted for delivery"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _message(recipient, subject):
+    return f"From: {SENDER}\r\nTo: {recipient}\r\nSubject: {subject}\r\n\r\nPDF attached.\r\n"
+
+
+@unittest.skipIf(Controller is None, "aiosmtpd is not installed")
+class SMTPConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=_free_port())
+        self.controller.start()
+        self.pool = SMTPConnectionPool(
+            host="127.0.0.1",
+            port=self.controller.port,
+            username=None,
+            password=None,
+            use_starttls=False,
+            max_connections=2,
+            connect_timeout=5
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        self.controller.stop()
+
+    def test_send_reuses_session(self):
+        for i in range(3):
+            self.pool.send(SENDER, "patient@example.com", _message("patient@example.com", f"Report {i}"))
+
+        self.assertEqual(len(self.handler.messages), 3)
+        self.assertEqual(self.pool.connections_opened, 1)
+        self.assertEqual(len(self.handler.sessions), 1)
+
+    def test_send_batch_over_one_session(self):
+        recipients = [f"patient{i}@example.com" for i in range(5)]
+        outcomes = self.pool.send_batch([
+            (SENDER, recipient, _message(recipient, "Report")) for recipient in recipients
+        ])
+
+        self.assertEqual(outcomes, [None] * 5)
+        self.assertEqual([rcpt_tos for _, rcpt_tos, _ in self.handler.messages], [[r] for r in recipients])
+        self.assertEqual(self.pool.connections_opened, 1)
+
+    def test_send_batch_rejected_recipient_keeps_session(self):
+        recipients = ["first@example.com", REJECTED_RECIPIENT, "last@example.com"]
+        outcomes = self.pool.send_batch([
+            (SENDER, recipient, _message(recipient, "Report")) for recipient in recipients
+        ])
+
+        self.assertIsNone(outcomes[0])
+        self.assertIsNotNone(outcomes[1])
+        self.assertIsNone(outcomes[2])
+        self.assertEqual(len(self.handler.messages), 2)
+        self.assertEqual(self.pool.connections_opened, 1)
+
+    def test_send_batch_recycles_sessions(self):
+        self.pool.max_messages = 2
+        outcomes = self.pool.send_batch([
+            (SENDER, "patient@example.com", _message("patient@example.com", f"Report {i}")) for i in range(5)
+        ])
+
+        self.assertEqual(outcomes, [None] * 5)
+        self.assertEqual(self.pool.connections_opened, 3)
+
+    def test_reconnects_after_server_drop(self):
+        self.pool.send(SENDER, "patient@example.com", _message("patient@example.com", "Before"))
+
+        # Drop the pooled session, as a server closing an idle connection would
+        self.pool._idle[0].smtp.sock.shutdown(socket.SHUT_RDWR)
+        self.pool.send(SENDER, "patient@example.com", _message("patient@example.com", "After"))
+
+        self.assertEqual(len(self.handler.messages), 2)
+        self.assertEqual(self.pool.connections_opened, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,9 +5,18 @@ Gradio UI implementation for RALPh chatbot.
 import os
 import gradio as gr
 
-from utils.pdf_generator import generate_pdf
-from utils.email_sender import send_email_with_pdf
-from utils.speech import audio_to_text, text_to_audio
+from api.sessions import SessionManager, SessionLimitReached
+from chat.session_store import SessionConflict
+from utils.speech_service import SpeechServiceBusy
+from utils.stage_scheduler import get_scheduler, StageBusy, STAGE_CHAT
+from utils.profiler import profiled
+from config import (
+    REPORT_SUMMARY_PRECOMPUTE,
+    SCHEDULER_CHAT_CONCURRENCY,
+    GRADIO_QUEUE_MAX_SIZE,
+    VOICE_ENABLED,
+    REPORTS_ENABLED
+)
 
 
 class GradioInterface:
@@ -15,16 +24,37 @@ class GradioInterface:
     Gradio UI interface for the RALPh chatbot.
     """
     
-    def __init__(self, chat_system, summaryllm):
+    def __init__(self, chat_system, summaryllm, sessions=None, summary_cache=None, report_jobs=None):
         """
         Initialize Gradio interface.
         
+        Each browser session chats with its own session, whose chat system shares the
+        models, knowledge base and log sinks of the main chat system.
+        
         Args:
             chat_system: RALPh chat system
             summaryllm: Model for summarization
+            sessions (SessionManager): Session manager (a new one for chat_system if None)
+            summary_cache (ReportSummaryCache): Cache of conversation summaries (created if None
+                and reports are enabled)
+            report_jobs (JobQueue): Report job queue (created if None and reports are enabled)
         """
         self.chat_system = chat_system
         self.summaryllm = summaryllm
+        self.sessions = sessions if sessions is not None else SessionManager(chat_system)
+        
+        # PDF summaries by email (their PDF and email dependencies are only loaded if enabled)
+        self.summary_cache = summary_cache
+        self.report_jobs = report_jobs
+        if REPORTS_ENABLED and self.summary_cache is None:
+            from utils.summary_cache import ReportSummaryCache
+            self.summary_cache = ReportSummaryCache(summaryllm, logger=chat_system.logger)
+        if REPORTS_ENABLED and self.report_jobs is None:
+            from utils.report_jobs import create_report_job_queue
+            self.report_jobs = create_report_job_queue(self.summary_cache)
+            
+        self.scheduler = get_scheduler()
+        self.busy_msg = "RALPh is helping many patients right now, please send your question again in a moment."
         self.introduction_msg = """💊 **Welcome to RALPh!** 🤖👨‍⚕️
 As your personalised pocket pharmacist, I'm here to help with all your medication-related questions. Whether you're curious about dosages, side effects, or your medications, I'm here to guide you every step of the way! 🌟
 
@@ -40,43 +70,113 @@ Firstly, may i verify your name, date of birth & allergy status?
         """
         print(x.index, x.value, x.liked)
     
-    def add_text_audio(self, history, text, audio=None):
+    def get_session(self, session_id):
+        """
+        Look up the session of a browser session, or create one on its first message.
+        
+        Args:
+            session_id: Session ID held by the browser session, or None
+            
+        Returns:
+            Session: The session, or None if it is unknown or expired
+            
+        Raises:
+            SessionLimitReached: If memory is full of busy sessions
+        """
+        if session_id is None:
+            return self.sessions.create()
+        return self.sessions.get(session_id)
+    
+    def _profile_context(self, session_id, history, play_audio=False):
+        """Logger, conversation and turn number of a profiled chat turn."""
+        try:
+            session = self.sessions.get(session_id) if session_id else None
+        except SessionLimitReached:
+            session = None
+        chat_system = session.chat_system if session else self.chat_system
+        return chat_system.logger, chat_system.convo_number, chat_system.turn_counter + 1
+    
+    def add_text_audio(self, session_id, history, text, audio=None):
         """
         Handle text input or use audio input if provided.
         
         Args:
+            session_id: Session ID of the browser session, or None
             history: Chat history
             text: Text input
             audio: Audio input file
             
         Returns:
-            tuple: (updated_history, textbox)
+            tuple: (session_id, updated_history, textbox)
         """
+        try:
+            session = self.get_session(session_id)
+        except SessionLimitReached as e:
+            self.chat_system.logger.log_event("chat_turn_rejected", error=repr(e))
+            session = None
+        if session is None:
+            return session_id, history + [(text or None, self.busy_msg)], gr.Textbox(value="", interactive=False)
+        
         if audio is not None:
-            # Convert audio input to text
-            transcribed_text, _, _, _ = audio_to_text(audio)
+            # Convert audio input to text on the bounded speech service
+            from utils.speech import submit_audio_to_text
+            try:
+                transcribed_text, _, _, _, stt_stats = submit_audio_to_text(audio).result()
+            except (SpeechServiceBusy, TimeoutError) as e:
+                session.chat_system.logger.log_event("speech_to_text_failed", error=repr(e))
+                gr.Warning("Voice input is busy right now, please type your question instead.")
+                return session.session_id, history, gr.Textbox(interactive=True)
+            session.chat_system.logger.log_event("speech_to_text", **stt_stats)
             user_input = transcribed_text
         else:
             user_input = text
         
         history = history + [(user_input, None)]
-        return history, gr.Textbox(value="", interactive=False)
+        return session.session_id, history, gr.Textbox(value="", interactive=False)
     
-    def trigger_bot_response(self, history, play_audio=False):
+    @profiled(
+        "trigger_bot_response",
+        lambda self, *args, **kwargs: self._profile_context(*args, **kwargs)
+    )
+    def trigger_bot_response(self, session_id, history, play_audio=False):
         """
         Process user input and generate bot response.
         
         Args:
+            session_id: Session ID of the browser session
             history: Chat history
             play_audio: Whether to convert response to audio
             
         Yields:
-            tuple: (updated_history, audio_path)
+            tuple: (updated_history, audio_chunk)
         """
+        # Nothing to answer if no new query was added (e.g. voice input was rejected)
+        if history[-1][1] is not None:
+            return
+        
         query = history[-1][0]  # Get the user's query
+        
+        # Claim the session, so that its turns run one at a time
+        try:
+            session = self.sessions.get(session_id) if session_id else None
+        except SessionLimitReached as e:
+            self.chat_system.logger.log_event("chat_turn_rejected", error=repr(e))
+            session = None
+        if session is None or not session.lock.acquire(blocking=False):
+            history[-1][1] = self.busy_msg
+            yield history, gr.update()
+            return
+        chat_system = session.chat_system
     
-        # Call the chatLLM, pass in the input & gather a response
-        response_content = self.chat_system.process_message(query)
+        # Wait for a chat slot, so that the chat stage limit is respected
+        try:
+            self.scheduler.acquire(STAGE_CHAT)
+        except (StageBusy, TimeoutError) as e:
+            session.lock.release()
+            chat_system.logger.log_event("chat_turn_rejected", error=repr(e))
+            history[-1][1] = self.busy_msg
+            yield history, gr.update()
+            return
     
         # Set up empathy prompt
         # from langchain_core.messages import SystemMessage, AIMessage
@@ -87,71 +187,174 @@ Firstly, may i verify your name, date of birth & allergy status?
     
         # Stream the final empathy LLM
         full_response = "" 
-        audio_path = None
         
-        # for chunk in self.chat_system.chatllm.stream(input=empathy_prompt):
+        # for chunk in chat_system.chatllm.stream(input=empathy_prompt):
             # full_response += chunk.content  # Append the chunk to the full response
-            
-        for chunk in response_content:  # Stream response content
-            full_response += chunk
-
-            history[-1][1] = full_response
-            yield history, audio_path
         
-        # Convert the full response to audio if play_audio is True
-        if play_audio:
-            print("--- Converting to audio ---")
-            _, audio_path = text_to_audio(full_response)
-            print("+++ Converted to audio +++")
+        # Synthesize each sentence as soon as it is complete in the text stream
+        tts = None
+        if play_audio and VOICE_ENABLED:
+            from utils.speech import SentenceTTSPipeline
+            tts = SentenceTTSPipeline()
             
-            # Yield the final update with the audio path
-            yield history, audio_path
+        try:
+            # Call the chatLLM, pass in the input & stream the response as it is generated
+            response_stream = chat_system.process_message_stream(query)
+            try:
+                for chunk in response_stream:
+                    full_response += chunk
+                    history[-1][1] = full_response
+                    
+                    # Stream the audio of sentences that are already synthesized
+                    audio_update = gr.update()
+                    if tts:
+                        tts.feed(chunk)
+                        ready_chunks = tts.ready_chunks()
+                        if ready_chunks:
+                            audio_update = b"".join(ready_chunks)
+                            
+                    yield history, audio_update
+                self.complete_turn(session, full_response)
+            except Exception:
+                # The state in memory may no longer match the store; reload it on the next turn
+                self.sessions.discard(session.session_id)
+                raise
+            finally:
+                # Free the chat slot and the session once the model is done (or the client has gone away)
+                response_stream.close()
+                self.scheduler.release(STAGE_CHAT)
+                session.lock.release()
             
+            # Stream the audio of the remaining sentences
+            if tts:
+                tts.finish()
+                for audio_chunk in tts.remaining_chunks():
+                    yield history, audio_chunk
+                tts.save()
+        finally:
+            if tts:
+                tts.cancel()
+    
+    def complete_turn(self, session, full_response):
+        """
+        Save the session state, log the final response and refresh the report summary.
+        
+        Args:
+            session: Session of the turn (its lock must be held)
+            full_response: Final response of the turn
+        """
+        chat_system = session.chat_system
+        try:
+            self.sessions.save_turn(session)
+        except SessionConflict as e:
+            # The turn could not be re-applied on the stored state; it is reloaded on the next turn
+            chat_system.logger.log_event("session_save_conflict", error=repr(e))
+        
         # Update the log with the final response
-        self.chat_system.logger.update_final_response(full_response)
+        chat_system.logger.update_final_response(full_response)
+        
+        # Keep the report summary up to date, so sending the PDF needs no LLM call
+        if self.summary_cache and REPORT_SUMMARY_PRECOMPUTE and chat_system.status_verified:
+            from utils.summary_cache import message_lines
+            self.summary_cache.precompute(
+                message_lines(chat_system.chat_memory),
+                chat_system.prescription_details,
+                chat_system.logger,
+                chat_system.convo_number
+            )
+    
+    def clear_chat(self, session_id):
+        """
+        Start a new conversation in the browser session.
+        
+        Args:
+            session_id: Session ID of the browser session, or None
+            
+        Returns:
+            Chat history (empty), or unchanged while a response is being generated
+        """
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            return None
+        if not session.lock.acquire(blocking=False):
+            gr.Warning("Please wait for RALPh's answer before clearing the chat.")
+            return gr.update()
+        try:
+            session.chat_system.reset_chat()
+            self.sessions.save(session)
+        except SessionConflict as e:
+            session.chat_system.logger.log_event("session_save_conflict", error=repr(e))
+        finally:
+            session.lock.release()
+        return None
     
-    def save_to_pdf_and_send_email(self, recipient_email):
+    def save_to_pdf_and_send_email(self, recipient_email, session_id):
         """
-        Generate PDF summary and send via email.
+        Queue a PDF summary of the conversation for email delivery.
         
         Args:
             recipient_email: Recipient's email address
+            session_id: Session ID of the browser session, or None
             
         Returns:
-            str: Success message or error
+            tuple: (status message, job ID or None, status poll timer)
         """
+        from utils.email_sender import is_valid_email
+        from utils.report_jobs import submit_report_job, describe_report_job
+        
+        if not recipient_email or not is_valid_email(recipient_email):
+            return "Invalid email address. Please provide a valid email.", None, gr.Timer(active=False)
+        
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            return "There is no conversation to summarize yet.", None, gr.Timer(active=False)
+        
         try:
-            # Generate PDF
-            pdf_path = generate_pdf(
-                self.chat_system.chat_memory,
-                self.chat_system.prescription_details,
-                self.summaryllm
+            job_id = submit_report_job(
+                self.report_jobs,
+                session.chat_system.chat_memory,
+                session.chat_system.prescription_details,
+                recipient_email
             )
-            
-            if not pdf_path:
-                return "Failed to generate PDF summary."
-            
-            # Send email
-            return send_email_with_pdf(pdf_path, recipient_email)
-            
         except Exception as e:
-            return f"Error while generating or sending PDF: {e}"
+            return f"Error while queueing the PDF summary: {e}", None, gr.Timer(active=False)
+            
+        # Poll the job status until the job is done
+        return describe_report_job(self.report_jobs.get(job_id)), job_id, gr.Timer(active=True)
     
-    def launch_interface(self, share=False):
+    def report_job_status(self, job_id):
         """
-        Build and launch the Gradio interface.
+        Poll the status of the last queued PDF summary.
         
         Args:
-            share (bool): Whether to create a public link
+            job_id: Report job ID, or None
             
         Returns:
-            gr.Blocks: Gradio interface
+            tuple: (status message, unchanged if there is no job; status poll timer, stopped
+                once the job is done)
+        """
+        if not job_id:
+            return gr.update(), gr.Timer(active=False)
+        from utils.report_jobs import describe_report_job
+        job = self.report_jobs.get(job_id)
+        done = job is None or job["status"] in ("succeeded", "failed")
+        return describe_report_job(job), gr.Timer(active=not done)
+    
+    def build_interface(self):
+        """
+        Build the Gradio interface.
+        
+        Returns:
+            gr.Blocks: Gradio interface with its queue configured
         """
         # Get the current directory for image assets
         current_directory = os.getcwd()
         
         # Create the Gradio interface
         with gr.Blocks() as main_interface: 
+            # Session of this browser session, created on its first message
+            session_state = gr.State(None)
+            
             chatbot = gr.Chatbot(
                 value=[[None, self.introduction_msg]],
                 elem_id="chatbot",
@@ -174,7 +377,7 @@ Firstly, may i verify your name, date of birth & allergy status?
                 )
                 clear = gr.Button("Clear")
     
-            with gr.Row():
+            with gr.Row(visible=VOICE_ENABLED):
                 # Audio input using Gradio's microphone interface
                 mic_input = gr.Audio(
                     sources="microphone",
@@ -187,7 +390,8 @@ Firstly, may i verify your name, date of birth & allergy status?
                 # Audio output component for playing the bot's response
                 audio_output = gr.Audio(
                     label="RALPh's Voice Response", 
-                    type="filepath", 
+                    format="mp3",
+                    streaming=True,
                     interactive=False,
                     visible=False,
                     autoplay=True,
@@ -203,24 +407,24 @@ Firstly, may i verify your name, date of birth & allergy status?
     
             # Trigger chatbot with text input
             txt_msg = txt_input.submit(
-                self.add_text_audio, [chatbot, txt_input], [chatbot, txt_input], queue=False
+                self.add_text_audio, [session_state, chatbot, txt_input], [session_state, chatbot, txt_input], queue=False
             ).then(
-                self.trigger_bot_response, [chatbot, play_audio_checkbox], [chatbot, audio_output], api_name="bot_response"
+                self.trigger_bot_response, [session_state, chatbot, play_audio_checkbox], [chatbot, audio_output], api_name="bot_response"
             ).then(
                 lambda: gr.Textbox(interactive=True), None, [txt_input], queue=False  # re-enable the textbox
             )
             
             # Trigger chatbot with voice input
             voice_msg = mic_input.stop_recording(
-                self.add_text_audio, [chatbot, txt_input, mic_input], [chatbot, txt_input], queue=False
+                self.add_text_audio, [session_state, chatbot, txt_input, mic_input], [session_state, chatbot, txt_input], queue=False
             ).then(
-                self.trigger_bot_response, [chatbot, play_audio_checkbox], [chatbot, audio_output]
+                self.trigger_bot_response, [session_state, chatbot, play_audio_checkbox], [chatbot, audio_output]
             ).then(
                 lambda: gr.Textbox(interactive=True), None, [txt_input], queue=False  # re-enable the textbox
             )  
     
             chatbot.like(self.print_like_dislike, None, None)  # like-dislike button
-            clear.click(lambda: self.chat_system.reset_chat(), None, chatbot, queue=False)  # button to reset chat
+            clear.click(self.clear_chat, session_state, chatbot, queue=False)  # button to reset chat
     
             # Update audio output visibility based on checkbox
             play_audio_checkbox.change(
@@ -229,7 +433,7 @@ Firstly, may i verify your name, date of birth & allergy status?
                 [audio_output]
             )
     
-            with gr.Row():
+            with gr.Row(visible=REPORTS_ENABLED):
                 email_input = gr.Textbox(
                     show_label=False, 
                     container=False, 
@@ -238,16 +442,42 @@ Firstly, may i verify your name, date of birth & allergy status?
                 )
                 save_button = gr.Button("Send PDF to Email", scale=3)
             
+            report_status = gr.Markdown(visible=REPORTS_ENABLED)
+            report_job_id = gr.State(None)
+            report_timer = gr.Timer(2, active=False)
+            
+            # Queue the report and return immediately, then poll the job status until it is done
+            # (outside the queue, so polling never waits behind chat turns)
             save_button.click(
                 self.save_to_pdf_and_send_email,
-                inputs=email_input,
-                outputs=email_input  # status response provided in the same box
+                inputs=[email_input, session_state],
+                outputs=[report_status, report_job_id, report_timer],
+                queue=False
+            )
+            report_timer.tick(
+                self.report_job_status, report_job_id, [report_status, report_timer], queue=False
             )
             
             warning_footnote = gr.HTML("""<p style="color: #ff9900; text-align: center;">⚠️ RALPh may display inaccurate information, do double-check its responses or consult a pharmacist. It is not a basis for therapeutic decisions, nor a substitute for professional judgement. ⚠️</p>""")
     
-        # Configure interface
-        main_interface.queue()
+        # Configure interface: bound the pending events, and run as many chat turns at once
+        # as the chat stage allows (the scheduler decides which of them go first); each
+        # browser session has its own chat state, so concurrent turns never share it
+        main_interface.queue(max_size=GRADIO_QUEUE_MAX_SIZE, default_concurrency_limit=SCHEDULER_CHAT_CONCURRENCY)
+        
+        return main_interface
+    
+    def launch_interface(self, share=False):
+        """
+        Build and launch the Gradio interface.
+        
+        Args:
+            share (bool): Whether to create a public link
+            
+        Returns:
+            gr.Blocks: Gradio interface
+        """
+        main_interface = self.build_interface()
         
         # Launch the interface
         main_interface.launch(show_api=False, share=share)
@@ -0,0 +1,168 @@
+# Speech-to-text upload preprocessing for RALPh.
+
+import io
+import os
+import time
+from math import gcd
+
+import numpy as np
+import scipy.io.wavfile as wav
+from scipy.signal import resample_poly
+
+from config import STT_SAMPLE_RATE, STT_VAD_THRESHOLD_DB, STT_VAD_PADDING_MS, STT_CODEC
+
+
+# Length of the frames the energy-based VAD works on
+VAD_FRAME_MS = 30
+
+# Frames this far above the estimated noise floor count as speech
+VAD_NOISE_MARGIN_DB = 12.0
+
+
+def load_wav(audio_file):
+    """
+    Load a WAV file as mono float samples in [-1, 1].
+
+    Args:
+        audio_file (str): Path to WAV file
+
+    Returns:
+        tuple: (samples, sample_rate)
+    """
+    sample_rate, data = wav.read(audio_file)
+
+    # Scale integer PCM to [-1, 1]
+    if np.issubdtype(data.dtype, np.integer):
+        info = np.iinfo(data.dtype)
+        data = (data.astype(np.float32) - (info.max + info.min + 1) / 2) / (info.max + 1)
+    else:
+        data = data.astype(np.float32)
+
+    # Downmix to mono
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+
+    return data, sample_rate
+
+
+def resample(samples, sample_rate, target_rate=STT_SAMPLE_RATE):
+    """
+    Resample audio with a polyphase filter.
+
+    Args:
+        samples (np.ndarray): Mono float samples
+        sample_rate (int): Sample rate of the samples
+        target_rate (int): Target sample rate
+
+    Returns:
+        np.ndarray: Resampled samples
+    """
+    if sample_rate == target_rate:
+        return samples
+    divisor = gcd(sample_rate, target_rate)
+    return resample_poly(samples, target_rate // divisor, sample_rate // divisor).astype(np.float32)
+
+
+def trim_silence(samples, sample_rate, threshold_db=STT_VAD_THRESHOLD_DB, padding_ms=STT_VAD_PADDING_MS):
+    """
+    Trim leading and trailing silence with an energy-based voice activity detector.
+
+    A frame is speech when its level is above both the absolute threshold and the
+    estimated noise floor plus a margin. Silence inside the utterance is kept.
+
+    Args:
+        samples (np.ndarray): Mono float samples
+        sample_rate (int): Sample rate of the samples
+        threshold_db (float): Absolute speech level threshold in dBFS
+        padding_ms (int): Audio kept before the first and after the last speech frame
+
+    Returns:
+        np.ndarray: Trimmed samples (unchanged if no speech is detected)
+    """
+    frame_length = max(1, int(sample_rate * VAD_FRAME_MS / 1000))
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return samples
+
+    # Level of each frame in dBFS
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    levels = 20 * np.log10(np.maximum(rms, 1e-10))
+
+    noise_floor = np.percentile(levels, 10)
+    speech = np.flatnonzero(levels > max(threshold_db, noise_floor + VAD_NOISE_MARGIN_DB))
+    if len(speech) == 0:
+        return samples
+
+    padding = int(sample_rate * padding_ms / 1000)
+    start = max(0, speech[0] * frame_length - padding)
+    end = min(len(samples), (speech[-1] + 1) * frame_length + padding)
+    return samples[start:end]
+
+
+def encode(samples, sample_rate, codec=STT_CODEC):
+    """
+    Encode audio for upload.
+
+    Opus and FLAC need the optional soundfile package; 16-bit WAV is used when it is
+    not installed or the codec is not supported by the local libsndfile.
+
+    Args:
+        samples (np.ndarray): Mono float samples
+        sample_rate (int): Sample rate of the samples
+        codec (str): "opus", "flac" or "wav"
+
+    Returns:
+        tuple: (encoded_bytes, file_extension)
+    """
+    if codec in ("opus", "flac"):
+        try:
+            import soundfile as sf
+
+            buffer = io.BytesIO()
+            if codec == "opus":
+                sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+                return buffer.getvalue(), "ogg"
+            sf.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+            return buffer.getvalue(), "flac"
+        except (ImportError, RuntimeError, TypeError, ValueError):
+            pass
+
+    buffer = io.BytesIO()
+    wav.write(buffer, sample_rate, (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16))
+    return buffer.getvalue(), "wav"
+
+
+def preprocess_for_stt(audio_file):
+    """
+    Resample to 16 kHz mono, trim silence and encode a WAV recording for upload.
+
+    Args:
+        audio_file (str): Path to WAV file
+
+    Returns:
+        tuple: (upload_file, stats) where upload_file is a named in-memory file and
+            stats holds the before/after sizes and durations and the preprocessing time
+    """
+    start_time = time.perf_counter()
+
+    samples, sample_rate = load_wav(audio_file)
+    original_duration = len(samples) / sample_rate
+
+    samples = resample(samples, sample_rate)
+    samples = trim_silence(samples, STT_SAMPLE_RATE)
+    encoded, extension = encode(samples, STT_SAMPLE_RATE)
+
+    upload_file = io.BytesIO(encoded)
+    upload_file.name = f"{os.path.splitext(os.path.basename(audio_file))[0]}.{extension}"
+
+    stats = {
+        "original_bytes": os.path.getsize(audio_file),
+        "upload_bytes": len(encoded),
+        "original_duration": round(original_duration, 3),
+        "upload_duration": round(len(samples) / STT_SAMPLE_RATE, 3),
+        "original_sample_rate": sample_rate,
+        "upload_format": extension,
+        "preprocess_duration": round(time.perf_counter() - start_time, 3),
+    }
+    return upload_file, stats
@@ -1,14 +1,34 @@
 # Email functionality for RALPh.
 
 import re
-import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 import os
 
-from config import EMAIL_SENDER, EMAIL_PASSWORD, EMAIL_SMTP_SERVER, EMAIL_SMTP_PORT
+from config import EMAIL_SENDER
+from utils.smtp_pool import SMTPConnectionPool
+
+
+# Shared SMTP connection pool, created on first use
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool():
+    """
+    Get the shared SMTP connection pool.
+    
+    Returns:
+        SMTPConnectionPool: The process-wide pool
+    """
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPConnectionPool()
+        return _smtp_pool
 
 
 def is_valid_email(email):
@@ -24,6 +44,119 @@ def is_valid_email(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email) is not None
 
 
+def deliver_pdf(pdf_path, recipient_email):
+    """
+    Send a PDF file via email, raising on failure.
+    
+    Args:
+        pdf_path (str): Path to PDF file
+        recipient_email (str): Recipient's email address
+        
+    Raises:
+        ValueError: If the email address is invalid
+        FileNotFoundError: If the PDF file does not exist
+        smtplib.SMTPException, OSError: If sending fails (usually transient)
+    """
+    # Validate PDF file exists
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF file not found at {pdf_path}")
+
+    with open(pdf_path, "rb") as attachment:
+        pdf_bytes = attachment.read()
+    deliver_pdf_bytes(pdf_bytes, os.path.basename(pdf_path), recipient_email)
+
+
+def _pdf_message(pdf_bytes, file_name, recipient_email):
+    """
+    Build the email carrying a PDF.
+    
+    Args:
+        pdf_bytes (bytes): PDF document
+        file_name (str): Attachment file name
+        recipient_email (str): Recipient's email address
+        
+    Returns:
+        str: Serialized message
+        
+    Raises:
+        ValueError: If the email address is invalid
+    """
+    # Validate recipient email
+    if not is_valid_email(recipient_email):
+        raise ValueError("Invalid email address. Please provide a valid email.")
+
+    # Email configuration
+    sender_email = EMAIL_SENDER
+
+    # Email subject and body
+    subject = "RALPh Chatbot Conversation PDF"
+    body = "Please find attached the PDF of your chatbot conversation."
+
+    # Create the email message
+    msg = MIMEMultipart()
+    msg['From'] = sender_email.strip()
+    msg['To'] = recipient_email.strip()
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body.encode('utf-8'), 'plain', 'utf-8'))
+
+    # Attach the PDF straight from memory
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(pdf_bytes)
+    encoders.encode_base64(part)
+    part.add_header(
+        "Content-Disposition",
+        f"attachment; filename={file_name}",
+    )
+    msg.attach(part)
+
+    return msg.as_string()
+
+
+def deliver_pdf_bytes(pdf_bytes, file_name, recipient_email):
+    """
+    Send an in-memory PDF via email, raising on failure.
+    
+    Args:
+        pdf_bytes (bytes): PDF document
+        file_name (str): Attachment file name
+        recipient_email (str): Recipient's email address
+        
+    Raises:
+        ValueError: If the email address is invalid
+        smtplib.SMTPException, OSError: If sending fails (usually transient)
+    """
+    message = _pdf_message(pdf_bytes, file_name, recipient_email)
+
+    # Send over a pooled SMTP connection
+    get_smtp_pool().send(EMAIL_SENDER, recipient_email, message)
+
+
+def deliver_pdf_batch(reports):
+    """
+    Send several in-memory PDFs, over as few SMTP sessions as possible.
+    
+    Args:
+        reports (list): (pdf_bytes, file_name, recipient_email) tuples
+        
+    Returns:
+        list: None for each delivered PDF, or the exception that prevented delivery
+            (ValueError for an invalid address, smtplib.SMTPException or OSError if sending failed)
+    """
+    outcomes = [None] * len(reports)
+    messages = []
+    for index, (pdf_bytes, file_name, recipient_email) in enumerate(reports):
+        try:
+            messages.append((index, (EMAIL_SENDER, recipient_email, _pdf_message(pdf_bytes, file_name, recipient_email))))
+        except ValueError as e:
+            outcomes[index] = e
+
+    if messages:
+        sent = get_smtp_pool().send_batch([message for _, message in messages])
+        for (index, _), outcome in zip(messages, sent):
+            outcomes[index] = outcome
+    return outcomes
+
+
 def send_email_with_pdf(pdf_path, recipient_email):
     """
     Send PDF via email.
@@ -37,49 +170,9 @@ def send_email_with_pdf(pdf_path, recipient_email):
     """
     print("Attempting to send email...")
     try:
-        # Validate recipient email
-        if not is_valid_email(recipient_email):
-            return "Invalid email address. Please provide a valid email."
-
-        # Validate PDF file exists
-        if not os.path.exists(pdf_path):
-            return f"PDF file not found at {pdf_path}"
-
-        # Email configuration
-        sender_email = EMAIL_SENDER
-        sender_password = EMAIL_PASSWORD
-        smtp_server = EMAIL_SMTP_SERVER
-        smtp_port = EMAIL_SMTP_PORT
-
-        # Email subject and body
-        subject = "RALPh Chatbot Conversation PDF"
-        body = "Please find attached the PDF of your chatbot conversation."
-
-        # Create the email message
-        msg = MIMEMultipart()
-        msg['From'] = sender_email.strip()
-        msg['To'] = recipient_email.strip()
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body.encode('utf-8'), 'plain', 'utf-8'))
-
-        # Attach the PDF file
-        with open(pdf_path, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header(
-                "Content-Disposition",
-                f"attachment; filename={os.path.basename(pdf_path)}",
-            )
-            msg.attach(part)
-
-        # Connect to the SMTP server and send the email
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, recipient_email, msg.as_string())
-        server.quit()
-
+        deliver_pdf(pdf_path, recipient_email)
         return f"Email sent successfully to {recipient_email}!"
+    except (ValueError, FileNotFoundError) as e:
+        return str(e)
     except Exception as e:
         return f"Error while sending email: {e}"
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Persistent background job queue for RALPh.
+
+Jobs are stored in SQLite and processed by a pool of worker threads. Failed attempts
+are retried with exponential backoff when the handler raises a retryable exception,
+idempotency keys make duplicate submissions return the existing job, and jobs that
+were running when the process stopped are picked up again on restart. Job kinds
+registered with a batch size are claimed and handled several due jobs at a time.
+
+Jobs run at least once: an attempt interrupted by a crash is run again. Handlers with
+side effects that must not be repeated (e.g. sending an email) record their progress
+with checkpoint() as soon as the side effect is done, and skip it when they see the
+record on a later attempt; only a crash between the side effect and its checkpoint
+repeats it.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+
+from config import REPORT_JOB_WORKERS, REPORT_JOB_MAX_ATTEMPTS, REPORT_JOB_BACKOFF_SECONDS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    next_attempt_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, next_attempt_at);
+"""
+
+# Statuses of jobs that still have work to do
+PENDING_STATUSES = ("queued", "retrying")
+
+# Jobs with these statuses are returned again for a repeated idempotency key
+REUSABLE_STATUSES = ("queued", "retrying", "running", "succeeded")
+
+JOB_COLUMNS = ["id", "kind", "idempotency_key", "status", "attempts", "payload", "result", "error",
+               "created_at", "updated_at", "next_attempt_at"]
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue with a worker thread pool.
+    """
+
+    def __init__(self,
+                 db_path,
+                 workers=REPORT_JOB_WORKERS,
+                 max_attempts=REPORT_JOB_MAX_ATTEMPTS,
+                 backoff_seconds=REPORT_JOB_BACKOFF_SECONDS):
+        """
+        Open the job database. Workers start with start().
+
+        Args:
+            db_path (str): Path of the SQLite job database
+            workers (int): Number of worker threads
+            max_attempts (int): Attempts before a job is marked failed
+            backoff_seconds (float): Delay before the first retry, doubled for each further retry
+        """
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+        # kind -> (handler, retryable exception types, batch size)
+        self._handlers = {}
+        self._threads = []
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+
+        # Jobs being run by each worker thread, for checkpoint()
+        self._current = threading.local()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+            # Jobs interrupted by a restart are run again, from their last checkpoint
+            self._connection.execute(
+                "UPDATE jobs SET status = 'queued', next_attempt_at = ? WHERE status = 'running'", (time.time(),)
+            )
+
+    def register(self, kind, handler, retry_on=(Exception,), batch_size=1):
+        """
+        Register the handler of a job kind.
+
+        The handler is called with the job payload (a dict) and returns a JSON-serializable
+        result. It may update the payload to keep progress across retries, and persist it
+        at once with checkpoint() to keep progress across a crash.
+
+        With a batch size above 1, up to batch_size due jobs of the kind are claimed together
+        and the handler is called with the list of their payloads. It returns one outcome per
+        payload: the job's result, or the exception that failed the job.
+
+        Args:
+            kind (str): Job kind
+            handler (callable): Handler function
+            retry_on (tuple): Exception types that trigger a retry; others fail the job immediately
+            batch_size (int): Maximum number of jobs handled per call
+        """
+        self._handlers[kind] = (handler, retry_on, batch_size)
+
+    def start(self):
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"JobWorker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        """Stop the worker threads after their current job."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, kind, payload, idempotency_key=None):
+        """
+        Queue a job.
+
+        Args:
+            kind (str): Job kind
+            payload (dict): JSON-serializable job input
+            idempotency_key (str): Submissions with the same key return the existing job,
+                unless that job failed
+
+        Returns:
+            str: Job ID
+        """
+        now = datetime.now().isoformat()
+        with self._wakeup:
+            if idempotency_key:
+                row = self._connection.execute(
+                    "SELECT id, status FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if row and row["status"] in REUSABLE_STATUSES:
+                    return row["id"]
+                if row:
+                    # Retry a failed job from scratch under the same key
+                    with self._connection:
+                        self._connection.execute(
+                            """
+                            UPDATE jobs SET status = 'queued', attempts = 0, payload = ?, result = NULL,
+                                   error = NULL, updated_at = ?, next_attempt_at = ?
+                            WHERE id = ?
+                            """,
+                            (json.dumps(payload), now, time.time(), row["id"])
+                        )
+                    self._wakeup.notify()
+                    return row["id"]
+
+            job_id = uuid.uuid4().hex
+            with self._connection:
+                self._connection.execute(
+                    """
+                    INSERT INTO jobs (id, kind, idempotency_key, status, payload, created_at, updated_at, next_attempt_at)
+                    VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)
+                    """,
+                    (job_id, kind, idempotency_key, json.dumps(payload), now, now, time.time())
+                )
+            self._wakeup.notify()
+            return job_id
+
+    def checkpoint(self, payload):
+        """
+        Persist the payload of a job running on the calling worker thread, so that its
+        progress survives a crash before the attempt finishes.
+
+        Args:
+            payload (dict): Updated payload, as passed to the handler
+        """
+        job = next(job for job in self._current.jobs if job["payload"] is payload)
+        with self._wakeup:
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+                    (json.dumps(payload), datetime.now().isoformat(), job["id"])
+                )
+
+    def get(self, job_id):
+        """
+        Get the record of a job.
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            dict: Job record with decoded payload and result, or None if unknown
+        """
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def stats(self):
+        """
+        Number of jobs per status.
+
+        Returns:
+            dict: status -> count
+        """
+        with self._lock:
+            return dict(self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def _claim(self):
+        """
+        Mark the next due job as running, with further due jobs of its kind if the kind
+        is handled in batches (lock must be held).
+
+        Returns:
+            list: Claimed jobs (empty if none is due)
+        """
+        due = f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM jobs
+            WHERE status IN {PENDING_STATUSES} AND next_attempt_at <= ? {{}}
+            ORDER BY next_attempt_at LIMIT ?
+        """
+        now = time.time()
+        rows = self._connection.execute(due.format(""), (now, 1)).fetchall()
+        if not rows:
+            return []
+
+        batch_size = self._handlers.get(rows[0]["kind"], (None, (), 1))[2]
+        if batch_size > 1:
+            rows = self._connection.execute(due.format("AND kind = ?"), (now, rows[0]["kind"], batch_size)).fetchall()
+
+        with self._connection:
+            self._connection.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(datetime.now().isoformat(), row["id"]) for row in rows]
+            )
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["attempts"] += 1
+            job["payload"] = json.loads(job["payload"])
+            jobs.append(job)
+        return jobs
+
+    def _next_due_in(self):
+        """Seconds until the next pending job is due (lock must be held)."""
+        row = self._connection.execute(
+            f"SELECT MIN(next_attempt_at) FROM jobs WHERE status IN {PENDING_STATUSES}"
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _finish(self, job, status, result=None, error=None, next_attempt_at=0.0):
+        """Record the outcome of an attempt."""
+        with self._wakeup:
+            with self._connection:
+                self._connection.execute(
+                    """
+                    UPDATE jobs SET status = ?, payload = ?, result = ?, error = ?, updated_at = ?, next_attempt_at = ?
+                    WHERE id = ?
+                    """,
+                    (status, json.dumps(job["payload"]), json.dumps(result) if result is not None else None,
+                     error, datetime.now().isoformat(), next_attempt_at, job["id"])
+                )
+            if status == "retrying":
+                self._wakeup.notify()
+
+    def _record(self, job, outcome, retry_on):
+        """Record the outcome of an attempt: a result, or the exception that failed it."""
+        if not isinstance(outcome, Exception):
+            self._finish(job, "succeeded", result=outcome)
+        elif isinstance(outcome, retry_on) and job["attempts"] < self.max_attempts:
+            delay = self.backoff_seconds * 2 ** (job["attempts"] - 1)
+            self._finish(job, "retrying", error=repr(outcome), next_attempt_at=time.time() + delay)
+        else:
+            self._finish(job, "failed", error=repr(outcome))
+
+    def _run(self):
+        """Worker loop: claim due jobs and run their handlers."""
+        while True:
+            with self._wakeup:
+                jobs = []
+                while not self._stopping:
+                    jobs = self._claim()
+                    if jobs:
+                        break
+                    self._wakeup.wait(self._next_due_in())
+                if self._stopping:
+                    return
+
+            handler, retry_on, batch_size = self._handlers.get(jobs[0]["kind"], (None, (), 1))
+            if handler is None:
+                for job in jobs:
+                    self._finish(job, "failed", error=f"No handler for job kind '{job['kind']}'")
+                continue
+
+            self._current.jobs = jobs
+            try:
+                if batch_size > 1:
+                    outcomes = handler([job["payload"] for job in jobs])
+                else:
+                    outcomes = [handler(jobs[0]["payload"])]
+            except Exception as e:
+                outcomes = [e] * len(jobs)
+            finally:
+                self._current.jobs = []
+
+            for job, outcome in zip(jobs, outcomes):
+                self._record(job, outcome, retry_on)
@@ -0,0 +1,24 @@
+"""
+Latency metrics helpers shared by the RALPh schedulers and services.
+"""
+
+
+# Number of recent samples kept per metric for the latency percentiles
+METRICS_WINDOW = 500
+
+
+def percentiles(samples):
+    """
+    Median and 95th percentile of a sample window.
+
+    Args:
+        samples (iterable): Recent values (at least one)
+
+    Returns:
+        dict: "p50" and "p95" -> value, rounded to milliseconds
+    """
+    ordered = sorted(samples)
+    return {
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+    }
@@ -3,12 +3,18 @@ PDF generation functionality for RALPh.
 """
 
 import os
+import copy
+import time
+import uuid
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from fpdf import FPDF
 from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 
 from chat.prompts import SYSTEM_PROMPT_SUMMARIZE
 from config import SUMMARIES_DIR
+from utils.summary_cache import message_lines
 
 
 def summarize_content(content, summaryllm):
@@ -38,51 +44,178 @@ def summarize_content(content, summaryllm):
         return f"Error in summarization: {e}"
 
 
-def generate_pdf(chat_memory, prescription_details, summaryllm):
+def conversation_content(chat_memory, prescription_details):
     """
-    Generate a PDF summary of the conversation.
+    Combine the chat history and prescription details for summarization.
     
     Args:
         chat_memory: Chat memory from the chat system
         prescription_details (str): Prescription details
-        summaryllm: LLM for summarization
         
     Returns:
-        str: Path to the generated PDF
+        str: Content to summarize
     """
-    try:
-        # Ensure summaries directory exists
-        os.makedirs(SUMMARIES_DIR, exist_ok=True)
-        
-        # Combine chat history and prescription details
-        full_content = "\n".join(str(chat_memory.messages) + "\n\n#PRESCRIPTION DETAILS:" + prescription_details)
+    return "\n".join(message_lines(chat_memory)) + "\n\n#PRESCRIPTION DETAILS:" + prescription_details
+
+
+class ReportRenderer:
+    """
+    Renders PDF summaries into memory.
+    
+    The Unicode font is parsed once into a template document with the page layout
+    already configured; each report starts from a copy of that template.
+    """
+    
+    def __init__(self, font_path=None):
+        """
+        Initialize the renderer. The template is built on first use.
         
-        # Summarize content
-        summary = summarize_content(full_content, summaryllm)
+        Args:
+            font_path (str): TTF font with Unicode support (defaults to DejaVu Sans or Arial)
+        """
+        self.font_path = font_path or find_unicode_font()
+        self._template = None
+        self._lock = threading.Lock()
         
-        # Generate the PDF
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_page()
+    def _get_template(self):
+        """Build the template document with the parsed font and page layout."""
+        with self._lock:
+            if self._template is None:
+                pdf = FPDF()
+                pdf.set_auto_page_break(auto=True, margin=15)
+                
+                # Add font with Unicode support
+                pdf.add_font('Unicode', '', self.font_path, uni=True)
+                self._template = pdf
+            return self._template
         
-        # Try to find an appropriate font that supports Unicode
-        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-        if not os.path.exists(font_path):
-            font_path = "C:/Windows/Fonts/Arial.ttf"
+    def render(self, summary):
+        """
+        Render a summary as a PDF document.
         
-        # Add font with Unicode support
-        pdf.add_font('Unicode', '', font_path, uni=True)
+        Args:
+            summary (str): Summary text
+            
+        Returns:
+            bytes: PDF document
+        """
+        pdf = copy.deepcopy(self._get_template())
+        pdf.add_page()
         pdf.set_font('Unicode', size=12)
         
         # Add content to PDF
         pdf.multi_cell(0, 10, summary if summary else "No conversation to save.")
         
-        # Generate filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = os.path.join(SUMMARIES_DIR, f"Chatbot_Summary_{timestamp}.pdf")
+        # PyFPDF returns a latin-1 string, fpdf2 a bytearray
+        output = pdf.output(dest='S')
+        if isinstance(output, str):
+            output = output.encode('latin-1')
+        return bytes(output)
+
+
+def find_unicode_font():
+    """
+    Find a TTF font that supports Unicode.
+    
+    Returns:
+        str: Font path
+    """
+    font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    if not os.path.exists(font_path):
+        font_path = "C:/Windows/Fonts/Arial.ttf"
+    return font_path
+
+
+# Shared renderer and background archival worker
+_renderer = ReportRenderer()
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf_archive")
+
+
+def prebuild_report_template():
+    """
+    Build the shared report template ahead of the first report, so that no report
+    pays for parsing the font.
+    """
+    _renderer._get_template()
+
+
+def pdf_file_name():
+    """
+    Generate a unique PDF file name, since reports may be rendered concurrently.
+    
+    Returns:
+        str: File name
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"Chatbot_Summary_{timestamp}_{uuid.uuid4().hex[:8]}.pdf"
+
+
+def archive_pdf(pdf_bytes, file_name, background=True):
+    """
+    Save a rendered PDF to the summaries directory.
+    
+    Args:
+        pdf_bytes (bytes): PDF document
+        file_name (str): File name
+        background (bool): Write on the archival thread instead of blocking
+        
+    Returns:
+        str or Future: Path to the saved file, or a future of it when writing in the background
+    """
+    def write():
+        os.makedirs(SUMMARIES_DIR, exist_ok=True)
+        path = os.path.join(SUMMARIES_DIR, file_name)
+        with open(path, "wb") as f:
+            f.write(pdf_bytes)
+        return path
+    
+    if background:
+        return _archive_executor.submit(write)
+    return write()
+
+
+def render_pdf_report(full_content, summaryllm=None, summary=None):
+    """
+    Summarize conversation content and render the PDF in memory.
+    
+    Args:
+        full_content (str): Output of conversation_content
+        summaryllm: LLM for summarization
+        summary (str): Existing summary; skips summarization when given
         
-        # Save PDF
-        pdf.output(file_name)
+    Returns:
+        tuple: (pdf_bytes, summary, stats) where stats holds the summarization and
+            rendering times in seconds and the PDF size
+    """
+    stats = {"summary_seconds": 0.0}
+    if summary is None:
+        start_time = time.perf_counter()
+        summary = summarize_content(full_content, summaryllm)
+        stats["summary_seconds"] = round(time.perf_counter() - start_time, 3)
+    
+    start_time = time.perf_counter()
+    pdf_bytes = _renderer.render(summary)
+    stats["render_seconds"] = round(time.perf_counter() - start_time, 4)
+    stats["pdf_bytes"] = len(pdf_bytes)
+    
+    return pdf_bytes, summary, stats
+
+
+def generate_pdf(chat_memory, prescription_details, summaryllm):
+    """
+    Generate a PDF summary of the conversation.
+    
+    Args:
+        chat_memory: Chat memory from the chat system
+        prescription_details (str): Prescription details
+        summaryllm: LLM for summarization
+        
+    Returns:
+        str: Path to the generated PDF
+    """
+    try:
+        pdf_bytes, _, _ = render_pdf_report(conversation_content(chat_memory, prescription_details), summaryllm)
+        file_name = archive_pdf(pdf_bytes, pdf_file_name(), background=False)
         print("PDF report generated!")
         
         return file_name
@@ -0,0 +1,271 @@
+"""
+Sampling profiler for the RALPh request path.
+
+Opt-in with `python main.py --profile`. A fraction of the process_message and
+trigger_bot_response executions is sampled: while a sampled execution runs, a background
+thread records the stack of the thread running it every few milliseconds. The stacks are
+written in collapsed format (one "frame;frame;frame count" line per distinct stack, as
+read by flamegraph.pl, speedscope and inferno) to a file named after the conversation
+and turn, and a "profile" event in the structured log points to the file.
+
+Only time spent inside the sampled function is recorded; for generators, the time the
+caller spends between chunks (e.g. Gradio sending updates) is not.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import inspect
+import threading
+import functools
+from collections import Counter
+
+from config import PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS, PROFILES_DIR
+
+
+# Deepest stack recorded (frames beyond it are cut at the root side)
+MAX_STACK_DEPTH = 200
+
+
+class _Sampler:
+    """
+    Background thread that records the stacks of the threads running sampled executions.
+    """
+
+    def __init__(self, interval):
+        """
+        Initialize the sampler and start its thread.
+
+        Args:
+            interval (float): Seconds between samples
+        """
+        self.interval = interval
+
+        # thread ID -> recordings active on that thread (nested executions share samples)
+        self._targets = {}
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="ProfileSampler", daemon=True).start()
+
+    def register(self, thread_id, recording):
+        with self._condition:
+            self._targets.setdefault(thread_id, []).append(recording)
+            self._condition.notify()
+
+    def unregister(self, thread_id, recording):
+        with self._condition:
+            recordings = self._targets.get(thread_id)
+            if recordings and recording in recordings:
+                recordings.remove(recording)
+                if not recordings:
+                    del self._targets[thread_id]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._targets:
+                    self._condition.wait()
+                targets = {thread_id: list(recordings) for thread_id, recordings in self._targets.items()}
+
+            frames = sys._current_frames()
+            for thread_id, recordings in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = _stack_labels(frame)
+                    for recording in recordings:
+                        recording.stacks[stack] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+# code object -> frame label
+_labels = {}
+
+
+def _frame_label(code):
+    """Label of a frame in the collapsed stacks: "function (path:line)"."""
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(os.getcwd()):
+            path = os.path.relpath(path)
+        elif "site-packages" in path:
+            path = path.split("site-packages" + os.sep, 1)[1]
+        label = _labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+    return label
+
+
+def _stack_labels(frame):
+    """Collapsed stack of a frame, root first."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class ProfileRecording:
+    """
+    Stack samples of one sampled execution.
+    """
+
+    def __init__(self, profiler, kind, logger, convo_number, turn_number):
+        """
+        Initialize the recording.
+
+        Args:
+            profiler (RequestProfiler): Profiler the recording belongs to
+            kind (str): Profiled function, e.g. "process_message"
+            logger (ChatSystemLogger): Logger of the conversation
+            convo_number (int): Conversation number
+            turn_number (int): Turn number
+        """
+        self.profiler = profiler
+        self.kind = kind
+        self.logger = logger
+        self.convo_number = convo_number
+        self.turn_number = turn_number
+        self.stacks = Counter()
+        self.duration = 0.0
+        self._resumed_at = None
+
+    def resume(self):
+        """Start sampling the current thread."""
+        self._resumed_at = time.perf_counter()
+        self.profiler.sampler.register(threading.get_ident(), self)
+
+    def pause(self):
+        """Stop sampling the current thread."""
+        self.profiler.sampler.unregister(threading.get_ident(), self)
+        self.duration += time.perf_counter() - self._resumed_at
+
+    def finish(self):
+        """Write the collapsed stacks and log where they are."""
+        conversation_id = self.logger.conversation_id or "unknown"
+        file_name = "{}_c{}_t{:04d}_{}_{}.collapsed".format(
+            re.sub(r"[^\w-]", "_", conversation_id), self.convo_number, self.turn_number,
+            self.kind, int(time.time() * 1000)
+        )
+        path = os.path.join(self.profiler.output_dir, file_name)
+
+        # Snapshot the counter: a last sample may still be being added
+        stacks = list(self.stacks.items())
+        try:
+            os.makedirs(self.profiler.output_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(stacks):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            # Profiling must never fail the request
+            self.logger.logger.warning("Could not write profile %s: %s", path, e)
+            return
+
+        self.logger.log_event(
+            "profile",
+            function=self.kind,
+            convo_number=self.convo_number,
+            turn_number=self.turn_number,
+            samples=sum(count for _, count in stacks),
+            duration=round(self.duration, 3),
+            path=path
+        )
+
+
+class RequestProfiler:
+    """
+    Decides which executions to sample and owns the sampler thread.
+    """
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, interval_ms=PROFILE_INTERVAL_MS, output_dir=PROFILES_DIR):
+        """
+        Initialize the profiler.
+
+        Args:
+            sample_rate (float): Share of executions sampled (0 to 1)
+            interval_ms (float): Milliseconds between stack samples
+            output_dir (str): Directory for the collapsed stack files
+        """
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.sampler = _Sampler(interval_ms / 1000)
+
+    def should_sample(self):
+        return random.random() < self.sample_rate
+
+
+# Profiler of the process, set by enable_profiling
+_profiler = None
+
+
+def enable_profiling(sample_rate=PROFILE_SAMPLE_RATE, interval_ms=PROFILE_INTERVAL_MS, output_dir=PROFILES_DIR):
+    """
+    Start sampling the functions decorated with @profiled.
+
+    Args:
+        sample_rate (float): Share of executions sampled (0 to 1)
+        interval_ms (float): Milliseconds between stack samples
+        output_dir (str): Directory for the collapsed stack files
+
+    Returns:
+        RequestProfiler: The process-wide profiler
+    """
+    global _profiler
+    _profiler = RequestProfiler(sample_rate, interval_ms, output_dir)
+    return _profiler
+
+
+def profiled(kind, context):
+    """
+    Decorate a method so that a share of its executions is profiled once profiling is enabled.
+
+    Works for plain methods and for generator methods; generators are sampled while they
+    produce each item, in whichever thread resumes them.
+
+    Args:
+        kind (str): Name of the profiled function in file names and logs
+        context (callable): Maps the instance and the call arguments to (logger, convo_number,
+            turn_number)
+
+    Returns:
+        callable: Decorator
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                profiler = _profiler
+                if profiler is None or not profiler.should_sample():
+                    return (yield from func(self, *args, **kwargs))
+
+                recording = ProfileRecording(profiler, kind, *context(self, *args, **kwargs))
+                iterator = func(self, *args, **kwargs)
+                try:
+                    while True:
+                        recording.resume()
+                        try:
+                            item = next(iterator)
+                        except StopIteration as stop:
+                            return stop.value
+                        finally:
+                            recording.pause()
+                        yield item
+                finally:
+                    iterator.close()
+                    recording.finish()
+        else:
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                profiler = _profiler
+                if profiler is None or not profiler.should_sample():
+                    return func(self, *args, **kwargs)
+
+                recording = ProfileRecording(profiler, kind, *context(self, *args, **kwargs))
+                recording.resume()
+                try:
+                    return func(self, *args, **kwargs)
+                finally:
+                    recording.pause()
+                    recording.finish()
+        return wrapper
+    return decorator
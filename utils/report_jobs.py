@@ -0,0 +1,184 @@
+"""
+Background PDF summary generation and email delivery for RALPh.
+"""
+
+import time
+import hashlib
+import smtplib
+
+from config import REPORT_JOB_DB_PATH, REPORT_JOB_MAX_ATTEMPTS, REPORT_JOB_BATCH_SIZE, PDF_ARCHIVE_ENABLED
+from utils.job_queue import JobQueue
+from utils.pdf_generator import render_pdf_report, pdf_file_name, archive_pdf
+from utils.summary_cache import message_lines, prefix_keys
+from utils.email_sender import deliver_pdf_batch
+from utils.stage_scheduler import get_scheduler, StageBusy, STAGE_REPORT
+
+
+REPORT_JOB_KIND = "pdf_email"
+
+
+class ReportGenerationError(RuntimeError):
+    """Raised when the PDF summary could not be generated."""
+
+
+def create_report_job_queue(summary_cache, db_path=REPORT_JOB_DB_PATH, deliver_batch=deliver_pdf_batch,
+                            batch_size=REPORT_JOB_BATCH_SIZE):
+    """
+    Create and start the report job queue.
+
+    Due report jobs are claimed together (up to batch_size) and their emails are sent
+    over one SMTP session.
+
+    Args:
+        summary_cache (ReportSummaryCache): Cache of conversation summaries
+        db_path (str): Path of the SQLite job database
+        deliver_batch (callable): Sends PDFs, called with a list of (pdf_bytes, file_name,
+            recipient_email) tuples; returns None or an exception per PDF
+        batch_size (int): Maximum number of reports sent together
+
+    Returns:
+        JobQueue: Started job queue with the report handler registered
+    """
+    def summarize(payload):
+        """Summarize the conversation of a report, unless done on an earlier attempt."""
+        try:
+            if payload.get("summary") is None:
+                payload["summary"], stats = summary_cache.summarize(
+                    payload["messages"], payload["prescription_details"]
+                )
+                return stats
+        except StageBusy:
+            raise
+        except Exception as e:
+            raise ReportGenerationError(f"Failed to generate PDF summary: {e}") from e
+        return {}
+
+    def handle_report_jobs(payloads):
+        outcomes = [None] * len(payloads)
+
+        # Keep the summary across retries, so a failed send does not summarize again
+        summarized = []
+        for index, payload in enumerate(payloads):
+            # Sent before a crash or a retry: finish without emailing the report again
+            if payload.get("delivered") is not None:
+                outcomes[index] = payload["delivered"]
+                continue
+            try:
+                summarized.append((index, summarize(payload)))
+            except (StageBusy, ReportGenerationError) as e:
+                outcomes[index] = e
+        if not summarized:
+            return outcomes
+
+        # Render and send within the report stage limit, behind interactive chat turns
+        queued_at = time.perf_counter()
+        prepared = []
+        with get_scheduler().slot(STAGE_REPORT):
+            report_wait = time.perf_counter() - queued_at
+            for index, summary_stats in summarized:
+                payload = payloads[index]
+                try:
+                    pdf_bytes, _, stats = render_pdf_report(None, summary=payload["summary"])
+                except Exception as e:
+                    outcomes[index] = ReportGenerationError(f"Failed to generate PDF summary: {e}")
+                    continue
+                stats.update(summary_stats)
+                stats["report_wait_seconds"] = round(report_wait, 3)
+                prepared.append((index, pdf_bytes, payload.setdefault("file_name", pdf_file_name()), stats))
+
+            # Send all rendered reports over one SMTP session
+            start_time = time.perf_counter()
+            try:
+                sent = deliver_batch([
+                    (pdf_bytes, file_name, payloads[index]["recipient_email"])
+                    for index, pdf_bytes, file_name, _ in prepared
+                ])
+            except Exception as e:
+                # E.g. the server is unreachable: none of the reports was sent
+                sent = [e] * len(prepared)
+            send_seconds = round(time.perf_counter() - start_time, 3)
+
+        for (index, pdf_bytes, file_name, stats), error in zip(prepared, sent):
+            if error is not None:
+                outcomes[index] = error
+                continue
+            payload = payloads[index]
+            stats.update(send_seconds=send_seconds, batch_size=len(prepared))
+            outcomes[index] = {
+                "message": f"Email sent successfully to {payload['recipient_email']}!",
+                "file_name": file_name,
+                "stats": stats,
+            }
+            
+            # Record the delivery at once, so that a crash before the job is marked succeeded
+            # does not send the email again (delivery is at-least-once only for a crash
+            # between the send and this checkpoint)
+            payload["delivered"] = outcomes[index]
+            job_queue.checkpoint(payload)
+
+            if PDF_ARCHIVE_ENABLED:
+                archive_pdf(pdf_bytes, file_name)
+
+        return outcomes
+
+    job_queue = JobQueue(db_path)
+    job_queue.register(
+        REPORT_JOB_KIND,
+        handle_report_jobs,
+        retry_on=(smtplib.SMTPException, OSError, ReportGenerationError, StageBusy),
+        batch_size=batch_size
+    )
+    job_queue.start()
+    return job_queue
+
+
+def submit_report_job(job_queue, chat_memory, prescription_details, recipient_email):
+    """
+    Queue a PDF summary for email delivery.
+
+    Repeated submissions of the same conversation to the same address return the
+    existing job instead of sending the email twice.
+
+    Args:
+        job_queue (JobQueue): Report job queue
+        chat_memory: Chat memory from the chat system
+        prescription_details (str): Prescription details
+        recipient_email (str): Recipient's email address
+
+    Returns:
+        str: Job ID
+    """
+    lines = message_lines(chat_memory)
+    recipient_email = recipient_email.strip()
+    conversation_key = prefix_keys(lines, prescription_details)[-1]
+    idempotency_key = hashlib.sha256(f"{recipient_email.lower()}\0{conversation_key}".encode("utf-8")).hexdigest()
+
+    return job_queue.submit(
+        REPORT_JOB_KIND,
+        {"messages": lines, "prescription_details": prescription_details, "recipient_email": recipient_email},
+        idempotency_key=idempotency_key
+    )
+
+
+def describe_report_job(job):
+    """
+    Describe the state of a report job for the user.
+
+    Args:
+        job (dict): Job record from JobQueue.get
+
+    Returns:
+        str: Status message
+    """
+    if job is None:
+        return ""
+    status = job["status"]
+    if status == "queued":
+        return "Your PDF summary is queued and will be emailed shortly."
+    if status == "running":
+        return "Preparing and sending your PDF summary..."
+    if status == "retrying":
+        return f"Sending the PDF summary failed, retrying (attempt {job['attempts'] + 1} of {REPORT_JOB_MAX_ATTEMPTS})..."
+    if status == "succeeded":
+        return job["result"]["message"]
+    return f"Could not send the PDF summary: {job['error']}"
@@ -0,0 +1,248 @@
+# Pooled, persistent SMTP connections for RALPh.
+
+import time
+import smtplib
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from config import (
+    EMAIL_SENDER,
+    EMAIL_PASSWORD,
+    EMAIL_SMTP_SERVER,
+    EMAIL_SMTP_PORT,
+    EMAIL_SMTP_STARTTLS,
+    EMAIL_SMTP_POOL_SIZE,
+    EMAIL_SMTP_IDLE_TIMEOUT,
+    EMAIL_SMTP_NOOP_INTERVAL,
+    EMAIL_SMTP_MAX_MESSAGES
+)
+
+
+def _is_connection_error(error):
+    """
+    Check whether an error means the session is unusable.
+
+    SMTPException subclasses OSError, so socket errors are told apart from rejected
+    commands (e.g. a refused recipient), after which the session is still usable.
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class _PooledConnection:
+    """An open SMTP session and its usage counters."""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Pool of logged-in SMTP sessions that are reused across messages.
+
+    At most max_connections sessions are open at once, to stay within the provider's
+    connection limits. Idle sessions are checked with NOOP before reuse and replaced
+    if the server dropped them; sessions are recycled after max_messages messages.
+    """
+
+    def __init__(self,
+                 host=EMAIL_SMTP_SERVER,
+                 port=EMAIL_SMTP_PORT,
+                 username=EMAIL_SENDER,
+                 password=EMAIL_PASSWORD,
+                 use_starttls=EMAIL_SMTP_STARTTLS,
+                 max_connections=EMAIL_SMTP_POOL_SIZE,
+                 idle_timeout=EMAIL_SMTP_IDLE_TIMEOUT,
+                 noop_interval=EMAIL_SMTP_NOOP_INTERVAL,
+                 max_messages=EMAIL_SMTP_MAX_MESSAGES,
+                 connect_timeout=30,
+                 smtp_class=smtplib.SMTP):
+        """
+        Initialize the pool. Connections are opened on demand.
+
+        Args:
+            host (str): SMTP server
+            port (int): SMTP port
+            username (str): Login user, or None to skip login (e.g. a local test server)
+            password (str): Login password
+            use_starttls (bool): Upgrade the session with STARTTLS
+            max_connections (int): Maximum number of open sessions
+            idle_timeout (float): Idle seconds after which a session is closed instead of reused
+            noop_interval (float): Idle seconds after which a session is checked with NOOP
+            max_messages (int): Messages per session before it is recycled
+            connect_timeout (float): Socket timeout in seconds
+            smtp_class (type): SMTP client class
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_starttls = use_starttls
+        self.idle_timeout = idle_timeout
+        self.noop_interval = noop_interval
+        self.max_messages = max_messages
+        self.connect_timeout = connect_timeout
+        self.smtp_class = smtp_class
+
+        self.connections_opened = 0
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Open and log in a new session."""
+        smtp = self.smtp_class(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            if self.use_starttls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        self.connections_opened += 1
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        """Close a session, ignoring errors from an already dropped server."""
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, connection):
+        """Check an idle session with NOOP if it has not been used recently."""
+        idle = time.monotonic() - connection.last_used
+        if idle >= self.idle_timeout or connection.messages_sent >= self.max_messages:
+            return False
+        if idle < self.noop_interval:
+            return True
+        try:
+            return connection.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self, timeout=None):
+        """Take a live session from the pool, opening one if needed."""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Timed out waiting for an SMTP connection")
+
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    return self._open()
+                if self._is_alive(connection):
+                    return connection
+                self._close(connection.smtp)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, reusable=True):
+        """Return a session to the pool, or close it."""
+        if reusable:
+            connection.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(connection)
+        else:
+            self._close(connection.smtp)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Borrow a logged-in SMTP session.
+
+        Args:
+            timeout (float): Maximum seconds to wait for a free connection
+
+        Yields:
+            smtplib.SMTP: Session to send with
+        """
+        connection = self._acquire(timeout)
+        try:
+            yield connection.smtp
+        except BaseException as e:
+            self._release(connection, reusable=not _is_connection_error(e))
+            raise
+        else:
+            connection.messages_sent += 1
+            self._release(connection)
+
+    def send(self, from_addr, to_addrs, message):
+        """
+        Send one message, reconnecting once if the server dropped the session.
+
+        Args:
+            from_addr (str): Envelope sender
+            to_addrs (str or list): Envelope recipients
+            message (str or bytes): Serialized message
+        """
+        for attempt in range(2):
+            try:
+                with self.connection() as smtp:
+                    smtp.sendmail(from_addr, to_addrs, message)
+                return
+            except OSError as e:
+                if attempt == 1 or not _is_connection_error(e):
+                    raise
+
+    def send_batch(self, messages):
+        """
+        Send queued messages over as few sessions as possible.
+
+        Args:
+            messages (list): (from_addr, to_addrs, message) tuples
+
+        Returns:
+            list: None for each delivered message, or the exception that prevented delivery
+        """
+        pending = deque(enumerate(messages))
+        outcomes = {}
+        reconnects = 0
+
+        while pending:
+            connection = self._acquire()
+            reusable = True
+            try:
+                while pending and connection.messages_sent < self.max_messages:
+                    index, (from_addr, to_addrs, message) = pending[0]
+                    try:
+                        connection.smtp.sendmail(from_addr, to_addrs, message)
+                        connection.messages_sent += 1
+                        outcomes[index] = None
+                    except OSError as e:
+                        if not _is_connection_error(e):
+                            # Rejected message (e.g. bad recipient); the session stays usable
+                            outcomes[index] = e
+                            pending.popleft()
+                            continue
+                        # Retry the message on a new session, but do not loop on a broken server
+                        reusable = False
+                        reconnects += 1
+                        if reconnects > len(messages):
+                            outcomes[index] = e
+                            pending.popleft()
+                        break
+                    pending.popleft()
+            finally:
+                self._release(connection, reusable)
+
+        return [outcomes.get(index) for index in range(len(messages))]
+
+    def close(self):
+        """Close all idle sessions."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection in idle:
+            self._close(connection.smtp)
@@ -1,18 +1,63 @@
 # Speech-to-text and text-to-speech functionality for RALPh.
 
 import os
+import re
+import time
+import uuid
+import threading
+from collections import deque
 from datetime import datetime
-import sounddevice as sd
-import numpy as np
-import scipy.io.wavfile as wav
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
 
-from config import ELEVENLABS_API_KEY, AUDIO_FILES_DIR
+from config import ELEVENLABS_API_KEY, AUDIO_FILES_DIR, TTS_CACHE_ENABLED, STT_PREPROCESS_ENABLED
+from utils.speech_service import get_speech_service, SpeechServiceBusy
+from utils.tts_cache import TTSCache, cache_key
 
+# Text-to-speech voice settings
+TTS_VOICE_ID = "JBFqnCBsd6RMkjVDRZzb"
+TTS_MODEL_ID = "eleven_flash_v2_5"
+TTS_OUTPUT_FORMAT = "mp3_44100_128"
 
-# Initialize ElevenLabs client
-client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+# Sentences shorter than this are merged with the next one before synthesis
+MIN_SENTENCE_CHARS = 40
+
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+MARKDOWN_PATTERN = re.compile(r"[*_`#>]+|^\s*[-+]\s+", re.M)
+
+# ElevenLabs client and synthesized speech cache, created on first use
+_client = None
+_tts_cache = None
+_init_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Get the shared ElevenLabs client.
+    
+    Returns:
+        ElevenLabs: The client
+    """
+    global _client
+    with _init_lock:
+        if _client is None:
+            from elevenlabs.client import ElevenLabs
+            _client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+        return _client
+
+
+def get_tts_cache():
+    """
+    Get the shared synthesized speech cache.
+    
+    Returns:
+        TTSCache: The cache, or None if caching is disabled
+    """
+    global _tts_cache
+    if not TTS_CACHE_ENABLED:
+        return None
+    with _init_lock:
+        if _tts_cache is None:
+            _tts_cache = TTSCache()
+        return _tts_cache
 
 
 def record_audio(output_filename="recording.wav", duration=10, sample_rate=44100):
@@ -27,6 +72,11 @@ def record_audio(output_filename="recording.wav", duration=10, sample_rate=44100
     Returns:
         str: Path to the recorded audio file
     """
+    # Audio device libraries are only needed (and only work) on machines with a microphone
+    import sounddevice as sd
+    import numpy as np
+    import scipy.io.wavfile as wav
+    
     print(f"Recording for {duration} seconds...")
 
     # Capture audio
@@ -45,77 +95,307 @@ def record_audio(output_filename="recording.wav", duration=10, sample_rate=44100
     return output_filename
 
 
-def audio_to_text(audio_file):
+def audio_to_text(audio_file, return_stats=False):
     """
     Convert audio file to text using ElevenLabs API.
     
+    WAV recordings are resampled, trimmed and compressed before upload when
+    STT_PREPROCESS_ENABLED is set; other files are uploaded as-is.
+    
     Args:
         audio_file (str): Path to audio file
+        return_stats (bool): Also return upload sizes and timings
         
     Returns:
-        tuple: (text, language, language_probability, words)
+        tuple: (text, language, language_probability, words), followed by a stats dict
+            if return_stats is True
     """
     # Check if file exists
     if not os.path.exists(audio_file):
         raise FileNotFoundError(f"Audio file not found: {audio_file}")
     
+    stats = {"original_bytes": os.path.getsize(audio_file), "preprocessed": False}
+    upload_file = None
+    if STT_PREPROCESS_ENABLED and audio_file.lower().endswith(".wav"):
+        try:
+            from utils.audio_preprocess import preprocess_for_stt
+            upload_file, preprocess_stats = preprocess_for_stt(audio_file)
+            stats.update(preprocess_stats, preprocessed=True)
+        except (ValueError, OSError) as e:
+            print(f"Audio preprocessing failed, uploading original file: {e}")
+    
     # Send to ElevenLabs API
-    with open(audio_file, "rb") as audio:
+    client = get_client()
+    start_time = time.perf_counter()
+    if upload_file is None:
+        stats["upload_bytes"] = stats["original_bytes"]
+        with open(audio_file, "rb") as audio:
+            response = client.speech_to_text.convert(
+                model_id="scribe_v1",
+                file=audio,
+                num_speakers=1,
+            )
+    else:
         response = client.speech_to_text.convert(
             model_id="scribe_v1",
-            file=audio,
+            file=upload_file,
             num_speakers=1,
         )
+    stats["stt_duration"] = round(time.perf_counter() - start_time, 3)
 
     text = response.text
     lang = response.language_code
     lang_probability = response.language_probability
     words = response.words
 
+    if return_stats:
+        return text, lang, lang_probability, words, stats
     return text, lang, lang_probability, words
 
 
-def text_to_audio(text_input):
+def _synthesize(text_input):
     """
-    Convert text to audio using ElevenLabs API.
+    Synthesize text with ElevenLabs, or return the cached audio of an identical request.
     
     Args:
         text_input (str): Text to convert to speech
         
     Returns:
-        tuple: (audio_generator, audio_file_path)
+        tuple: (audio_bytes, audio_file_path), the path is None when caching is disabled
     """
-    # Ensure audio files directory exists
-    os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
+    key = cache_key(text_input, TTS_VOICE_ID, TTS_MODEL_ID, TTS_OUTPUT_FORMAT)
+    tts_cache = get_tts_cache()
+    if tts_cache:
+        cached = tts_cache.get(key)
+        if cached:
+            return cached
     
-    # Input validation
-    if not text_input or not isinstance(text_input, str):
-        raise ValueError("Invalid text input")
-
-    # Convert to audio - creates a generator object
-    audio = client.text_to_speech.convert(
+    audio = get_client().text_to_speech.convert(
         text=text_input,
-        voice_id="JBFqnCBsd6RMkjVDRZzb",
-        model_id="eleven_flash_v2_5",
-        output_format="mp3_44100_128",
+        voice_id=TTS_VOICE_ID,
+        model_id=TTS_MODEL_ID,
+        output_format=TTS_OUTPUT_FORMAT,
     )
+    audio_data = b"".join(chunk for chunk in audio if chunk)
+    
+    return audio_data, tts_cache.put(key, audio_data) if tts_cache else None
+
 
-    # Generate filename with timestamp
+def _save_audio(audio_data):
+    """
+    Save MP3 audio as a new file in the audio files folder, outside the speech cache.
+    
+    Args:
+        audio_data (bytes): MP3 audio
+        
+    Returns:
+        str: Path to the saved file
+    """
+    os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
+    
+    # Generate a unique filename so that concurrent saves never collide
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    audio_file = os.path.join(AUDIO_FILES_DIR, f"output_audio_{timestamp}.mp3")
+    audio_file = os.path.join(AUDIO_FILES_DIR, f"output_audio_{timestamp}_{uuid.uuid4().hex[:8]}.mp3")
     
-    # Save to mp3 file
     with open(audio_file, "wb") as f:
-        for chunk in audio:
-            if chunk:
-                f.write(chunk)
+        f.write(audio_data)
+        
+    return audio_file
+
+
+def text_to_audio(text_input):
+    """
+    Convert text to audio using ElevenLabs API.
+    
+    Args:
+        text_input (str): Text to convert to speech
+        
+    Returns:
+        tuple: (audio_generator, audio_file_path)
+    """
+    # Input validation
+    if not text_input or not isinstance(text_input, str):
+        raise ValueError("Invalid text input")
 
-    # Return a fresh generator and the file path
-    with open(audio_file, "rb") as f:
-        audio_data = f.read()
+    # Convert to audio, keeping the bytes in memory for the returned generator
+    audio_data, audio_file = _synthesize(text_input)
+    if audio_file is None:
+        audio_file = _save_audio(audio_data)
     
-    # Recreate generator to avoid exhaustion
     def audio_generator():
         yield audio_data
     
-    return audio_generator(), audio_file
\ No newline at end of file
+    return audio_generator(), audio_file
+
+
+class SentenceBuffer:
+    """
+    Accumulates streamed text and emits complete sentences.
+    """
+    
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        """
+        Initialize the buffer.
+        
+        Args:
+            min_chars (int): Minimum length of an emitted sentence
+        """
+        self.min_chars = min_chars
+        self._buffer = ""
+        self._scan_from = 0
+        
+    def feed(self, text):
+        """
+        Add streamed text.
+        
+        Args:
+            text (str): Next piece of the text stream
+            
+        Returns:
+            list: Sentences completed by this piece
+        """
+        self._buffer += text
+        sentences = []
+        
+        # Only scan the new text (plus a little look-behind for closing quotes)
+        search_from = max(0, self._scan_from - 3)
+        while True:
+            match = SENTENCE_BOUNDARY_PATTERN.search(self._buffer, search_from)
+            if not match or match.end() == len(self._buffer):
+                # A boundary at the very end may still grow (e.g. more whitespace)
+                self._scan_from = match.start() if match else len(self._buffer)
+                break
+            if match.start() < self.min_chars:
+                # Too short to synthesize on its own, merge with the next sentence
+                search_from = match.end()
+                continue
+            sentences.append(self._buffer[:match.start()].strip())
+            self._buffer = self._buffer[match.end():]
+            search_from = 0
+            
+        return [sentence for sentence in sentences if sentence]
+    
+    def flush(self):
+        """
+        Return the remaining text as the last sentence.
+        
+        Returns:
+            list: The remaining sentence, if any
+        """
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        self._scan_from = 0
+        return [remainder] if remainder else []
+
+
+class SentenceTTSPipeline:
+    """
+    Pipelines text-to-speech by sentence: each sentence is synthesized as soon as it is
+    complete in the text stream, and its audio is released in order as soon as it is ready.
+    
+    Synthesis runs on the shared speech service, so its concurrency limit applies across
+    all users. Sentences that are rejected, time out or fail are skipped.
+    """
+    
+    def __init__(self):
+        """Initialize the pipeline."""
+        self._service = get_speech_service()
+        self._sentences = SentenceBuffer()
+        self._pending = deque()
+        self._audio_chunks = []
+        
+    def _submit(self, sentences):
+        """Start synthesizing completed sentences."""
+        for sentence in sentences:
+            speech_text = MARKDOWN_PATTERN.sub("", sentence).strip()
+            if not speech_text:
+                continue
+            try:
+                self._pending.append((speech_text, self._service.submit("tts", _synthesize, speech_text)))
+            except SpeechServiceBusy as e:
+                print(f"Skipping speech for a sentence: {e}")
+    
+    def _collect(self):
+        """Take the audio of the next pending sentence, or None if it failed."""
+        speech_text, future = self._pending.popleft()
+        try:
+            audio_data = future.result()[0]
+        except Exception as e:
+            print(f"Skipping speech for a sentence: {e!r}")
+            return None
+        self._audio_chunks.append(audio_data)
+        return audio_data
+    
+    def feed(self, text):
+        """
+        Add streamed response text.
+        
+        Args:
+            text (str): Next piece of the response
+        """
+        self._submit(self._sentences.feed(text))
+        
+    def finish(self):
+        """Synthesize the remaining text once the response is complete."""
+        self._submit(self._sentences.flush())
+        
+    def ready_chunks(self):
+        """
+        Collect the audio of sentences that are already synthesized, without blocking.
+        
+        Returns:
+            list: MP3 chunks in sentence order
+        """
+        chunks = []
+        while self._pending and self._pending[0][1].done():
+            chunk = self._collect()
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+    
+    def remaining_chunks(self):
+        """
+        Wait for the remaining sentences in order.
+        
+        Yields:
+            bytes: MP3 chunk of the next sentence
+        """
+        while self._pending:
+            chunk = self._collect()
+            if chunk:
+                yield chunk
+        
+    def cancel(self):
+        """Cancel sentences that have not been synthesized, e.g. when the user leaves."""
+        while self._pending:
+            self._pending.popleft()[1].cancel()
+        
+    def save(self):
+        """
+        Save the audio streamed so far as one MP3 file.
+        
+        The joined reply is written to the audio files folder, not to the speech cache:
+        whole replies are rarely repeated and would push the reusable sentences out of it.
+        
+        Returns:
+            str: Path to the saved file, or None if there is no audio
+        """
+        if not self._audio_chunks:
+            return None
+        return _save_audio(b"".join(self._audio_chunks))
+
+
+def submit_audio_to_text(audio_file):
+    """
+    Schedule speech-to-text on the shared speech service.
+    
+    Args:
+        audio_file (str): Path to audio file
+        
+    Returns:
+        concurrent.futures.Future: Result of audio_to_text with stats
+        
+    Raises:
+        SpeechServiceBusy: If too many speech calls are already waiting
+    """
+    return get_speech_service().submit("stt", audio_to_text, audio_file, return_stats=True)
@@ -0,0 +1,189 @@
+"""
+Bounded asynchronous execution of speech vendor calls for RALPh.
+
+Speech-to-text and text-to-speech calls are scheduled on a dedicated asyncio event loop.
+A semaphore caps the number of concurrent vendor calls, admission control rejects new
+calls when too many are already waiting, and every call has a timeout. Callers get a
+concurrent.futures.Future; cancelling it drops a call that has not started yet.
+
+A call that times out is abandoned, but its worker thread stays busy until the vendor
+responds, since blocking SDK calls cannot be interrupted.
+"""
+
+import time
+import asyncio
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SPEECH_MAX_CONCURRENCY, SPEECH_MAX_QUEUE, SPEECH_TIMEOUT
+from utils.metrics import METRICS_WINDOW, percentiles
+
+
+class SpeechServiceBusy(Exception):
+    """Raised when a speech call is rejected because the queue is full."""
+
+
+class SpeechService:
+    """
+    Runs blocking speech calls with bounded concurrency on a background event loop.
+    """
+
+    def __init__(self, max_concurrency=SPEECH_MAX_CONCURRENCY, max_queue=SPEECH_MAX_QUEUE, timeout=SPEECH_TIMEOUT):
+        """
+        Initialize the service and start its event loop thread.
+
+        Args:
+            max_concurrency (int): Maximum number of concurrent vendor calls
+            max_queue (int): Maximum number of calls waiting for a slot before new calls are rejected
+            timeout (float): Default seconds a call may run before it is abandoned
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="speech")
+        self._semaphore = None
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+        # Per call kind: outcome counters and recent queue wait / service time samples
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._queue_waits = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+        self._service_times = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), name="SpeechService", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def _run(self, started):
+        """Event loop thread."""
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop.call_soon(started.set)
+        self._loop.run_forever()
+
+    def _count(self, kind, outcome):
+        """Increment an outcome counter."""
+        with self._lock:
+            self._counters[kind][outcome] += 1
+
+    def _leave_queue(self, call):
+        """Stop counting a call as waiting (once)."""
+        with self._lock:
+            if not call["dequeued"]:
+                call["dequeued"] = True
+                self._waiting -= 1
+
+    async def _execute(self, kind, timeout, call, func, args, kwargs):
+        """Wait for a concurrency slot, then run the call in the worker pool."""
+        try:
+            async with self._semaphore:
+                started_at = time.perf_counter()
+                self._leave_queue(call)
+                with self._lock:
+                    self._queue_waits[kind].append(started_at - call["queued_at"])
+                try:
+                    result = await asyncio.wait_for(
+                        self._loop.run_in_executor(self._executor, lambda: func(*args, **kwargs)),
+                        timeout
+                    )
+                finally:
+                    with self._lock:
+                        self._service_times[kind].append(time.perf_counter() - started_at)
+        except asyncio.CancelledError:
+            self._count(kind, "cancelled")
+            raise
+        except asyncio.TimeoutError:
+            self._count(kind, "timed_out")
+            raise
+        except Exception:
+            self._count(kind, "failed")
+            raise
+
+        self._count(kind, "completed")
+        return result
+
+    def submit(self, kind, func, *args, timeout=None, **kwargs):
+        """
+        Schedule a blocking speech call.
+
+        Args:
+            kind (str): Call kind used for metrics, e.g. "stt" or "tts"
+            func (callable): Blocking function to run
+            *args: Positional arguments of the function
+            timeout (float): Seconds the call may run (defaults to the service timeout)
+            **kwargs: Keyword arguments of the function
+
+        Returns:
+            concurrent.futures.Future: Result of the call; cancelling it drops the call if
+                it has not started
+
+        Raises:
+            SpeechServiceBusy: If too many calls are already waiting
+        """
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._counters[kind]["rejected"] += 1
+                raise SpeechServiceBusy(f"Speech service busy: {self._waiting} calls waiting")
+            self._waiting += 1
+            self._counters[kind]["submitted"] += 1
+
+        call = {"queued_at": time.perf_counter(), "dequeued": False}
+        future = asyncio.run_coroutine_threadsafe(
+            self._execute(kind, timeout or self.timeout, call, func, args, kwargs), self._loop
+        )
+        # A call cancelled before it got a slot leaves the queue as well
+        future.add_done_callback(lambda _: self._leave_queue(call))
+        return future
+
+    def metrics(self):
+        """
+        Outcome counters and latency percentiles per call kind.
+
+        Returns:
+            dict: kind -> counters, queue wait and service time percentiles (seconds)
+        """
+        with self._lock:
+            result = {"waiting": self._waiting}
+            for kind in set(self._counters) | set(self._queue_waits):
+                entry = dict(self._counters[kind])
+                for name, samples in (("queue_wait", self._queue_waits[kind]), ("service_time", self._service_times[kind])):
+                    if samples:
+                        entry[name] = percentiles(samples)
+                result[kind] = entry
+            return result
+
+
+# Shared service, started on first use
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_speech_service():
+    """
+    Get the shared speech service.
+
+    Returns:
+        SpeechService: The process-wide speech service
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SpeechService()
+        return _service
+
+
+def speech_metrics():
+    """
+    Metrics of the shared speech service, without starting it.
+
+    Returns:
+        dict: Speech service metrics (see SpeechService.metrics), or None if the service
+            has not been started
+    """
+    with _service_lock:
+        service = _service
+    return service.metrics() if service is not None else None
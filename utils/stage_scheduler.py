@@ -0,0 +1,250 @@
+"""
+Per-stage admission control for the RALPh request pipeline.
+
+Each pipeline stage (interactive chat turns, report summaries, report delivery) has its
+own concurrency limit and queue cap, and all stages share a pool of worker slots. When
+slots are scarce, waiting work is admitted by stage priority, so chat turns go ahead of
+background reports. Work arriving at a stage whose queue is full is rejected at once
+with StageBusy instead of piling up.
+
+Speech calls are bounded separately by the speech service (see utils/speech_service.py);
+its metrics are included in the scheduler stats.
+"""
+
+import time
+import bisect
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from config import (
+    SCHEDULER_TOTAL_SLOTS,
+    SCHEDULER_CHAT_CONCURRENCY,
+    SCHEDULER_CHAT_MAX_QUEUE,
+    SCHEDULER_CHAT_WAIT_TIMEOUT,
+    SCHEDULER_SUMMARY_CONCURRENCY,
+    SCHEDULER_SUMMARY_MAX_QUEUE,
+    SCHEDULER_REPORT_CONCURRENCY,
+    SCHEDULER_REPORT_MAX_QUEUE
+)
+from utils.metrics import METRICS_WINDOW, percentiles
+from utils.speech_service import speech_metrics
+from models.rate_limiter import rate_limit_priority, get_rate_limiter
+
+
+# Pipeline stages; a lower priority number is admitted first
+STAGE_CHAT = "chat"
+STAGE_SUMMARY = "summary"
+STAGE_REPORT = "report"
+
+
+class StageBusy(Exception):
+    """Raised when work is rejected because its stage queue is full."""
+
+
+class _Stage:
+    """Limits, occupancy and counters of one stage."""
+
+    def __init__(self, name, priority, max_concurrency, max_queue, wait_timeout):
+        self.name = name
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_times = deque(maxlen=METRICS_WINDOW)
+
+
+class StageScheduler:
+    """
+    Admits pipeline work by stage, within per-stage and total concurrency limits.
+    """
+
+    def __init__(self, total_slots=SCHEDULER_TOTAL_SLOTS):
+        """
+        Initialize the scheduler. Stages are added with add_stage.
+
+        Args:
+            total_slots (int): Maximum number of running tasks across all stages
+        """
+        self.total_slots = total_slots
+        self._running = 0
+        self._stages = {}
+
+        # Waiting tickets (priority, sequence, stage), in admission order
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def add_stage(self, name, priority, max_concurrency, max_queue, wait_timeout=None):
+        """
+        Register a pipeline stage.
+
+        Args:
+            name (str): Stage name
+            priority (int): Admission priority (lower goes first)
+            max_concurrency (int): Maximum number of running tasks of the stage
+            max_queue (int): Maximum number of waiting tasks before new ones are rejected
+            wait_timeout (float): Default maximum seconds to wait for a slot (None waits indefinitely)
+        """
+        self._stages[name] = _Stage(name, priority, max_concurrency, max_queue, wait_timeout)
+
+    def _has_capacity(self, stage):
+        """Check whether a task of the stage could start now (lock must be held)."""
+        return self._running < self.total_slots and stage.running < stage.max_concurrency
+
+    def _next_admitted(self):
+        """The first waiting ticket whose stage has capacity (lock must be held)."""
+        for ticket in self._waiters:
+            if self._has_capacity(ticket[2]):
+                return ticket
+        return None
+
+    def _start(self, stage, queued_at):
+        """Account for a task that starts running (lock must be held)."""
+        self._running += 1
+        stage.running += 1
+        stage.admitted += 1
+        stage.wait_times.append(time.perf_counter() - queued_at)
+
+    def acquire(self, name, timeout=None):
+        """
+        Wait for a slot of a stage.
+
+        Args:
+            name (str): Stage name
+            timeout (float): Maximum seconds to wait (defaults to the stage's wait timeout)
+
+        Raises:
+            StageBusy: If the stage queue is full
+            TimeoutError: If no slot became free in time
+        """
+        stage = self._stages[name]
+        timeout = stage.wait_timeout if timeout is None else timeout
+        queued_at = time.perf_counter()
+
+        with self._condition:
+            # Start at once unless higher-priority or earlier work is waiting for the slot
+            ahead = self._next_admitted()
+            if self._has_capacity(stage) and (ahead is None or ahead[0] > stage.priority):
+                self._start(stage, queued_at)
+                return
+
+            if stage.waiting >= stage.max_queue:
+                stage.rejected += 1
+                raise StageBusy(f"{name} stage busy: {stage.waiting} tasks waiting")
+
+            ticket = (stage.priority, next(self._sequence), stage)
+            bisect.insort(self._waiters, ticket, key=lambda t: t[:2])
+            stage.waiting += 1
+            deadline = None if timeout is None else queued_at + timeout
+            try:
+                while self._next_admitted() is not ticket:
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        stage.timed_out += 1
+                        raise TimeoutError(f"Timed out waiting for a {name} slot")
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters.remove(ticket)
+                stage.waiting -= 1
+                # Let the next waiter re-check, whether this one started or gave up
+                self._condition.notify_all()
+
+            self._start(stage, queued_at)
+
+    def release(self, name):
+        """
+        Free a slot of a stage.
+
+        Args:
+            name (str): Stage name
+        """
+        with self._condition:
+            self._running -= 1
+            self._stages[name].running -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, name, timeout=None):
+        """
+        Run a block of work in a slot of a stage. Model calls made in the block are
+        rate limited with the stage's priority.
+
+        Args:
+            name (str): Stage name
+            timeout (float): Maximum seconds to wait (defaults to the stage's wait timeout)
+
+        Raises:
+            StageBusy: If the stage queue is full
+            TimeoutError: If no slot became free in time
+        """
+        self.acquire(name, timeout)
+        try:
+            with rate_limit_priority(self._stages[name].priority):
+                yield
+        finally:
+            self.release(name)
+
+    def stats(self):
+        """
+        Live queue depth, occupancy and queue wait percentiles per stage.
+
+        Returns:
+            dict: Total occupancy, per-stage stats, speech service metrics and rate limit budgets
+        """
+        with self._condition:
+            result = {"running": self._running, "total_slots": self.total_slots, "stages": {}}
+            for stage in self._stages.values():
+                entry = {
+                    "priority": stage.priority,
+                    "running": stage.running,
+                    "waiting": stage.waiting,
+                    "max_concurrency": stage.max_concurrency,
+                    "max_queue": stage.max_queue,
+                    "admitted": stage.admitted,
+                    "rejected": stage.rejected,
+                    "timed_out": stage.timed_out,
+                }
+                if stage.wait_times:
+                    entry["queue_wait"] = percentiles(stage.wait_times)
+                result["stages"][stage.name] = entry
+
+        # Only report speech metrics if the speech service has been started
+        speech = speech_metrics()
+        if speech is not None:
+            result["speech"] = speech
+
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            result["rate_limits"] = limiter.stats()
+        return result
+
+
+# Shared scheduler, created on first use
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Get the shared scheduler with the RALPh pipeline stages.
+
+    Returns:
+        StageScheduler: The process-wide scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = StageScheduler()
+            _scheduler.add_stage(STAGE_CHAT, 0, SCHEDULER_CHAT_CONCURRENCY, SCHEDULER_CHAT_MAX_QUEUE,
+                                 SCHEDULER_CHAT_WAIT_TIMEOUT)
+            _scheduler.add_stage(STAGE_REPORT, 1, SCHEDULER_REPORT_CONCURRENCY, SCHEDULER_REPORT_MAX_QUEUE)
+            _scheduler.add_stage(STAGE_SUMMARY, 2, SCHEDULER_SUMMARY_CONCURRENCY, SCHEDULER_SUMMARY_MAX_QUEUE)
+        return _scheduler
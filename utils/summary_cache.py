@@ -0,0 +1,216 @@
+"""
+Cached, incremental conversation summaries for RALPh PDF reports.
+
+Summaries are cached by a hash of the prescription and the message history. When the
+history has grown since a cached summary, only the new messages are summarized on top
+of it. Summaries can be precomputed in the background after each turn, so that a
+report request usually finds its summary ready.
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+
+from chat.prompts import SYSTEM_PROMPT_SUMMARIZE, SYSTEM_PROMPT_SUMMARIZE_UPDATE
+from config import REPORT_SUMMARY_CACHE_SIZE
+from utils.stage_scheduler import get_scheduler, STAGE_SUMMARY
+from utils.usage import message_usage, usage_record
+
+
+def message_lines(chat_memory):
+    """
+    Serialize the chat history for summarization and hashing.
+
+    Args:
+        chat_memory: Chat memory from the chat system
+
+    Returns:
+        list: One "role: content" string per message
+    """
+    return [f"{message.type}: {message.content}" for message in chat_memory.messages]
+
+
+def prefix_keys(lines, prescription_details):
+    """
+    Chained hashes of the prescription and each prefix of the message history.
+
+    Args:
+        lines (list): Serialized messages
+        prescription_details (str): Prescription details
+
+    Returns:
+        list: keys[n] identifies the prescription plus the first n messages
+    """
+    digest = hashlib.sha256(prescription_details.encode("utf-8"))
+    keys = [digest.hexdigest()]
+    for line in lines:
+        digest = hashlib.sha256((keys[-1] + "\0" + line).encode("utf-8"))
+        keys.append(digest.hexdigest())
+    return keys
+
+
+class ReportSummaryCache:
+    """
+    LRU cache of report summaries with incremental updates and background precompute.
+    """
+
+    def __init__(self, summaryllm, max_entries=REPORT_SUMMARY_CACHE_SIZE, logger=None):
+        """
+        Initialize the cache.
+
+        Args:
+            summaryllm: LLM for summarization
+            max_entries (int): Number of summaries kept
+            logger (ChatSystemLogger): Logger for the token usage of summary calls (None to not log it)
+        """
+        self.summaryllm = summaryllm
+        self.max_entries = max_entries
+        self.logger = logger
+
+        self.hits = 0
+        self.incremental_updates = 0
+        self.full_summaries = 0
+
+        # key -> summary, least recently used first
+        self._summaries = OrderedDict()
+        # key -> Future of a summary being computed
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+    def _summarize_full(self, lines, prescription_details):
+        """Summarize the whole conversation (returns the model response)."""
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT_SUMMARIZE),
+            HumanMessagePromptTemplate.from_template("{content_to_summarize}")
+        ])
+        content = "\n".join(lines) + "\n\n#PRESCRIPTION DETAILS:" + prescription_details
+        return self.summaryllm(prompt.format_messages(content_to_summarize=content))
+
+    def _summarize_update(self, summary, new_lines):
+        """Update a summary with the messages added since it was made (returns the model response)."""
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT_SUMMARIZE_UPDATE),
+            HumanMessagePromptTemplate.from_template("#CURRENT REPORT:\n{summary}\n\n#NEW MESSAGES:\n{new_messages}")
+        ])
+        messages = prompt.format_messages(summary=summary, new_messages="\n".join(new_lines))
+        return self.summaryllm(messages)
+
+    def _store(self, key, summary):
+        """Cache a summary (lock must be held)."""
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+
+    def _log_usage(self, logger, convo_number, stage, response, start_time):
+        """Record the token usage of a summary call for the conversation it was made for."""
+        logger = logger or self.logger
+        if logger is None:
+            return
+        model_name = getattr(self.summaryllm, "model_name", None)
+        logger.log_event(
+            "llm_usage",
+            convo_number=convo_number,
+            stage=stage,
+            model=model_name,
+            duration=round(time.time() - start_time, 3),
+            **usage_record(model_name, message_usage(response))
+        )
+
+    def _compute(self, lines, prescription_details, keys, logger=None, convo_number=None):
+        """Summarize from the longest cached prefix, or from scratch."""
+        with self._lock:
+            base = next(
+                (n for n in range(len(lines) - 1, 0, -1) if keys[n] in self._summaries),
+                None
+            )
+            base_summary = self._summaries.get(keys[base]) if base else None
+
+        with get_scheduler().slot(STAGE_SUMMARY):
+            start_time = time.time()
+            if base_summary is not None:
+                response = self._summarize_update(base_summary, lines[base:])
+                stage = "report_summary_update"
+                self.incremental_updates += 1
+            else:
+                response = self._summarize_full(lines, prescription_details)
+                stage = "report_summary"
+                self.full_summaries += 1
+        summary = response.content
+        self._log_usage(logger, convo_number, stage, response, start_time)
+
+        with self._lock:
+            self._store(keys[-1], summary)
+        return summary
+
+    def _submit(self, lines, prescription_details, background, logger=None, convo_number=None):
+        """Get the future of a summary, starting its computation unless cached or in flight."""
+        keys = prefix_keys(lines, prescription_details)
+        key = keys[-1]
+        with self._lock:
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(self._summaries[key])
+                return future, "hit"
+            if key in self._inflight:
+                return self._inflight[key], "inflight"
+
+            if background:
+                future = self._executor.submit(self._compute, lines, prescription_details, keys, logger, convo_number)
+            else:
+                future = Future()
+            self._inflight[key] = future
+
+        if not background:
+            try:
+                future.set_result(self._compute(lines, prescription_details, keys, logger, convo_number))
+            except Exception as e:
+                future.set_exception(e)
+
+        future.add_done_callback(lambda _: self._forget_inflight(key))
+        return future, "computed"
+
+    def _forget_inflight(self, key):
+        """Remove a finished computation from the in-flight table."""
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def summarize(self, lines, prescription_details):
+        """
+        Get the summary of a conversation, computing it if needed.
+
+        Args:
+            lines (list): Serialized messages (see message_lines)
+            prescription_details (str): Prescription details
+
+        Returns:
+            tuple: (summary, stats) with the cache outcome ("hit", "inflight" or "computed")
+                and the seconds spent waiting
+
+        Raises:
+            Exception: If summarization fails
+        """
+        start_time = time.perf_counter()
+        future, outcome = self._submit(lines, prescription_details, background=False)
+        summary = future.result()
+        return summary, {"summary_cache": outcome, "summary_seconds": round(time.perf_counter() - start_time, 3)}
+
+    def precompute(self, lines, prescription_details, logger=None, convo_number=None):
+        """
+        Start summarizing a conversation in the background.
+
+        Args:
+            lines (list): Serialized messages (see message_lines)
+            prescription_details (str): Prescription details
+            logger (ChatSystemLogger): Logger of the conversation (defaults to the cache's logger)
+            convo_number (int): Conversation number, recorded with the token usage
+        """
+        if lines:
+            self._submit(lines, prescription_details, background=True, logger=logger, convo_number=convo_number)
@@ -0,0 +1,82 @@
+# Token counting helpers for RALPh.
+
+from functools import lru_cache
+
+
+# Rough characters-per-token ratio used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model_name):
+    """
+    Load (and cache) the tiktoken encoding for a model.
+
+    Args:
+        model_name (str): OpenAI model name
+
+    Returns:
+        Encoding or None if tiktoken is not installed or the encoding cannot be loaded
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    # Loading an encoding may download its BPE file; on any failure, estimate token
+    # counts instead (None is cached, so the download is not retried on every call)
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"tiktoken encoding for {model_name} unavailable, estimating token counts: {e!r}")
+        return None
+
+
+def count_tokens(text, model_name="gpt-4o"):
+    """
+    Count (or estimate) the number of tokens in a piece of text.
+
+    Args:
+        text (str): Text to count
+        model_name (str): Model whose tokenizer should be used
+
+    Returns:
+        int: Number of tokens
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return max(1, len(text) // CHARS_PER_TOKEN)
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def trim_history(messages, budget, model_name="gpt-4o"):
+    """
+    Drop the oldest chat history messages until the rest fits a token budget.
+
+    Args:
+        messages (list): Chat history messages, oldest first
+        budget (int): Maximum tokens of the kept messages (None for no limit)
+        model_name (str): Model whose tokenizer should be used
+
+    Returns:
+        tuple: (kept messages, number of messages dropped)
+    """
+    if budget is None:
+        return list(messages), 0
+
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        used += count_tokens(str(message.content), model_name)
+        if used > budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept, len(messages) - len(kept)
@@ -0,0 +1,213 @@
+"""
+Content-addressed cache of synthesized speech for RALPh.
+
+Audio is stored as one file per (text, voice, model, output format) key, so repeated
+phrases are synthesized only once. The cache is kept under a disk quota by evicting the
+least recently used entries, and entries not used within the TTL are removed.
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_CACHE_TTL_SECONDS
+
+
+# Seconds between two TTL sweeps triggered by writes
+CLEANUP_INTERVAL = 600
+
+
+def cache_key(text, voice_id, model_id, output_format):
+    """
+    Build the content address of a synthesis request.
+
+    Args:
+        text (str): Text to synthesize
+        voice_id (str): ElevenLabs voice ID
+        model_id (str): ElevenLabs model ID
+        output_format (str): ElevenLabs output format
+
+    Returns:
+        str: Hex digest identifying the audio
+    """
+    digest = hashlib.sha256()
+    for part in (voice_id, model_id, output_format, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTSCache:
+    """
+    Disk cache of synthesized audio with LRU eviction and TTL cleanup.
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES, ttl_seconds=TTS_CACHE_TTL_SECONDS):
+        """
+        Initialize the cache from the files already on disk.
+
+        Args:
+            cache_dir (str): Directory of the cached audio files
+            max_bytes (int): Disk quota of the cache
+            ttl_seconds (float): Entries not used for this long are removed (0 disables)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (size, last access time), least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._last_cleanup = 0.0
+        self._lock = threading.Lock()
+
+        self._load()
+        self.cleanup()
+
+    def _path(self, key):
+        """Path of the audio file of a key."""
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _load(self):
+        """Index the cached files, using the modification time as last access time."""
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                # Leftover of an interrupted write
+                os.remove(path)
+                continue
+            if not name.endswith(".mp3"):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(".mp3")], stat.st_size))
+
+        for mtime, key, size in sorted(entries):
+            self._entries[key] = (size, mtime)
+            self._total_bytes += size
+
+    def _remove(self, key):
+        """Remove an entry and its file (lock must be held)."""
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """
+        Look up cached audio.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            tuple: (audio_bytes, file_path), or None on a miss
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    audio_data = f.read()
+            except FileNotFoundError:
+                # Removed behind our back
+                self._entries.pop(key)
+                self.misses += 1
+                return None
+
+            # Mark as most recently used, on disk as well so the order survives restarts
+            now = time.time()
+            self._entries[key] = (self._entries[key][0], now)
+            self._entries.move_to_end(key)
+            os.utime(path, (now, now))
+
+            self.hits += 1
+            return audio_data, path
+
+    def put(self, key, audio_data):
+        """
+        Store audio, evicting least recently used entries to stay under the quota.
+
+        Args:
+            key (str): Cache key
+            audio_data (bytes): Audio to store
+
+        Returns:
+            str: Path of the cached file
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+
+        # Write to a uniquely named file first so concurrent writers never see partial audio
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(audio_data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][0]
+            self._entries[key] = (len(audio_data), time.time())
+            self._entries.move_to_end(key)
+            self._total_bytes += len(audio_data)
+
+            # Evict least recently used entries, never the one just written
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+        if time.monotonic() - self._last_cleanup >= CLEANUP_INTERVAL:
+            self.cleanup()
+
+        return path
+
+    def cleanup(self):
+        """
+        Remove entries that were not used within the TTL.
+
+        Returns:
+            int: Number of removed entries
+        """
+        self._last_cleanup = time.monotonic()
+        if not self.ttl_seconds:
+            return 0
+
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        with self._lock:
+            # Entries are ordered by last access, so expired ones come first
+            while self._entries:
+                key = next(iter(self._entries))
+                if self._entries[key][1] >= cutoff:
+                    break
+                self._remove(key)
+                removed += 1
+        return removed
+
+    def stats(self):
+        """
+        Cache usage statistics.
+
+        Returns:
+            dict: Entry count, size in bytes, hits and misses
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
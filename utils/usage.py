@@ -0,0 +1,102 @@
+# Token usage and cost accounting for RALPh.
+
+# USD per million (prompt, completion) tokens; dated model versions match by prefix
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "o3-mini": (1.10, 4.40),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+
+
+def empty_usage():
+    """
+    Zero usage totals.
+
+    Returns:
+        dict: {"prompt_tokens", "completion_tokens", "cost_usd"}
+    """
+    return {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+
+
+def message_usage(message):
+    """
+    Get the token usage reported with a model response.
+
+    Args:
+        message: AIMessage or AIMessageChunk
+
+    Returns:
+        dict: {"prompt_tokens", "completion_tokens"}, or None if no usage was reported
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)}
+
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        return {
+            "prompt_tokens": token_usage.get("prompt_tokens", 0),
+            "completion_tokens": token_usage.get("completion_tokens", 0)
+        }
+    return None
+
+
+def add_usage(total, usage):
+    """
+    Add usage to a running total.
+
+    Args:
+        total (dict): Running total (None to start one)
+        usage (dict): Usage to add (None adds nothing)
+
+    Returns:
+        dict: The total, or None if both are None
+    """
+    if usage is None:
+        return total
+    if total is None:
+        total = {key: 0 for key in usage}
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
+def usage_cost(model_name, usage):
+    """
+    Estimate the cost of a model call.
+
+    Args:
+        model_name (str): Model name
+        usage (dict): {"prompt_tokens", "completion_tokens"}
+
+    Returns:
+        float: Cost in USD, or None if the model has no known price
+    """
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model_name and model_name.startswith(prefix):
+            prompt_price, completion_price = MODEL_PRICES[prefix]
+            return round(
+                (usage["prompt_tokens"] * prompt_price + usage["completion_tokens"] * completion_price) / 1_000_000, 6
+            )
+    return None
+
+
+def usage_record(model_name, usage):
+    """
+    Build the usage fields of a stage record.
+
+    Args:
+        model_name (str): Model name
+        usage (dict): {"prompt_tokens", "completion_tokens"} (None if not reported)
+
+    Returns:
+        dict: prompt_tokens, completion_tokens and cost_usd (empty if usage is None)
+    """
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "cost_usd": usage_cost(model_name, usage),
+    }
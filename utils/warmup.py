@@ -0,0 +1,188 @@
+"""
+Start-up warm-up for RALPh.
+
+Pays the one-off costs of the first request before the app reports ready: opening the
+connection pools to OpenAI, IRIS and the SMTP server, the first embedding call, loading
+the tokenizer and parsing the PDF font. Independent steps run in parallel; after the
+deadline the app reports ready even if some steps have not finished.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from config import (
+    WARMUP_DEADLINE,
+    WARMUP_LLM_PING,
+    VOICE_ENABLED,
+    REPORTS_ENABLED,
+    EMAIL_SENDER
+)
+
+
+class WarmupOrchestrator:
+    """
+    Runs warm-up steps in parallel with an overall deadline and tracks readiness.
+    """
+
+    def __init__(self, deadline=WARMUP_DEADLINE):
+        """
+        Initialize the orchestrator. Steps are added with add_step.
+
+        Args:
+            deadline (float): Seconds after which the app is ready regardless of unfinished steps
+        """
+        self.deadline = deadline
+        self._steps = {}
+        self._started_at = None
+        self._finished_at = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def add_step(self, name, func):
+        """
+        Register a warm-up step.
+
+        Args:
+            name (str): Step name
+            func (callable): Function to run (no arguments)
+        """
+        self._steps[name] = {"func": func, "status": "pending", "duration": None, "error": None}
+
+    def _run_step(self, name):
+        """Run one step and record its outcome."""
+        step = self._steps[name]
+        with self._lock:
+            step["status"] = "running"
+        start_time = time.perf_counter()
+        try:
+            step["func"]()
+            status, error = "ok", None
+        except Exception as e:
+            status, error = "failed", repr(e)
+        with self._lock:
+            step["status"] = status
+            step["duration"] = round(time.perf_counter() - start_time, 3)
+            step["error"] = error
+
+    def _run(self):
+        """Run all steps and wait for them until the deadline."""
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self._steps)), thread_name_prefix="warmup")
+        futures = [executor.submit(self._run_step, name) for name in self._steps]
+        deadline = self._started_at + self.deadline
+        for future in futures:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                future.result(timeout=remaining)
+            except FutureTimeoutError:
+                break
+        # Steps still running keep going in the background, but no longer hold up readiness
+        executor.shutdown(wait=False)
+
+        with self._lock:
+            self._finished_at = time.perf_counter()
+        self._done.set()
+
+    def start(self):
+        """
+        Start the warm-up in the background.
+
+        Returns:
+            WarmupOrchestrator: self
+        """
+        self._started_at = time.perf_counter()
+        threading.Thread(target=self._run, name="Warmup", daemon=True).start()
+        return self
+
+    def wait(self):
+        """
+        Wait until the warm-up has finished or the deadline has passed.
+
+        Returns:
+            dict: Readiness status (see status)
+        """
+        self._done.wait()
+        return self.status()
+
+    @property
+    def ready(self):
+        """Whether the app should accept traffic."""
+        return self._done.is_set()
+
+    def status(self):
+        """
+        Readiness status for the readiness probe.
+
+        "warm" is True once every step succeeded, i.e. first requests are expected to be as
+        fast as steady-state ones; "ready" is also True after the deadline or failed steps.
+
+        Returns:
+            dict: ready, warm, elapsed seconds and per-step status, duration and error
+        """
+        with self._lock:
+            steps = {
+                name: {key: step[key] for key in ("status", "duration", "error")}
+                for name, step in self._steps.items()
+            }
+            end = self._finished_at or time.perf_counter()
+            elapsed = round(end - self._started_at, 3) if self._started_at else 0.0
+        return {
+            "ready": self.ready,
+            "warm": all(step["status"] == "ok" for step in steps.values()),
+            "elapsed": elapsed,
+            "steps": steps,
+        }
+
+
+def create_warmup(chat_system):
+    """
+    Create the warm-up for the configured features.
+
+    Args:
+        chat_system (ChatSystem): Chat system whose models and knowledge base are warmed up
+
+    Returns:
+        WarmupOrchestrator: Warm-up with its steps registered (not started)
+    """
+    warmup = WarmupOrchestrator()
+    knowledge_base = chat_system.knowledge_base
+
+    if WARMUP_LLM_PING:
+        # Open the HTTPS connection pool of each chat model with a 1-token request
+        for stage, llm in (("chat_model", chat_system.chatllm), ("counselling_model", chat_system.chatllm_large)):
+            warmup.add_step(stage, lambda llm=llm: llm.bind(max_tokens=1).invoke("Hi"))
+
+    # Connect to IRIS and exercise the embedding, search and context compression path.
+    # Queries are not pre-embedded: searches embed the patient's message together with
+    # the pre-KB model output, which cannot be known ahead of time
+    warmup.add_step("kb_probe_search", lambda: knowledge_base.search("paracetamol side effects", 1))
+
+    # Load the tokenizer used for context budgets
+    def load_tokenizer():
+        from utils.tokens import count_tokens
+        count_tokens("warm up")
+    warmup.add_step("tokenizer", load_tokenizer)
+
+    if REPORTS_ENABLED:
+        def prebuild_pdf_template():
+            from utils.pdf_generator import prebuild_report_template
+            prebuild_report_template()
+        warmup.add_step("pdf_template", prebuild_pdf_template)
+
+        if EMAIL_SENDER:
+            def open_smtp_connection():
+                from utils.email_sender import get_smtp_pool
+                with get_smtp_pool().connection():
+                    pass
+            warmup.add_step("smtp_connection", open_smtp_connection)
+
+    if VOICE_ENABLED:
+        def init_speech():
+            from utils.speech import get_client, get_tts_cache
+            get_client()
+            get_tts_cache()
+        warmup.add_step("speech_client", init_speech)
+
+    return warmup